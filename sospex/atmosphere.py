@@ -0,0 +1,151 @@
+import numpy as np
+
+
+def shiftOperator(x, xr, atran=None):
+    """
+    Sparse operator equivalent to np.interp(x, xr, y / atran) for each spectrum y.
+    Arguments:
+        x      wavelength grid of the output spectra
+        xr     wavelengths of the input spectra (increasing)
+        atran  atmospheric transmission on the input grid (scalar, array or None)
+    Each row has at most two non-zero weights, so the NaN values of the input
+    propagate only to the interpolated values which use them, as in np.interp.
+    """
+    from scipy.sparse import csr_matrix
+    x = np.asarray(x, dtype=float)
+    xr = np.asarray(xr, dtype=float)
+    n = len(xr)
+    i1 = np.clip(np.searchsorted(xr, x, side='right'), 1, n - 1)
+    i0 = i1 - 1
+    w1 = (x - xr[i0]) / (xr[i1] - xr[i0])
+    # Constant values outside the input grid
+    w1 = np.clip(w1, 0., 1.)
+    w0 = 1. - w1
+    rows = np.repeat(np.arange(len(x)), 2)
+    cols = np.c_[i0, i1].ravel()
+    weights = np.c_[w0, w1].ravel()
+    keep = weights > 0
+    operator = csr_matrix((weights[keep], (rows[keep], cols[keep])), shape=(len(x), n))
+    if atran is not None:
+        # Divide by the transmission before interpolating
+        from scipy.sparse import diags
+        atran = np.broadcast_to(np.asarray(atran, dtype=float), (n,))
+        operator = operator @ diags(1. / atran)
+        operator = csr_matrix(operator)
+    return operator
+
+
+def applyOperator(operator, cube, out=None, chunksize=64 * 1024 * 1024):
+    """
+    Apply a spectral operator to all the spectra of a cube, a few rows at a time
+    to limit the memory used by temporary arrays.
+    """
+    nz, ny, nx = np.shape(cube)
+    if out is None:
+        out = np.empty((operator.shape[0], ny, nx), dtype=np.result_type(cube, np.float32))
+    nrows = max(1, chunksize // max(1, nz * nx * 8))
+    for j0 in range(0, ny, nrows):
+        j1 = min(ny, j0 + nrows)
+        block = np.asarray(cube[:, j0:j1, :], dtype=np.float64).reshape(nz, -1)
+        out[:, j0:j1, :] = (operator @ block).reshape(-1, j1 - j0, nx)
+    return out
+
+
+def atmosphericDepth(za):
+    """
+    Depth of the atmosphere above the aircraft in units of the depth at zenith,
+    taking into account the Earth curvature.
+    """
+    angle = za * np.pi / 180.
+    a = 6371 + 12.5  # Earth radius + altitude (~12.5 km)
+    c = 38           # Rest of stratosphere (~ 38 km)
+    b = a + c
+    alpha = np.arcsin(a / b * np.sin(angle))  # From law of sinus
+    dx = np.sqrt(a * a + b * b - 2 * a * b * np.cos(angle - alpha))  # From law of cosinus
+    return dx / c
+
+
+class AtranModel(object):
+    """
+    Grid of ATRAN transmissions as a function of altitude and zenithal water vapor.
+    The grid is read once from the compressed FITS file and kept as uncompressed
+    numpy files in a cache directory, which are then memory-mapped.
+    Transmissions are linearly interpolated in altitude and water vapor.
+    """
+    def __init__(self, filename, cachedir=None):
+        import os
+        import tempfile
+        self.filename = filename
+        if cachedir is None:
+            cachedir = os.path.join(tempfile.gettempdir(), 'sospex-atran')
+        base = os.path.join(cachedir, os.path.basename(filename).split('.')[0])
+        names = ['WAVELENGTH', 'ATRAN', 'ALTITUDE', 'WVZ']
+        files = [base + '_' + name + '.npy' for name in names]
+        mtime = os.path.getmtime(filename)
+        if not all(os.path.exists(f) and os.path.getmtime(f) >= mtime for f in files):
+            from astropy.io import fits
+            os.makedirs(cachedir, exist_ok=True)
+            with fits.open(filename) as hdl:
+                for name, f in zip(names, files):
+                    # Write aside and rename, so that another session never maps a partial file
+                    tmpfile = f + '.{:d}.part'.format(os.getpid())
+                    with open(tmpfile, 'wb') as out:
+                        np.save(out, np.asarray(hdl[name].data, dtype=np.float64))
+                    os.replace(tmpfile, f)
+        self.wave = np.load(files[0])
+        self.atran = np.load(files[1], mmap_mode='r')
+        self.altitudes = np.load(files[2])
+        self.wvzs = np.load(files[3])
+        self.grids = {}
+
+    def weights(self, values, value):
+        """Indices and weights of the linear interpolation on a grid (clipped at the borders)."""
+        if len(values) == 1:
+            return 0, 0, 1.
+        order = np.argsort(values)
+        v = values[order]
+        value = np.clip(value, v[0], v[-1])
+        i1 = int(np.clip(np.searchsorted(v, value, side='right'), 1, len(v) - 1))
+        i0 = i1 - 1
+        w0 = (v[i1] - value) / (v[i1] - v[i0])
+        return order[i0], order[i1], w0
+
+    def resampled(self, wave):
+        """Grid of transmissions resampled on a wavelength grid (computed once)."""
+        key = (len(wave), float(wave[0]), float(wave[-1]))
+        if key not in self.grids:
+            na, nw, nt = np.shape(self.atran)
+            grid = np.empty((na, nw, len(wave)))
+            for i in range(na):
+                for j in range(nw):
+                    grid[i, j] = np.interp(wave, self.wave, self.atran[i, j])
+            self.grids[key] = grid
+        return self.grids[key]
+
+    def transmission(self, altitude, wvz, za, wave=None):
+        """
+        Transmission for an altitude (feet), a zenithal water vapor (microns) and
+        a zenith angle (degrees), on the wavelengths of the model or on wave.
+        """
+        grid = self.atran if wave is None else self.resampled(wave)
+        a0, a1, wa = self.weights(self.altitudes, altitude)
+        v0, v1, wv = self.weights(self.wvzs, wvz)
+        at = (wa * (wv * grid[a0, v0] + (1 - wv) * grid[a0, v1])
+              + (1 - wa) * (wv * grid[a1, v0] + (1 - wv) * grid[a1, v1]))
+        return at ** atmosphericDepth(za)
+
+
+_models = {}
+
+def atranModel(detchan, order):
+    """Return the ATRAN model of a FIFI-LS channel (read only once)."""
+    import os
+    if detchan == 'BLUE':
+        file = 'AtranBlue' + str(order) + '.fits.gz'
+    else:
+        file = 'AtranRed.fits.gz'
+    path0, file0 = os.path.split(__file__)
+    filename = os.path.join(path0, 'data', file)
+    if filename not in _models:
+        _models[filename] = AtranModel(filename)
+    return _models[filename]
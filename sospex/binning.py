@@ -0,0 +1,332 @@
+import numpy as np
+
+
+def channelNoise(flux, chunksize=64 * 1024 * 1024):
+    """
+    Noise of each channel of the spectra of a cube estimated, as for the moments,
+    from the median absolute deviation of the differences between consecutive channels.
+    """
+    import warnings
+    nz, ny, nx = np.shape(flux)
+    noise = np.empty((ny, nx))
+    nrows = max(1, chunksize // max(1, nz * nx * 8))
+    with warnings.catch_warnings():
+        # Spaxels without data have an undefined noise
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for j0 in range(0, ny, nrows):
+            j1 = min(ny, j0 + nrows)
+            df = np.diff(np.asarray(flux[:, j0:j1, :], dtype=float), axis=0)
+            med = np.nanmedian(df, axis=0)
+            # Divide by sqrt(2.) since the difference of two values
+            noise[j0:j1, :] = np.nanmedian(np.abs(df - med), axis=0) / np.sqrt(2.) * 1.4826
+    return noise
+
+
+def signalNoiseMaps(flux, eflux=None):
+    """
+    Mean signal of the spectra and its noise. The noise of the channels is
+    taken from the error cube, if available, or estimated from the spectra.
+    """
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        n = np.sum(np.isfinite(flux), axis=0)
+        signal = np.nanmean(flux, axis=0)
+        if eflux is not None:
+            sigma = np.sqrt(np.nanmean(np.asarray(eflux, dtype=float)**2, axis=0))
+        else:
+            sigma = channelNoise(flux)
+        return signal, sigma / np.sqrt(np.maximum(n, 1))
+
+
+class VoronoiBinning(object):
+    """
+    Adaptive binning of an image to reach a target signal-to-noise ratio, following
+    Cappellari & Copin 2003 (MNRAS 342, 345).
+    Arguments:
+        signal, noise  maps of signal and noise
+        target         signal-to-noise ratio of the bins
+        mask           pixels to bin (by default, those with finite signal and positive noise)
+    Pixels are accreted into compact bins until the target is reached; then the
+    generators are moved to the centroids of their Voronoi cells (weighted by S/N squared).
+    The bins are the Voronoi cells of the sites, as the regions of the Voronoi interactor.
+    """
+    def __init__(self, signal, noise, target, mask=None, roundness=0.3, niter=20):
+        self.signal = np.asarray(signal, dtype=float)
+        self.noise = np.asarray(noise, dtype=float)
+        self.target = target
+        if mask is None:
+            mask = np.isfinite(self.signal) & np.isfinite(self.noise) & (self.noise > 0)
+        self.mask = mask
+        ny, nx = self.signal.shape
+        yy, xx = np.nonzero(mask)
+        self.xy = np.c_[xx, yy].astype(float)
+        self.s = self.signal[yy, xx]
+        self.n2 = self.noise[yy, xx]**2
+        self.shape = (ny, nx)
+        self.index = np.full((ny, nx), -1)
+        self.index[yy, xx] = np.arange(len(yy))
+        if len(yy) == 0:
+            self.sites = np.empty((0, 2))
+        else:
+            labels = self.accrete(roundness)
+            self.sites = self.regularize(labels, niter)
+
+    def neighbours(self, k):
+        """Indices of the pixels adjacent to the pixel k."""
+        ny, nx = self.shape
+        x, y = self.xy[k].astype(int)
+        near = []
+        for i, j in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if 0 <= i < nx and 0 <= j < ny and self.index[j, i] >= 0:
+                near.append(self.index[j, i])
+        return near
+
+    def accrete(self, roundness):
+        """Accretion of pixels into bins (label -1 for pixels in failed bins)."""
+        npix = len(self.s)
+        labels = np.full(npix, -2)      # -2: not yet binned
+        sn = self.s / np.sqrt(self.n2)
+        current = int(np.nanargmax(sn))
+        nbin = 0
+        while current is not None:
+            members = [current]
+            labels[current] = nbin
+            frontier = set(self.neighbours(current))
+            frontier = {k for k in frontier if labels[k] == -2}
+            ssum = self.s[current]
+            n2sum = self.n2[current]
+            centroid = self.xy[current].copy()
+            snr = ssum / np.sqrt(n2sum)
+            while snr < self.target and len(frontier) > 0:
+                candidates = np.fromiter(frontier, dtype=int)
+                d = np.hypot(*(self.xy[candidates] - centroid).T)
+                k = candidates[np.argmin(d)]
+                # Test the compactness and the improvement of S/N of the new bin
+                new = members + [k]
+                c = np.mean(self.xy[new], axis=0)
+                rmax = np.max(np.hypot(*(self.xy[new] - c).T))
+                r = rmax / np.sqrt(len(new) / np.pi) - 1.
+                newsnr = (ssum + self.s[k]) / np.sqrt(n2sum + self.n2[k])
+                if (r > roundness) or (newsnr < snr):
+                    break
+                members = new
+                labels[k] = nbin
+                ssum += self.s[k]
+                n2sum += self.n2[k]
+                centroid = c
+                snr = newsnr
+                frontier.discard(k)
+                frontier.update(j for j in self.neighbours(k) if labels[j] == -2)
+            if snr >= 0.8 * self.target:
+                nbin += 1
+            else:
+                labels[members] = -1
+            # Next bin starts from the free pixel closest to the centroid of the binned pixels
+            free = np.nonzero(labels == -2)[0]
+            if len(free) == 0:
+                current = None
+            else:
+                binned = labels >= 0
+                if np.any(binned):
+                    c = np.mean(self.xy[binned], axis=0)
+                    current = free[np.argmin(np.hypot(*(self.xy[free] - c).T))]
+                else:
+                    current = free[np.argmax(sn[free])]
+        if nbin == 0:
+            # Target not reachable: a single bin
+            return np.zeros(npix, dtype=int)
+        return labels
+
+    def regularize(self, labels, niter):
+        """Move the generators to the weighted centroids of their Voronoi cells."""
+        from scipy.spatial import cKDTree
+        nbins = np.max(labels) + 1
+        w = np.clip(self.s, 0, None)**2 / self.n2
+        if np.sum(w) <= 0:
+            w = np.ones_like(w)
+        good = labels >= 0
+        sites = self.centroids(labels[good], self.xy[good], w[good], nbins)
+        for it in range(niter):
+            labels = cKDTree(sites).query(self.xy)[1]
+            new = self.centroids(labels, self.xy, w, nbins, sites)
+            if np.allclose(new, sites, atol=1.e-3):
+                break
+            sites = new
+        return sites
+
+    def centroids(self, labels, xy, w, nbins, default=None):
+        wsum = np.bincount(labels, weights=w, minlength=nbins)
+        xs = np.bincount(labels, weights=w * xy[:, 0], minlength=nbins)
+        ys = np.bincount(labels, weights=w * xy[:, 1], minlength=nbins)
+        n = np.bincount(labels, minlength=nbins)
+        # Geometric centroid for bins without positive signal
+        xg = np.bincount(labels, weights=xy[:, 0], minlength=nbins) / np.maximum(n, 1)
+        yg = np.bincount(labels, weights=xy[:, 1], minlength=nbins) / np.maximum(n, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sites = np.where((wsum > 0)[:, None], np.c_[xs / wsum, ys / wsum], np.c_[xg, yg])
+        if default is not None:
+            # Empty cells keep their site
+            sites[n == 0] = default[n == 0]
+        return sites
+
+    def regions(self):
+        """Map of the bin of each pixel (-1 outside the mask)."""
+        from scipy.spatial import cKDTree
+        regions = np.full(self.shape, -1)
+        if len(self.sites) > 0:
+            yy, xx = np.nonzero(self.mask)
+            regions[yy, xx] = cKDTree(self.sites).query(np.c_[xx, yy])[1]
+        return regions
+
+
+class CellSpectra(object):
+    """
+    Spectra of the cells of a tessellation: sum, number, mean, variance, and median
+    of the finite values of the pixels in each cell.
+    Arguments:
+        cube     spectral cube (nz, ny, nx)
+        labels   map with the cell of each pixel (negative if not in a cell)
+        mask     pixels to ignore (True if masked)
+        subtract cube subtracted from the spectra (e.g. the continuum)
+    The pixels are sorted by cell, so each reduction is done over contiguous segments
+    for all the cells at once, a few channels at a time. The median is computed when needed.
+    """
+    def __init__(self, cube, labels, mask=None, subtract=None, chunksize=64 * 1024 * 1024):
+        self.cube = cube
+        self.labels = labels
+        self.subtract = subtract
+        self.chunksize = chunksize
+        flat = np.asarray(labels).reshape(-1)
+        valid = flat >= 0
+        if mask is not None:
+            valid &= ~np.asarray(mask, dtype=bool).reshape(-1)
+        pixels = np.flatnonzero(valid)
+        order = np.argsort(flat[pixels], kind='stable')
+        self.pixels = pixels[order]
+        sortedlabels = flat[self.pixels]
+        self.ncells = int(np.max(flat)) + 1 if flat.size > 0 else 0
+        self.npix = np.bincount(sortedlabels, minlength=self.ncells)
+        # Cells with pixels and start of their segments
+        self.cells = np.flatnonzero(self.npix)
+        self.starts = np.searchsorted(sortedlabels, self.cells)
+        self.segment = np.repeat(np.arange(len(self.cells)), self.npix[self.cells])
+        self._median = None
+        self.reduce()
+
+    def blocks(self):
+        """Spectra of the sorted pixels, a few channels at a time."""
+        nz = np.shape(self.cube)[0]
+        nchan = max(1, self.chunksize // max(1, len(self.pixels) * 8))
+        for z0 in range(0, nz, nchan):
+            z1 = min(nz, z0 + nchan)
+            block = np.asarray(self.cube[z0:z1], dtype=float).reshape(z1 - z0, -1)[:, self.pixels]
+            if self.subtract is not None:
+                block = block - np.asarray(self.subtract[z0:z1]).reshape(z1 - z0, -1)[:, self.pixels]
+            yield z0, z1, block
+
+    def reduce(self):
+        nz = np.shape(self.cube)[0]
+        shape = (nz, self.ncells)
+        self.sum = np.zeros(shape)
+        self.count = np.zeros(shape, dtype=int)
+        self.mean = np.full(shape, np.nan)
+        self.variance = np.full(shape, np.nan)
+        if len(self.cells) == 0:
+            return
+        for z0, z1, block in self.blocks():
+            finite = np.isfinite(block)
+            values = np.where(finite, block, 0.)
+            s = np.add.reduceat(values, self.starts, axis=1)
+            n = np.add.reduceat(finite, self.starts, axis=1, dtype=int)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = s / n
+            # Variance from the deviations to the mean of the cell
+            deviation = np.where(finite, block - mean[:, self.segment], 0.)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                variance = np.add.reduceat(deviation * deviation, self.starts, axis=1) / n
+            self.sum[z0:z1, self.cells] = s
+            self.count[z0:z1, self.cells] = n
+            self.mean[z0:z1, self.cells] = mean
+            self.variance[z0:z1, self.cells] = variance
+
+    @property
+    def median(self):
+        """Median spectrum of each cell."""
+        if self._median is None:
+            import warnings
+            nz = np.shape(self.cube)[0]
+            self._median = np.full((nz, self.ncells), np.nan)
+            ends = np.append(self.starts[1:], len(self.pixels))
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                for z0, z1, block in self.blocks():
+                    for cell, i0, i1 in zip(self.cells, self.starts, ends):
+                        self._median[z0:z1, cell] = np.nanmedian(block[:, i0:i1], axis=1)
+        return self._median
+
+
+def windowMedian(cube, labels, windows, n=None, chunksize=64 * 1024 * 1024):
+    """
+    Median of each spectrum over the continuum windows (i0, i1, i2, i3) of its cell.
+    The median is computed over the channels i0:i1 and i2:i3 or, if n is given, over
+    the lowest 1/n of the values in i0:i3. Pixels not in a cell are undefined.
+    """
+    import warnings
+    nz, ny, nx = np.shape(cube)
+    labels = np.asarray(labels)
+    windows = np.asarray(windows, dtype=int)
+    # Windows of the pixels (pixels not in a cell have empty windows)
+    pixwin = np.zeros((ny, nx, 4), dtype=int)
+    inside = labels >= 0
+    pixwin[inside] = windows[labels[inside]]
+    k = np.arange(nz)[:, None, None]
+    median = np.full((ny, nx), np.nan)
+    nrows = max(1, chunksize // max(1, nz * nx * 8))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for j0 in range(0, ny, nrows):
+            j1 = min(ny, j0 + nrows)
+            i0, i1, i2, i3 = np.moveaxis(pixwin[j0:j1], -1, 0)
+            block = np.asarray(cube[:, j0:j1, :], dtype=float)
+            if n is None:
+                selected = ((k >= i0) & (k < i1)) | ((k >= i2) & (k < i3))
+                median[j0:j1] = np.nanmedian(np.where(selected, block, np.nan), axis=0)
+            else:
+                selected = (k >= i0) & (k < i3)
+                # Undefined values are sorted at the end
+                block = np.sort(np.where(selected, block, np.nan), axis=0)
+                lowest = k < (i3 - i0) // n
+                median[j0:j1] = np.nanmedian(np.where(lowest, block, np.nan), axis=0)
+    return median
+
+
+def updateRegions(regions, sites, edit, neighbours, oldNeighbours):
+    """
+    Update in place the map of the nearest site of each pixel after one site is
+    moved, deleted, or inserted (edit = (kind, index of the site)).
+    Only the pixels of the cells of the site and of its Voronoi neighbours
+    (before and after the modification) can change cell, so only they are relabelled.
+    """
+    kind, k = edit
+    if kind == 'move':
+        cells = {k} | neighbours[k] | oldNeighbours[k]
+        selected = np.isin(regions, list(cells))
+    elif kind == 'delete':
+        selected = regions == k
+        # Neighbours of the deleted site with their new indices
+        cells = {j - 1 if j > k else j for j in oldNeighbours[k]}
+        regions[regions > k] -= 1
+    elif kind == 'insert':
+        regions[regions >= k] += 1
+        cells = {k} | neighbours[k]
+        selected = np.isin(regions, list(cells))
+    else:
+        raise ValueError('Unknown modification ' + str(kind))
+    cells = np.array(sorted(cells))
+    yy, xx = np.nonzero(selected)
+    if len(yy) > 0:
+        dx = xx[:, None] - sites[cells, 0][None, :]
+        dy = yy[:, None] - sites[cells, 1][None, :]
+        regions[yy, xx] = cells[np.argmin(dx * dx + dy * dy, axis=1)]
+    return regions
@@ -0,0 +1,132 @@
+import numpy as np
+import threading
+import weakref
+from collections import OrderedDict
+
+
+class ChannelCache(object):
+    """
+    Least recently used cache of display-ready channel images.
+    Arguments:
+        loader   function returning the image of a key, e.g. ('Flux', n)
+        budget   maximum memory used by the cached images (in bytes)
+    """
+    def __init__(self, loader, budget=256 * 1024 * 1024):
+        self.loader = loader
+        self.budget = budget
+        self.planes = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.planes
+
+    def get(self, key):
+        """Return the image of key, loading it if not cached."""
+        with self.lock:
+            if key in self.planes:
+                self.planes.move_to_end(key)
+                return self.planes[key]
+        image = self.load(key)
+        self.put(key, image)
+        return image
+
+    def load(self, key):
+        """Load a plane as a contiguous float array."""
+        image = np.asarray(self.loader(key))
+        if image.dtype.kind != 'f':
+            image = image.astype(np.float32)
+        return np.ascontiguousarray(image)
+
+    def put(self, key, image):
+        with self.lock:
+            if key in self.planes:
+                self.nbytes -= self.planes.pop(key).nbytes
+            self.planes[key] = image
+            self.nbytes += image.nbytes
+            # Evict least recently used planes (keep at least the last one)
+            while self.nbytes > self.budget and len(self.planes) > 1:
+                k, plane = self.planes.popitem(last=False)
+                self.nbytes -= plane.nbytes
+
+    def prefetch(self, key):
+        """Load a plane if not already cached."""
+        if key in self:
+            return
+        self.put(key, self.load(key))
+
+    def clear(self):
+        with self.lock:
+            self.planes.clear()
+            self.nbytes = 0
+
+
+class ImageStatistics(object):
+    """
+    Statistics of the finite values of an image computed once.
+    Images with more than maxsize finite values are regularly subsampled
+    to compute the sorted values, the quantiles and the histograms.
+    """
+    def __init__(self, image, maxsize=1000000):
+        ima = np.asarray(image)[np.isfinite(image)]
+        self.n = ima.size
+        if self.n > 0:
+            self.min = np.min(ima)
+            self.max = np.max(ima)
+            self.std = np.std(ima)
+        else:
+            self.min = self.max = self.std = 0.
+        if self.n > maxsize:
+            ima = ima[::self.n // maxsize + 1]
+        self.values = np.sort(ima)
+        nv = self.values.size
+        if nv > 0:
+            self.median = 0.5 * (self.values[(nv - 1) // 2] + self.values[nv // 2])
+            # Unique values (repeated values could be border values)
+            keep = np.ones(nv, dtype=bool)
+            keep[1:] = self.values[1:] != self.values[:-1]
+            self.unique = self.values[keep]
+            self.umedian = np.median(self.unique)
+            self.usdev = np.median(np.abs(self.unique - self.umedian)) * 1.4826  # Gauss distr
+        else:
+            self.median = self.umedian = self.usdev = 0.
+            self.unique = self.values
+        self.histograms = {}
+
+    def percentile(self, q):
+        """Percentiles of the finite values."""
+        return np.percentile(self.values, q)
+
+    def histogram(self, nbins, hrange):
+        """
+        Histogram of the unique values (computed once for each binning), as displayed
+        before. For subsampled images, these are the unique values of the subsample,
+        so only the shape of the histogram is kept, not the counts of the full image.
+        """
+        key = (nbins, float(hrange[0]), float(hrange[1]))
+        if key not in self.histograms:
+            counts, bins = np.histogram(self.unique, bins=nbins, range=hrange)
+            self.histograms[key] = (counts, bins)
+        return self.histograms[key]
+
+
+_statistics = {}
+
+def imageStatistics(image):
+    """Return the cached statistics of an image, computing them if needed."""
+    key = id(image)
+    entry = _statistics.get(key)
+    if entry is not None and entry[0]() is image:
+        return entry[1]
+    stats = ImageStatistics(image)
+    try:
+        ref = weakref.ref(image, lambda r, key=key: _statistics.pop(key, None))
+    except TypeError:
+        return stats
+    _statistics[key] = (ref, stats)
+    return stats
+
+def invalidateStatistics(image):
+    """Discard the statistics of an image modified in place."""
+    _statistics.pop(id(image), None)
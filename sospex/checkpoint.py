@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import numpy as np
+from sospex.store import jsonDefault
+
+
+class Checkpoint(object):
+    """
+    Sidecar file where a fit over the cube saves periodically the pixels already done
+    and their results, so that an interrupted fit can be resumed skipping them.
+    The key describes the inputs of the fit (checksums of the cubes, guesses, settings):
+    the checkpoint of a fit with different inputs is ignored.
+    Arguments:
+        filename   name of the sidecar file
+        key        dictionary describing the inputs (JSON serializable)
+        interval   minimum time (in seconds) between two savings
+        update     function called with the arrays of results after each saving
+                   (to display the pixels already done)
+    """
+    def __init__(self, filename, key, interval=10., update=None):
+        self.filename = filename
+        self.key = json.dumps(key, sort_keys=True, default=jsonDefault)
+        self.interval = interval
+        self.update = update
+        self.arrays = {}
+        self.done = None
+        self.saved = time.time()
+
+    def attach(self, arrays):
+        """
+        Register the arrays of results (dictionary name: array, the last two axes being
+        the spatial ones), modified in place by the fit. The first time, the pixels
+        done by a previous run with the same inputs are restored in the arrays.
+        Returns the map of the pixels done.
+        """
+        self.arrays = arrays
+        if self.done is None:
+            shape = np.shape(next(iter(arrays.values())))[-2:]
+            self.done = np.zeros(shape, dtype=bool)
+            self.restore()
+        self.saved = time.time()
+        return self.done
+
+    def restore(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with np.load(self.filename, allow_pickle=False) as data:
+                if str(data['key']) != self.key or data['done'].shape != self.done.shape:
+                    print('Checkpoint of a fit with different inputs ignored')
+                    return
+                done = data['done']
+                for name, array in self.arrays.items():
+                    array[..., done] = data[name][..., done]
+                self.done[done] = True
+            print('Restored ', np.sum(self.done), ' pixels from ', self.filename)
+        except (OSError, KeyError, ValueError) as e:
+            print('Checkpoint not restored: ', e)
+
+    def pending(self, points):
+        """Points (x, y) not yet done."""
+        points = np.asarray(points)
+        if self.done is None or len(points) == 0:
+            return points
+        return points[~self.done[points[:, 1], points[:, 0]]]
+
+    def mark(self, p):
+        """Mark a pixel as done, and save if the interval since the last saving elapsed."""
+        i, j = p
+        self.done[j, i] = True
+        if time.time() - self.saved > self.interval:
+            self.save()
+
+    def save(self):
+        """Save the pixels done and their results (the file is replaced atomically)."""
+        tmpfile = self.filename + '.part'
+        try:
+            with open(tmpfile, 'wb') as f:
+                np.savez(f, key=np.array(self.key), done=self.done, **self.arrays)
+            os.replace(tmpfile, self.filename)
+        except OSError as e:
+            print('Checkpoint not saved: ', e)
+        self.saved = time.time()
+        if self.update is not None:
+            self.update(self.arrays)
+
+    def remove(self):
+        """Remove the sidecar file (once the fit is complete)."""
+        for filename in [self.filename, self.filename + '.part']:
+            if os.path.exists(filename):
+                os.remove(filename)
@@ -0,0 +1,115 @@
+import numpy as np
+from collections import OrderedDict
+from matplotlib.collections import LineCollection
+
+
+def contourLines(image, levels, sigma=None):
+    """
+    Compute the geometry of the contour lines of an image.
+    Returns, for each level, a list of (n,2) arrays of pixel coordinates.
+    It does not use the GUI, so it can run outside the GUI thread.
+    """
+    if sigma is not None:
+        import scipy.ndimage as ndimage
+        image = ndimage.gaussian_filter(image, sigma=sigma, order=0)
+    z = np.ma.masked_invalid(image)
+    try:
+        from contourpy import contour_generator, LineType
+    except ImportError:
+        # contourpy is bundled with matplotlib only since version 3.6
+        return [contourSegments(z, level) for level in levels]
+    generator = contour_generator(z=z, line_type=LineType.Separate)
+    return [generator.lines(level) for level in levels]
+
+
+def contourSegments(z, level):
+    """Lines of a level computed with a matplotlib contour set (on a figure without canvas)."""
+    from matplotlib.figure import Figure
+    if z.count() == 0:
+        return []
+    axes = Figure().add_subplot(111)
+    contour = axes.contour(z, levels=[level])
+    return [np.asarray(segment) for segment in contour.allsegs[0]]
+
+
+class ContourLines(object):
+    """
+    Contour lines drawn on an axes, one LineCollection for each level.
+    As for the matplotlib contour sets, the collections are in self.collections.
+    """
+    def __init__(self, axes, color, transform=None):
+        self.axes = axes
+        self.color = color
+        self.transform = transform
+        self.levels = []
+        self.collections = []
+
+    def update(self, levels, lines):
+        """Show the levels given, using the new lines (dictionary level:lines) when available."""
+        old = dict(zip(self.levels, self.collections))
+        collections = []
+        for level in levels:
+            if level in lines:
+                coll = LineCollection(lines[level], colors=self.color)
+                if self.transform is not None:
+                    coll.set_transform(self.transform)
+                self.axes.add_collection(coll, autolim=False)
+            else:
+                coll = old.pop(level)
+            collections.append(coll)
+        # Remove the lines of levels no more used (or recomputed)
+        for level in self.levels:
+            if level in lines or level not in levels:
+                coll = old.pop(level, None)
+                if coll is not None:
+                    coll.remove()
+        self.levels = list(levels)
+        self.collections = collections
+
+    def missing(self, levels):
+        """Levels without lines."""
+        return [level for level in levels if level not in self.levels]
+
+    def remove(self):
+        for coll in self.collections:
+            coll.remove()
+        self.levels = []
+        self.collections = []
+
+
+class ContourCache(object):
+    """
+    Data used to contour a source image over a target image (cutout or reprojection)
+    and lines of each level, kept for the last maxsize keys (source, target, viewport).
+    """
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        return None
+
+    def add(self, key, data, wcs=None):
+        """Store the data to contour and the WCS of their pixels (None if target pixels)."""
+        entry = {'data': data, 'wcs': wcs, 'lines': {}}
+        self.entries[key] = entry
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+    def lines(self, key, levels):
+        """Lines of the levels, computing only the new ones."""
+        entry = self.entries[key]
+        old = entry['lines']
+        missing = [level for level in levels if level not in old]
+        if len(missing) > 0:
+            old.update(zip(missing, contourLines(entry['data'], missing)))
+        # Forget levels no more used
+        entry['lines'] = {level: old[level] for level in levels}
+        return entry['lines']
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,202 @@
+import os
+import inspect
+import numpy as np
+
+
+# Keywords describing the structure of an HDU, set by the writer
+structural = ['SIMPLE', 'XTENSION', 'BITPIX', 'NAXIS', 'EXTEND', 'PCOUNT', 'GCOUNT']
+
+
+class StreamedHDU(object):
+    """
+    Image extension whose data are computed by chunks of channels when written:
+        ((data - subtract) * scale) ** power
+    optionally flipped along the first axis and with NaN on the masked spatial pixels.
+    Arguments:
+        data      cube (or image) to write
+        extname   name of the extension (None for the primary HDU)
+        unit      value of BUNIT
+        header    keywords added to the header (structural keywords are ignored)
+        subtract  array with the same shape as data (e.g. the continuum)
+        scale     multiplicative factor
+        power     exponent (e.g. 2 to write variances from errors)
+        flip      reverse the order of the channels
+        mask      2D boolean array of the masked pixels
+    """
+    def __init__(self, data, extname=None, unit=None, header=None, subtract=None, scale=None,
+                 power=None, flip=False, mask=None, dtype=None):
+        self.data = data
+        self.extname = extname
+        self.unit = unit
+        self.header = header
+        self.subtract = subtract
+        self.scale = scale
+        self.power = power
+        self.flip = flip
+        self.mask = mask
+        self.shape = np.shape(data)
+        if dtype is None:
+            dtype = np.asarray(data[:1]).dtype
+            if any(x is not None for x in [subtract, scale, power, mask]):
+                dtype = np.result_type(dtype, np.float32)
+            if subtract is not None:
+                dtype = np.result_type(dtype, np.asarray(subtract[:1]).dtype)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def chunk(self, k0, k1):
+        """Channels [k0,k1) of the data to write."""
+        if self.flip:
+            n = self.shape[0]
+            k0, k1 = n - k1, n - k0
+        block = np.asarray(self.data[k0:k1])
+        if self.subtract is not None:
+            block = block - self.subtract[k0:k1]
+        if self.scale is not None:
+            block = block * self.scale
+        if self.power is not None:
+            block = block ** self.power
+        if self.mask is not None:
+            block = np.where(self.mask, np.nan, block)
+        if self.flip:
+            block = block[::-1]
+        return np.asarray(block, dtype=self.dtype)
+
+    def chunks(self, chunksize):
+        """Iterate over the data in chunks of about chunksize bytes."""
+        if len(self.shape) == 0:
+            yield self.chunk(0, 1)
+            return
+        n = self.shape[0]
+        plane = max(1, self.nbytes // max(1, n))
+        nchunk = max(1, chunksize // plane)
+        for k0 in range(0, n, nchunk):
+            yield self.chunk(k0, min(n, k0 + nchunk))
+
+    def makeHeader(self, primary):
+        """Header of the HDU, with the structure of the data."""
+        from astropy.io import fits
+        # HDU of the right type and dimension to get the structural keywords in order
+        ndim = len(self.shape)
+        dummy = np.zeros((1,) * ndim, dtype=self.dtype)
+        if primary:
+            header = fits.PrimaryHDU(dummy).header
+            header['EXTEND'] = True
+        else:
+            header = fits.ImageHDU(dummy).header
+        for i, n in enumerate(reversed(self.shape)):
+            header['NAXIS' + str(i + 1)] = n
+        if self.extname is not None:
+            header['EXTNAME'] = self.extname
+        if self.unit is not None:
+            header['BUNIT'] = self.unit
+        if self.header is not None:
+            for card in self.header.cards:
+                key = card.keyword
+                if key in structural or key.startswith('NAXIS'):
+                    continue
+                # The data are written in physical units
+                if key in ['BSCALE', 'BZERO', 'BLANK'] and self.dtype.kind == 'f':
+                    continue
+                header.append(card, end=True)
+        return header
+
+    def compressed(self, compression):
+        """Tile compressed HDU (the data of the extension are computed at once)."""
+        header = self.makeHeader(False)
+        data = np.concatenate(list(self.chunks(self.nbytes + 1)))
+        return compressHDU(data, header, compression)
+
+
+def compressionSupported():
+    """True if astropy can write tile compressed images."""
+    try:
+        from astropy.io.fits.hdu import compressed
+    except ImportError:
+        return False
+    return getattr(compressed, 'COMPRESSION_SUPPORTED', True) is True
+
+
+def fitsNameFilters():
+    """Filters of the dialogs saving FITS files (compressed files only if supported)."""
+    filters = ["Fits Files (*.fits)"]
+    if compressionSupported():
+        filters.append("Compressed Fits Files (*.fits.fz)")
+    return filters + ["All Files (*)"]
+
+
+def compressHDU(data, header, compression):
+    """Compressed image HDU with one tile per plane (lossless for floating point data)."""
+    from astropy.io import fits
+    tile = (1,) * (data.ndim - 2) + data.shape[-2:]
+    # Before astropy 5.3 the tile is given in the FITS order of the axes (tile_size)
+    if 'tile_shape' in inspect.signature(fits.CompImageHDU.__init__).parameters:
+        tiling = {'tile_shape': tile}
+    else:
+        tiling = {'tile_size': tile[::-1]}
+    extname = header.get('EXTNAME')
+    header = header.copy()
+    for key in structural + ['EXTNAME']:
+        header.remove(key, ignore_missing=True, remove_all=True)
+    for key in [k for k in header.keys() if k.startswith('NAXIS')]:
+        header.remove(key, ignore_missing=True, remove_all=True)
+    return fits.CompImageHDU(data, header, name=extname, compression_type=compression,
+                             quantize_level=0., **tiling)
+
+
+def writeStreamed(hdus, outfile, compression=None, chunksize=64 * 1024 * 1024, progress=None):
+    """
+    Write a list of HDUs, the first one being the primary HDU.
+    StreamedHDU elements are written by chunks of channels, so the data to write are never
+    computed at once (except for compressed extensions, computed one at a time), while
+    the other HDUs (astropy objects) are written as they are.
+    Compression (e.g. 'GZIP_2', 'RICE_1') is applied to the image extensions.
+    The file is written with a temporary name and renamed at the end, so a failed
+    writing does not leave an incomplete file.
+    progress(fraction) is called after each chunk written.
+    """
+    from astropy.io import fits
+    tmpfile = outfile + '.part'
+    if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+    total = sum(h.nbytes if isinstance(h, StreamedHDU) else 0 for h in hdus)
+    done = 0
+    try:
+        for i, hdu in enumerate(hdus):
+            primary = i == 0
+            if isinstance(hdu, StreamedHDU):
+                if compression is not None and not primary and len(hdu.shape) >= 2:
+                    appendHDU(tmpfile, hdu.compressed(compression))
+                    done += hdu.nbytes
+                else:
+                    stream = fits.StreamingHDU(tmpfile, hdu.makeHeader(primary))
+                    for block in hdu.chunks(chunksize):
+                        stream.write(block)
+                        done += block.nbytes
+                        if progress is not None:
+                            progress(done / max(1, total))
+                    stream.close()
+            else:
+                if primary:
+                    hdu.writeto(tmpfile)
+                else:
+                    if (compression is not None and isinstance(hdu, fits.ImageHDU)
+                            and hdu.data is not None and hdu.data.ndim >= 2):
+                        hdu = compressHDU(hdu.data, hdu.header, compression)
+                    appendHDU(tmpfile, hdu)
+            if progress is not None:
+                progress(done / max(1, total))
+        os.replace(tmpfile, outfile)
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+
+
+def appendHDU(filename, hdu):
+    """Add an HDU at the end of a FITS file without rewriting it."""
+    from astropy.io import fits
+    with fits.open(filename, mode='append') as hdul:
+        hdul.append(hdu)
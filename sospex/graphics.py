@@ -30,7 +30,7 @@ from astropy import units as u
 from PyQt5.QtWidgets import (QVBoxLayout, QHBoxLayout, QLineEdit, QSizePolicy, QInputDialog, 
                              QPushButton,QLabel,QMessageBox,QScrollArea,QWidget)
 from PyQt5.QtGui import QFont
-from PyQt5.QtCore import Qt, QSize, pyqtSignal
+from PyQt5.QtCore import Qt, QSize, pyqtSignal, QThread
 from PyQt5.QtTest import QTest
 
 # https://het.as.utexas.edu/HET/Software/Astropy-1.0/_modules/astropy/visualization/stretch.html
@@ -251,12 +251,70 @@ class MplCanvas(FigureCanvas):
         pass
 
     
+def downsampleImage(image, factor=2):
+    """Reduce an image averaging the finite values in blocks of factor x factor pixels."""
+    ny, nx = np.shape(image)
+    my = -(-ny // factor)
+    mx = -(-nx // factor)
+    # Pad with NaN to a multiple of the factor
+    padded = np.full((my * factor, mx * factor), np.nan, dtype=np.float32)
+    padded[:ny, :nx] = image
+    blocks = padded.reshape(my, factor, mx, factor)
+    mask = np.isfinite(blocks)
+    n = np.sum(mask, axis=(1, 3))
+    total = np.sum(np.where(mask, blocks, 0), axis=(1, 3))
+    reduced = np.full((my, mx), np.nan, dtype=np.float32)
+    np.divide(total, n, out=reduced, where=n > 0)
+    return reduced
+
+
+class BuildPyramid(QThread):
+    """Thread to compute the levels of detail of a large image."""
+
+    def __init__(self, image, minsize=512, parent=None):
+        super().__init__(parent)
+        self.image = image
+        self.minsize = minsize
+        self.levels = []
+        self.cancelled = False
+
+    def cancel(self):
+        """Stop computing the levels (checked between two levels)."""
+        self.cancelled = True
+
+    def run(self):
+        image = self.image
+        while max(np.shape(image)) > self.minsize:
+            if self.cancelled:
+                break
+            image = downsampleImage(image)
+            self.levels.append(image)
+        if self.cancelled:
+            self.levels = []
+        # Release the image
+        self.image = None
+
+
 class ImageCanvas(MplCanvas):
     """Canvas to plot an image."""
     
     def __init__(self, *args, **kwargs):
         MplCanvas.__init__(self, *args, **kwargs)
         # Define color map
+        # Levels of detail for images larger than pyramidSize pixels
+        self.pyramidSize = 2048 * 2048
+        self.pyramid = None
+        self.pyramidThread = None
+        self.level = 0
+        self.panning = False
+        self.cidlim = None
+        # Version of the image data (increased when the data change)
+        self.version = 0
+        # Key of the cached contours drawn from another image
+        self.contourKey = None
+        # Mask layer of the cube (for images on the cube grid) and unmasked data
+        self.maskLayer = None
+        self.dimage = None
             
     def compute_initial_figure(self, image=None, wcs=None, title=None, cMap = 'real',
                                cMapDir = '_r', stretch='linear', instrument=None, aspect=1):
@@ -378,17 +436,20 @@ class ImageCanvas(MplCanvas):
         return stretch
 
     def showImage(self, image):        
-        self.oimage = image.copy()
+        self.dimage = image
+        self.oimage = self.maskImage(image).copy()
+        image = self.oimage
+        self.version += 1
         # Intensity limits
         if self.cmin is None:
-            mask =  np.isfinite(image)
-            if np.sum(mask) == 0:
+            stats = imageStatistics(self.oimage)
+            if stats.n == 0:
                 cmin=-10
                 cmax=+10
             else:       
                 # Check if too many zeros
-                vmed0=np.nanmedian(image)
-                d0 = np.nanstd(image)
+                vmed0 = stats.median
+                d0 = stats.std
                 cmin = vmed0-1*d0
                 if cmin < 0:
                     cmin = 0
@@ -412,25 +473,115 @@ class ImageCanvas(MplCanvas):
         else:
             self.cmin, self.cmax = self.image.get_clim()
 
-        # Cursor data format
-        def format_coord(x,y):
-            """ Redefine how to show the coordinates """
-            pixel = np.array([[x, y]], np.float_)
-            world = self.wcs.all_pix2world(pixel, 0)                    
-            xx = world[0][0]
-            yy = world[0][1]
-            " Transform coordinates in string "
-            radec = SkyCoord(xx*u.deg, yy*u.deg, frame='icrs')
-            xx = radec.ra.to_string(u.hour,sep=':',precision=2)
-            yy = radec.dec.to_string(sep=':',precision=1)
-            return '{:s} {:s} ({:4.0f},{:4.0f})'.format(xx,yy,x,y)
-         
-        self.axes.format_coord = format_coord
+        # Cursor data format (interpolated sky coordinates, error below 1 mas)
+        self.readout = SkyReadout(self.wcs, image.shape)
+        self.axes.format_coord = self.readout.format
+        # Levels of detail
+        if self.cidlim is not None:
+            try:
+                self.cidlim[0].disconnect(self.cidlim[1])
+            except BaseException:
+                pass
+        self.cidlim = (self.axes.callbacks,
+                       self.axes.callbacks.connect('xlim_changed', self.onLimitsChanged))
+        self.buildPyramid()
         
     def updateImage(self, image):
         """Update only the image data."""
+        if image is self.oimage:
+            # Image modified in place
+            invalidateStatistics(image)
+        self.dimage = image
+        image = self.maskImage(image)
         self.image.set_data(image)
         self.oimage = image
+        self.version += 1
+        if self.pyramid is not None or self.pyramidThread is not None:
+            self.setExtent(image, 1)
+        self.buildPyramid()
+
+    def maskImage(self, image):
+        """Image with NaN on the pixels masked in the cube."""
+        if self.maskLayer is None:
+            return image
+        return self.maskLayer.image(image)
+
+    def refreshMask(self):
+        """Show again the data after a change of the mask."""
+        if self.dimage is not None:
+            self.updateImage(self.dimage)
+
+    def buildPyramid(self):
+        """Start computing the levels of detail of a large image."""
+        self.pyramid = None
+        self.level = 0
+        if self.pyramidThread is not None:
+            # The previous thread is stopped and its results are ignored
+            thread = self.pyramidThread
+            try:
+                thread.finished.disconnect()
+            except BaseException:
+                pass
+            thread.cancel()
+            thread.finished.connect(thread.deleteLater)
+            if thread.isFinished():
+                thread.deleteLater()
+            self.pyramidThread = None
+        if np.size(self.oimage) <= self.pyramidSize:
+            return
+        self.pyramidThread = BuildPyramid(self.oimage, parent=self)
+        self.pyramidThread.finished.connect(self.onPyramidBuilt)
+        self.pyramidThread.start()
+
+    def onPyramidBuilt(self):
+        if self.pyramidThread is None:
+            return
+        self.pyramid = [self.oimage] + self.pyramidThread.levels
+        self.pyramidThread.deleteLater()
+        self.pyramidThread = None
+        if self.selectLevel():
+            self.fig.canvas.draw_idle()
+
+    def onLimitsChanged(self, axes):
+        self.selectLevel()
+
+    def panImage(self, panning):
+        """Use a coarser level of detail while panning."""
+        if panning == self.panning:
+            return
+        self.panning = panning
+        if self.selectLevel() and not panning:
+            self.fig.canvas.draw_idle()
+
+    def selectLevel(self):
+        """Display the level of detail matching the current zoom."""
+        if self.pyramid is None:
+            return False
+        x0, x1 = self.axes.get_xlim()
+        y0, y1 = self.axes.get_ylim()
+        width = max(1., self.axes.bbox.width)
+        height = max(1., self.axes.bbox.height)
+        # Image pixels per screen pixel
+        ratio = max(np.abs(x1 - x0) / width, np.abs(y1 - y0) / height)
+        level = int(np.floor(np.log2(max(ratio, 1.))))
+        if self.panning:
+            level += 1
+        level = min(level, len(self.pyramid) - 1)
+        if level == self.level:
+            return False
+        self.level = level
+        self.image.set_data(self.pyramid[level])
+        self.setExtent(self.pyramid[level], 2 ** level)
+        return True
+
+    def setExtent(self, image, factor):
+        """Extent in pixels of the original image, conserving the axes limits."""
+        ny, nx = np.shape(image)
+        xlim = self.axes.get_xlim()
+        ylim = self.axes.get_ylim()
+        self.image.set_extent((-0.5, nx * factor - 0.5, -0.5, ny * factor - 0.5))
+        self.axes.set_xlim(xlim, emit=False)
+        self.axes.set_ylim(ylim, emit=False)
     
     def updateScale(self,_cmin,_cmax):
         self.image.set_clim([_cmin, _cmax])
@@ -446,7 +597,57 @@ class ImageCanvas(MplCanvas):
         self.fig.canvas.draw_idle()
         self.changed = False
 
+    def contourArtists(self):
+        if self.contour is None:
+            return []
+        try:
+            return list(self.contour.collections)
+        except AttributeError:
+            return [self.contour]
+
+    def startAnimation(self):
+        """Draw everything except the image and contours and save it as background."""
+        self.image.set_animated(True)
+        for a in self.contourArtists():
+            a.set_animated(True)
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.axes.bbox)
+        self.blitImage(self.oimage)
+
+    def blitImage(self, image):
+        """Update the image redrawing only the image artist (and contours)."""
+        self.dimage = image
+        image = self.maskImage(image)
+        self.image.set_data(image)
+        self.oimage = image
+        self.fig.canvas.restore_region(self.background)
+        self.axes.draw_artist(self.image)
+        for a in self.contourArtists():
+            self.axes.draw_artist(a)
+        self.fig.canvas.blit(self.axes.bbox)
+
+    def stopAnimation(self):
+        self.image.set_animated(False)
+        for a in self.contourArtists():
+            a.set_animated(False)
+        self.background = None
+        self.fig.canvas.draw_idle()
+
 from sospex.moments import histoImage
+from sospex.cache import imageStatistics, invalidateStatistics
+from sospex.wcstransform import SkyReadout
+
+def histogramData(image, percent=None):
+    """
+    Histogram and statistics of an image.
+    It does not use matplotlib, so it can run outside the GUI thread.
+    """
+    ima, nbins, xmin, xmax, hmin, hmax, imedian, imin, imax, sdev, epsilon, nh = histoImage(image, percent)
+    if hmin == hmax:
+        return None
+    counts, bins = imageStatistics(image).histogram(nbins, (hmin, hmax))
+    return {'counts': counts, 'bins': bins, 'xmin': xmin, 'xmax': xmax, 'median': imedian,
+            'min': imin, 'max': imax, 'sdev': sdev, 'epsilon': epsilon, 'nh': nh}
         
 class ImageHistoCanvas(MplCanvas):
     """ Canvas to plot the histogram of image intensity """
@@ -469,6 +670,8 @@ class ImageHistoCanvas(MplCanvas):
         self.levels = []
         self._ind = None
         self.changed = True
+        self.bars = None
+        self.grid = None
         
     def compute_initial_figure(self, image=None,xmin=None,xmax=None):
         if image is None:
@@ -486,34 +689,48 @@ class ImageHistoCanvas(MplCanvas):
         
     def update_figure(self, image=None, percent=None):
         try:
-            ima, nbins, xmin, xmax, hmin, hmax, imedian, imin, imax, sdev, epsilon, nh = histoImage(image, percent)
-            if hmin != hmax:
-                n, self.bins, patches = self.axes.hist(ima, bins=nbins,
-                                                       range=(hmin,hmax), fc='k', ec='k')
-                # Draw grid (median, median+n*sigma)
-                # This should be a collection which could be removed once redrawing the image
-                x = imedian
-                for i in range(10):
-                    if x < imax:
-                        self.axes.axvline(x=x,color='black',alpha=0.5)
-                        x += sdev                
-                x = imedian-sdev
-                for i in range(3):
-                    if x > imin:
-                        self.axes.axvline(x=x,color='black',alpha=0.5)
-                        x -= sdev                
-                self.min = imin
-                self.max = imax
-                self.median = imedian
-                self.epsilon = epsilon
-                self.sdev = sdev
-                self.nh = nh
-                self.onSelect(xmin,xmax)
-            else:
-                self.limits = [0, 0]
+            self.showHistogram(histogramData(image, percent))
         except:
             print('Problems with the image')
 
+    def showHistogram(self, data):
+        """Draw a histogram computed by histogramData (also in a thread)."""
+        if data is None:
+            self.limits = [0, 0]
+            return
+        # Remove the previous histogram (if not already cleared)
+        for artist in [self.bars, self.grid]:
+            try:
+                artist.remove()
+            except:
+                pass
+        # Bars drawn as a single step polygon
+        bins = data['bins']
+        counts = data['counts']
+        x = np.concatenate([[bins[0]], np.repeat(bins, 2), [bins[-1]]])
+        y = np.concatenate([[0, 0], np.repeat(counts, 2), [0, 0]])
+        self.bars = Polygon(np.c_[x, y], closed=True, fc='k', ec='k')
+        self.bars.sticky_edges.y[:] = [0]
+        self.axes.add_patch(self.bars)
+        self.axes.autoscale_view()
+        self.bins = bins
+        # Draw grid (median, median+n*sigma)
+        imedian = data['median']
+        sdev = data['sdev']
+        imin = data['min']
+        imax = data['max']
+        grid = [imedian + i * sdev for i in range(10) if imedian + i * sdev < imax]
+        grid += [imedian - i * sdev for i in range(1, 4) if imedian - i * sdev > imin]
+        self.grid = self.axes.vlines(grid, 0, 1, transform=self.axes.get_xaxis_transform(),
+                                     color='black', alpha=0.5)
+        self.min = imin
+        self.max = imax
+        self.median = imedian
+        self.epsilon = data['epsilon']
+        self.sdev = sdev
+        self.nh = data['nh']
+        self.onSelect(data['xmin'], data['xmax'])
+
     def drawLevels(self):
         """ Draw levels as defined in levels"""
         if len(self.levels) > 0:
@@ -600,9 +817,6 @@ class ImageHistoCanvas(MplCanvas):
             return
         if event.button != 1:
             return
-        # Emit a signal to communicate change of contour (for large images)
-        if self.nh > 100000 and self._ind is not None:
-            self.levSignal.emit(self._ind)
         self._ind = None
         
     def get_ind_under_point(self, event):
@@ -713,8 +927,8 @@ class ImageHistoCanvas(MplCanvas):
         self.fig.canvas.update()
         #self.fig.canvas.repaint()
         self.fig.canvas.flush_events()
-        # Emit a signal to communicate change of contour
-        if self.nh <= 100000 and self._ind is not None:
+        # Emit a signal to communicate change of contour (contours are computed in a thread)
+        if self._ind is not None:
             self.levSignal.emit(self._ind)
 
 
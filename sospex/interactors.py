@@ -502,6 +502,9 @@ class VoronoiInteractor(QObject):
 
         # self.sites = self.sites
         #self.sites = sites
+        self.ridges = None
+        self.neighbours = None
+        self.edit = None    # last modification: ('move'|'delete'|'insert', index of site)
         self.drawVoronoi()
         #self.cid = self.poly.add_callback(self.poly_changed)
         self._ind = None  # the active vert
@@ -509,40 +512,40 @@ class VoronoiInteractor(QObject):
         
     def drawVoronoi(self):
         from scipy.spatial import Voronoi
+        from matplotlib.collections import LineCollection
         self.sites = self.poly.xy[:-1]
-        #print('Sites are ', len(self.sites))
-        #print('sites: ', self.sites)
         vor = Voronoi(self.sites)
-        #print('vertices ', vor.vertices)
-        # Ridge segments
-        self.segments = []
-        for simplex in vor.ridge_vertices:
-            simplex = np.asarray(simplex)
-            if np.all(simplex >= 0):
-                x = vor.vertices[simplex, 0]
-                y = vor.vertices[simplex, 1]
-                #print('vertices: ', x, y)
-                segment = Line2D(x, y, color='black', linestyle='-')#, animated=True)
-                self.ax.add_line(segment)
-                self.segments.append(segment)
+        # Neighbours of each site (before and after the last modification)
+        self.oldNeighbours = self.neighbours
+        self.neighbours = [set() for site in self.sites]
+        for i, j in vor.ridge_points:
+            self.neighbours[i].add(j)
+            self.neighbours[j].add(i)
         center = self.sites.mean(axis=0)
-        # Ridge rays
-        self.rays = []
+        # Ridge segments (solid) and rays (dashed)
+        segments = []
+        styles = []
         for pointidx, simplex in zip(vor.ridge_points, vor.ridge_vertices):
             simplex = np.asarray(simplex)
-            if np.any(simplex < 0):
+            if np.all(simplex >= 0):
+                segments.append(vor.vertices[simplex])
+                styles.append('solid')
+            else:
                 i = simplex[simplex >= 0][0] # finite end Voronoi vertex
                 t = self.sites[pointidx[1]] - self.sites[pointidx[0]]  # tangent
                 t = t / np.linalg.norm(t)
                 n = np.array([-t[1], t[0]]) # normal
-                #print('normal is ',n, ' finite end ', vor.vertices[i], ' site ', self.sites[pointidx[0]])
                 midpoint = self.sites[pointidx].mean(axis=0)
                 far_point = vor.vertices[i] + np.sign(np.dot(midpoint - center, n)) * n * 3
-                x = [vor.vertices[i,0], far_point[0]]
-                y = [vor.vertices[i,1], far_point[1]]
-                ray = Line2D(x, y, color='black', linestyle='--')#, animated=True)
-                self.ax.add_line(ray)
-                self.rays.append(ray)
+                segments.append(np.array([vor.vertices[i], far_point]))
+                styles.append('dashed')
+        # All the ridges are in one collection updated in place
+        if self.ridges is None:
+            self.ridges = LineCollection(segments, colors='black', linestyles=styles)
+            self.ax.add_collection(self.ridges, autolim=False)
+        else:
+            self.ridges.set_segments(segments)
+            self.ridges.set_linestyles(styles)
 
     def connect(self):
         self.cid_draw = self.canvas.mpl_connect('draw_event', self.draw_callback)
@@ -553,8 +556,7 @@ class VoronoiInteractor(QObject):
         self.canvas.draw_idle()
 
     def removeRidges(self):
-        for s in self.segments + self.rays:
-            s.remove()
+        self.ridges.remove()
         self.poly.remove()
         self.line.remove()
         self.canvas.draw_idle()
@@ -618,10 +620,11 @@ class VoronoiInteractor(QObject):
             return
         if event.button != 1:
             return
+        if self._ind is None:
+            return
+        n = len(self.poly.xy) - 1  # the last vertex is the first one
+        self.edit = ('move', self._ind % n)
         self._ind = None
-        # For some reason, 't' inhibites the changes in Voronoi
-        for s in self.segments + self.rays:
-            s.remove()
         self.drawVoronoi()
         # Redraw the polygons
         self.canvas.draw_idle()
@@ -642,6 +645,7 @@ class VoronoiInteractor(QObject):
         elif event.key == 'd':
             ind = self.get_ind_under_point(event)
             if ind is not None:
+                ind %= len(self.poly.xy) - 1  # the last vertex is the first one
                 if len(self.poly.xy) < 4:  # the minimum polygon has 4 points since the 1st is repeated as final
                     # Delete polygon
                     #self.disconnect()
@@ -661,10 +665,10 @@ class VoronoiInteractor(QObject):
                     self.poly.set_xy(a)
                     #print('new lengths ', len(a), len(self.poly.xy))
                     self.line.set_data(zip(*self.poly.xy))
+                    self.edit = ('delete', ind)
+                    self.drawVoronoi()
+                    self.canvas.draw_idle()
                     self.modSignal.emit(str(ind))  # Pass the index canceled
-                for s in self.segments + self.rays:
-                    s.remove()
-                self.drawVoronoi()
         elif event.key == 'i':
             xys = self.poly.get_transform().transform(self.poly.xy)
             p = event.x, event.y  # display coords
@@ -681,11 +685,11 @@ class VoronoiInteractor(QObject):
                     #    [(event.xdata, event.ydata)] +
                     #    list(self.poly.xy[i+1:]))
                     self.line.set_data(zip(*self.poly.xy))
+                    self.edit = ('insert', i + 1)
+                    self.drawVoronoi()
+                    self.canvas.draw_idle()
+                    self.modSignal.emit('one voronoi site added')
                     break
-            self.modSignal.emit('one voronoi site added')
-            for s in self.segments + self.rays:
-                s.remove()
-            self.drawVoronoi()
 
     def motion_notify_callback(self, event):
         'on mouse movement'
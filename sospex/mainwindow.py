@@ -8,7 +8,7 @@ from PyQt5.QtWidgets import (QApplication, QWidget, QMainWindow, QTabWidget,
                              QAbstractItemView, QMessageBox, QInputDialog, 
                              QDialog, QLabel, QProxyStyle,QStyle)
 from PyQt5.QtGui import QIcon, QStandardItem, QStandardItemModel, QPixmap, QMovie
-from PyQt5.QtCore import Qt, QSize, QTimer, QThread, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import Qt, QSize, QTimer, QThread, QEventLoop, pyqtSignal, pyqtSlot
 
 import matplotlib
 matplotlib.use('Qt5Agg')
@@ -22,21 +22,35 @@ import warnings
 
 from sospex.moments import ( multiFitContinuum, multiComputeMoments,
                             multiFitLines, multiFitLinesSingle, residualsPsf, 
-                            fitApertureContinuum, fitApertureLines)
+                            fitApertureContinuum, fitApertureLines, zeroMomentMap,
+                            multiFitLinesBins, smoothCube, continuumAt)
 from sospex.dialogs import (ContParams, ContFitParams, SlicerDialog, guessParams,
-                            FitCubeDialog, cmDialog, ApertureParams)
+                            FitCubeDialog, cmDialog, ApertureParams, WVZDialog)
 from sospex.graphics import  (NavigationToolbar, ImageCanvas, ImageHistoCanvas,
-                              SpectrumCanvas, ds9cmap, ScrollMessageBox, PsfCanvas)
+                              SpectrumCanvas, ds9cmap, ScrollMessageBox, PsfCanvas,
+                              histogramData)
 from sospex.apertures import (photoAperture, PolygonInteractor, EllipseInteractor,
                               RectangleInteractor, PixelInteractor)
-from sospex.specobj import specCube, specCubeAstro, Spectrum, ExtSpectrum
+from sospex.specobj import (specCube, specCubeAstro, Spectrum, ExtSpectrum, CumulativeCube,
+                            MaskLayer, trimSpectralCube, cropSpectralCube)
 from sospex.cloud import cloudImage
+from sospex.cache import ChannelCache, imageStatistics, invalidateStatistics
+from sospex.movie import multiRenderFigures, framesToMovie
+from sospex.contours import contourLines, ContourLines, ContourCache
+from sospex.wcstransform import pix2pix
+from sospex.fitswriter import StreamedHDU, writeStreamed, compressionSupported, fitsNameFilters
+from sospex.atmosphere import shiftOperator, applyOperator, atranModel
+from sospex.binning import (VoronoiBinning, CellSpectra, signalNoiseMaps, windowMedian,
+                            updateRegions)
 from sospex.interactors import (SliderInteractor, SliceInteractor, DistanceSelector,
                                 VoronoiInteractor, LineInteractor, PsfInteractor,
                                 InteractorManager, SegmentsSelector, SegmentsInteractor)
 from sospex.inout import (exportAperture, importAperture, 
-                          exportGuesses, importGuesses,
-                          exportContours, importContours)
+                          exportGuesses, importGuesses, guessesInfo, applyGuesses,
+                          apertureInfo, applyAperture, exportContours, importContours)
+from sospex.store import ProductStore
+from sospex.session import Session, fileReference, arrayChecksum
+from sospex.checkpoint import Checkpoint
 
 class MyProxyStyle(QProxyStyle):
     pass
@@ -160,16 +174,207 @@ class CheckVersion(QThread):
 
         
 class UpdateHistogram(QThread):
+    """Thread to compute the histograms of changed images (drawn later in the GUI thread)."""
     sendMessage = pyqtSignal([str])
+    histogramReady = pyqtSignal([object])
                 
-    def __init__(self, image, clim, parent=None):
+    def __init__(self, parent=None):
         super().__init__(parent)
-        self.image = image
-        self.clim = clim
-        
+        self.requests = {}
+        self.finished.connect(self.restart)
+
+    def submit(self, itab, image, percent=None):
+        """A new request for a tab replaces the pending one."""
+        self.requests.pop(itab, None)
+        self.requests[itab] = (image, percent)
+        if not self.isRunning():
+            self.start()
+
+    def restart(self):
+        if len(self.requests) > 0:
+            self.start()
+
+    @pyqtSlot()
     def run(self):
-        pass
+        while len(self.requests) > 0:
+            try:
+                itab, (image, percent) = self.requests.popitem()
+            except KeyError:
+                break
+            try:
+                data = histogramData(image, percent)
+            except BaseException:
+                self.sendMessage.emit('Problems with the histogram of the image')
+                continue
+            self.histogramReady.emit((itab, image, data))
         
+class PrefetchChannels(QThread):
+    """Thread to load in the cache the channels close to the displayed one."""
+
+    def __init__(self, cache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.keys = []
+
+    @pyqtSlot()
+    def run(self):
+        self.keeprunning = True
+        while self.keeprunning and len(self.keys) > 0:
+            try:
+                key = self.keys.pop(0)
+                self.cache.prefetch(key)
+            except BaseException:
+                # Cube changed while prefetching
+                break
+
+    def stop(self):
+        self.keeprunning = False
+        self.keys = []
+        self.quit()
+        self.wait()
+
+class ComputeContours(QThread):
+    """Thread to compute the geometry of contour lines (drawn later in the GUI thread)."""
+    contoursReady = pyqtSignal([object])
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.request = None
+        self.smoothed = None
+        self.finished.connect(self.restart)
+
+    def submit(self, request):
+        """A new request replaces (cancels) the pending one."""
+        self.request = request
+        if not self.isRunning():
+            self.start()
+
+    def restart(self):
+        if self.request is not None:
+            self.start()
+
+    @pyqtSlot()
+    def run(self):
+        while self.request is not None:
+            request = self.request
+            self.request = None
+            ident, itab, image, sigma, levels, missing = request
+            try:
+                if sigma is not None:
+                    # Smooth the image only once
+                    if (self.smoothed is None or self.smoothed[0] is not image 
+                        or self.smoothed[1] != sigma):
+                        ismo = ndimage.gaussian_filter(image, sigma=sigma, order=0)
+                        self.smoothed = (image, sigma, ismo)
+                    data = self.smoothed[2]
+                else:
+                    data = image
+                lines = contourLines(data, missing)
+            except BaseException:
+                print('Contours not computed')
+                continue
+            # Skip results already superseded by a new request
+            if self.request is None:
+                self.contoursReady.emit((ident, itab, levels, dict(zip(missing, lines))))
+
+class CorrectAtmosphere(QThread):
+    """Thread to correct the uncorrected flux of a FIFI-LS cube with a new transmission.
+    The corrected cubes are new arrays, so the cube displayed is never half corrected."""
+    corrected = pyqtSignal([object, object, object])
+
+    def __init__(self, cube, atmed, atran, parent=None):
+        super().__init__(parent)
+        self.cube = cube
+        self.atmed = atmed
+        self.atran = atran
+
+    @pyqtSlot()
+    def run(self):
+        s = self.cube
+        # The wavelength shift is the same for all the spectra
+        x = s.wave
+        xr = x * (1 + s.baryshift)
+        operator = shiftOperator(x, xr, self.atmed)
+        flux = applyOperator(operator, s.uflux, out=np.empty_like(s.flux))
+        eflux = applyOperator(operator, s.euflux, out=np.empty_like(s.eflux))
+        self.corrected.emit(self.atran, flux, eflux)
+
+class WriteFits(QThread):
+    """Thread to write a list of HDUs on disk, streaming the cubes by chunks of channels."""
+    saved = pyqtSignal([str])
+    progress = pyqtSignal([int])
+    sendMessage = pyqtSignal([str])
+
+    def __init__(self, hdus, outfile, compression=None, parent=None):
+        super().__init__(parent)
+        self.hdus = hdus
+        self.outfile = outfile
+        self.compression = compression
+        self.percent = -1
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            writeStreamed(self.hdus, self.outfile, compression=self.compression,
+                          progress=self.onProgress)
+            self.saved.emit(self.outfile)
+            message = 'File ' + os.path.basename(self.outfile) + ' saved'
+        except BaseException as e:
+            message = 'ERROR: ' + str(e)
+        print(message)
+        self.sendMessage.emit(message)
+
+    def onProgress(self, fraction):
+        percent = int(fraction * 100)
+        if percent != self.percent:
+            self.percent = percent
+            self.progress.emit(percent)
+
+class WriteProducts(QThread):
+    """Thread to write the analysis products in a product store."""
+    sendMessage = pyqtSignal([str])
+
+    def __init__(self, arrays, info, outfile, parent=None):
+        super().__init__(parent)
+        self.arrays = arrays
+        self.info = info
+        self.outfile = outfile
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            with ProductStore(self.outfile, 'w') as store:
+                for name, data, attrs in self.arrays:
+                    store.write(name, data, attrs)
+                for name, obj in self.info:
+                    store.writeJSON(name, obj)
+            message = 'Products saved in ' + os.path.basename(self.outfile)
+        except BaseException as e:
+            message = 'ERROR: ' + str(e)
+        print(message)
+        self.sendMessage.emit(message)
+
+class SaveSession(QThread):
+    """Thread to save a snapshot of the session."""
+    sendMessage = pyqtSignal([str])
+
+    def __init__(self, session, arrays, state, versions, parent=None):
+        super().__init__(parent)
+        self.session = session
+        self.arrays = arrays
+        self.state = state
+        self.versions = versions
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            self.session.save(self.arrays, self.state, self.versions)
+            message = 'Session saved '
+        except BaseException as e:
+            message = 'Session not saved: ' + str(e)
+        print(message)
+        self.sendMessage.emit(message)
+
 class GUI (QMainWindow):
     """Main GUI window."""
     
@@ -200,6 +405,32 @@ class GUI (QMainWindow):
         self.kernel = 1
         # Default number of cells
         self.ncells = 1
+        # Memory (MB) for cached channel images and number of channels prefetched on each side
+        self.channelCacheSize = 256
+        self.channelPrefetch = 3
+        self.channelCache = None
+        self.prefetch = None
+        # Identifier of the latest contour request
+        self.contourId = 0
+        # Contours of an image drawn on the other images
+        self.contourCache = ContourCache()
+        # Thread applying a new atmospheric transmission
+        self.atmThread = None
+        self.writeThread = None
+        self.productThread = None
+        # Session saved periodically (minutes)
+        self.session = None
+        self.sessionInterval = 5
+        self.sessionThread = None
+        # Versions of the products modified in place (to save only what changed)
+        self.productVersions = {}
+        # Fits over the cube saved periodically (seconds)
+        self.checkpointInterval = 10
+        self.fitRunning = False
+        self.cells = None
+        self.smoothed = None
+        # Frames per second when playing the channels
+        self.playFps = 5.
         # Initial press setting 
         self.press = None
         self.press2 = None
@@ -235,6 +466,19 @@ class GUI (QMainWindow):
         # Timer for periodical events
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.blinkTab)
+        # Thread computing contours
+        self.contourThread = ComputeContours(parent=self)
+        self.contourThread.contoursReady.connect(self.onContoursReady)
+        # Thread computing histograms
+        self.histogramThread = UpdateHistogram(parent=self)
+        self.histogramThread.histogramReady.connect(self.onHistogramReady)
+        self.histogramThread.sendMessage.connect(lambda m: self.sb.showMessage(m, 2000))
+        # Timer to play the channels of the cube
+        self.playTimer = QTimer(self)
+        self.playTimer.timeout.connect(self.playNextChannel)
+        # Timer to save the session
+        self.sessionTimer = QTimer(self)
+        self.sessionTimer.timeout.connect(self.autosaveSession)
         # Load lines
         from sospex.lines import define_lines
         self.Lines = define_lines()
@@ -355,6 +599,12 @@ class GUI (QMainWindow):
         io.addAction(QAction('Save spectrum', self, shortcut='',triggered=self.saveSpectrum))
         io.addAction(QAction('Save moments', self, shortcut='',triggered=self.saveMoments))
         io.addAction(QAction('Save lines', self, shortcut='',triggered=self.saveLines))
+        io.addAction(QAction('Save all products', self, shortcut='',triggered=self.saveProducts))
+        session = io.addMenu("Session")
+        session.addAction(QAction('Save', self, shortcut='', triggered=self.saveSession))
+        session.addAction(QAction('Resume', self, shortcut='', triggered=self.resumeSession))
+        io.addAction(QAction('Export channel maps', self, shortcut='',
+                             triggered=self.exportChannelMaps))
         aperture = io.addMenu("Aperture I/O")
         aperture.addAction(QAction('Export',self,shortcut='',triggered=self.exportApertureAction))
         aperture.addAction(QAction('Import',self,shortcut='',triggered=self.importApertureAction))
@@ -371,6 +621,8 @@ class GUI (QMainWindow):
         slice.addAction(QAction('on channel', self, shortcut='', triggered=self.initializeSlider))
         slice.addAction(QAction('on slice', self, shortcut='', triggered=self.initializeSlicer))
         slice.addAction(QAction('no', self, shortcut='', triggered=self.removeSliders))
+        slice.addAction(QAction('play channels', self, shortcut='', triggered=self.playChannels))
+        slice.addAction(QAction('stop playing', self, shortcut='', triggered=self.stopChannels))
         level = view.addMenu("Image levels")
         level.addAction(QAction('100.0%',self,shortcut='', triggered=self.changeVisibility100))
         level.addAction(QAction('99.9%',self,shortcut='', triggered=self.changeVisibility999))
@@ -423,6 +675,10 @@ class GUI (QMainWindow):
                                 triggered=self.maskCubeInsidePolygon))
         erase.addAction(QAction('.. outside a polygon',self,shortcut='',
                                 triggered=self.maskCubeOutsidePolygon))
+        erase.addAction(QAction('Undo last mask',self,shortcut='Ctrl+z',
+                                triggered=self.undoMask))
+        erase.addAction(QAction('Redo mask',self,shortcut='Ctrl+y',
+                                triggered=self.redoMask))
         continuum = tools.addMenu("Continuum and moments")
         continuum.addAction(QAction('Define guesses',self,shortcut='',
                                     triggered=self.guessContinuum))
@@ -688,6 +944,10 @@ class GUI (QMainWindow):
         ic = ImageCanvas(t, width=11, height=10.5, dpi=100)
         if b in ['Flux','uFlux','Exp','C0','M0','M1','M2','M3','M4','L0','L1','v0','v1','d0','d1']:
             ic.crota2 = self.specCube.crota2
+        if b in ['Flux','uFlux','Exp','C0','M0','M1','M2','M3','M4',
+                 'v','sv','L0','L1','v0','v1','d0','d1']:
+            # Images on the grid of the cube show its mask
+            ic.maskLayer = self.specCube.mask
         # No contours available
         ic.contours = None
         ic.contour0 = None
@@ -898,49 +1158,7 @@ class GUI (QMainWindow):
                     ima.contour0 = None
                 if ima.contour0 is not None:
                     if isinstance(ima.contour0, int):
-                        # print('Computing contours ...')
-                        from astropy.nddata import Cutout2D
-                        itab = ima.contour0
-                        ic0 = self.ici[itab]
-                        ih0 = self.ihi[itab]
-                        # Consider only the part visible in the image
-                        x = ima.axes.get_xlim()
-                        y = ima.axes.get_ylim()                        
-                        x = [x[0], x[1], x[1], x[0]]
-                        y = [y[0], y[0], y[1], y[1]]
-                        ra,dec = ima.wcs.all_pix2world(x, y, 0)
-                        x, y = ic0.wcs.all_world2pix(ra,dec,0)
-                        x = np.array(x)
-                        y = np.array(y)
-                        x = [np.min(x), np.max(x)]
-                        y = [np.min(y), np.max(y)]
-                        
-                        center =  ((x[0]+x[1])*0.5,(y[0]+y[1])*0.5)
-                        size = (np.abs((y[1]-y[0]).astype(int)),np.abs((x[1]-x[0]).astype(int)))
-                        co = Cutout2D(ic0.oimage, center, size, wcs=ic0.wcs, mode='partial')
-                        #print('Cutout wcs ', co.wcs)
-                        # If the contour image is much large, one should lower the resolution
-                        # to speed-up the computation
-                        ny0, nx0 = np.shape(co.data)
-                        ny, nx = np.shape(ima.oimage)
-                        # Sort the histrogram levels
-                        # ih0.sort_levels()
-                        levs = ih0.levels
-                        # Smooth data
-                        #ismo = ndimage.gaussian_filter(co.data, sigma=0.1, order=0)
-                        #ismo = co.data
-                        if nx0 > 2 * nx:
-                            from reproject import reproject_interp
-                            from astropy.io import fits
-                            hdu = fits.PrimaryHDU(ima.oimage)
-                            hdu.header.extend(ima.wcs.to_header())
-                            hdu0 = fits.PrimaryHDU(co.data)
-                            hdu0.header.extend(co.wcs.to_header())
-                            array, footprint = reproject_interp(hdu0, hdu.header)
-                            ima.contour = ima.axes.contour(array, levs, colors=self.colorContour[0])
-                        else:
-                            ima.contour = ima.axes.contour(co.data, levs, colors=self.colorContour[0],
-                                                           transform=ima.axes.get_transform(co.wcs))
+                        self.drawOtherContours(ima, ima.contour0)
                         ima.contour0 = None
                 ima.fig.canvas.draw_idle()
                 ima.changed = False
@@ -950,6 +1168,64 @@ class GUI (QMainWindow):
                 self.blink = 'on'
                 self.timer.start(1000)
         
+    def drawOtherContours(self, ima, itab):
+        """Draw on the image ima the contours of the image in tab itab using cached lines."""
+        ic0 = self.ici[itab]
+        ih0 = self.ihi[itab]
+        levels = list(ih0.levels)
+        # Consider only the part visible in the image
+        x = ima.axes.get_xlim()
+        y = ima.axes.get_ylim()
+        viewport = tuple(np.round(np.concatenate([x, y])).astype(int))
+        # The key holds the canvas and the WCS, so they cannot be confused with new ones
+        key = (ic0, ic0.version, ima.wcs, viewport)
+        if self.contourCache.get(key) is None:
+            data, wcs = self.contourData(ima, ic0, x, y)
+            self.contourCache.add(key, data, wcs)
+        lines = self.contourCache.lines(key, levels)
+        if not isinstance(ima.contour, ContourLines) or ima.contourKey != key:
+            if ima.contour is not None:
+                for coll in ima.contour.collections:
+                    coll.remove()
+            wcs = self.contourCache.get(key)['wcs']
+            if wcs is None:
+                transform = None
+            else:
+                transform = ima.axes.get_transform(wcs)
+            ima.contour = ContourLines(ima.axes, self.colorContour[0], transform)
+            ima.contourKey = key
+        # Only new or moved levels are added
+        ima.contour.update(levels, {l: lines[l] for l in ima.contour.missing(levels)})
+
+    def contourData(self, ima, ic0, x, y):
+        """Part of the image ic0 visible in the image ima and its WCS (None if reprojected)."""
+        from astropy.nddata import Cutout2D
+        x = [x[0], x[1], x[1], x[0]]
+        y = [y[0], y[0], y[1], y[1]]
+        x, y = pix2pix(ima.wcs, ic0.wcs, x, y)
+        x = np.array(x)
+        y = np.array(y)
+        x = [np.min(x), np.max(x)]
+        y = [np.min(y), np.max(y)]
+        center =  ((x[0]+x[1])*0.5,(y[0]+y[1])*0.5)
+        size = (np.abs((y[1]-y[0]).astype(int)),np.abs((x[1]-x[0]).astype(int)))
+        co = Cutout2D(ic0.oimage, center, size, wcs=ic0.wcs, mode='partial')
+        # If the contour image is much larger, lower the resolution
+        # to speed-up the computation
+        ny0, nx0 = np.shape(co.data)
+        ny, nx = np.shape(ima.oimage)
+        if nx0 > 2 * nx:
+            from reproject import reproject_interp
+            from astropy.io import fits
+            hdu = fits.PrimaryHDU(ima.oimage)
+            hdu.header.extend(ima.wcs.to_header())
+            hdu0 = fits.PrimaryHDU(co.data)
+            hdu0.header.extend(co.wcs.to_header())
+            array, footprint = reproject_interp(hdu0, hdu.header)
+            return array, None
+        else:
+            return co.data, co.wcs
+
     def onChangeIntensity(self, event):
         itab = self.itabs.currentIndex()
         ic = self.ici[itab]
@@ -958,6 +1234,25 @@ class GUI (QMainWindow):
         ic.image.set_clim(ih.limits)
         ic.fig.canvas.draw_idle()
 
+    def updateHistogram(self, itab):
+        """Compute in a thread the histogram of the image displayed in a tab."""
+        self.histogramThread.submit(itab, self.ici[itab].oimage)
+
+    def onHistogramReady(self, result):
+        """Draw the histogram computed by the thread and apply its intensity limits."""
+        itab, image, data = result
+        # Discard histograms of images no more displayed
+        if itab >= len(self.ici) or self.ici[itab].oimage is not image:
+            return
+        ic = self.ici[itab]
+        ih = self.ihi[itab]
+        ih.showHistogram(data)
+        ic.image.set_clim(ih.limits)
+        if itab == self.itabs.currentIndex():
+            ic.fig.canvas.draw_idle()
+        else:
+            ic.changed = True
+
     def onHelp(self, event):
         import webbrowser
         webbrowser.open('file://'+os.path.abspath(os.path.join(self.path0,'help','Help.html')))
@@ -1006,6 +1301,7 @@ class GUI (QMainWindow):
             # Pan using the mouse middle button
             itab = self.itabs.currentIndex()
             ic = self.ici[itab]
+            ic.panImage(True)
             xlim = np.asarray(ic.axes.get_xlim())
             ylim = np.asarray(ic.axes.get_ylim())
             x = xlim - dx
@@ -1049,17 +1345,15 @@ class GUI (QMainWindow):
         aper0 = ic0.photApertures[nap]
         if aper.type == 'Polygon':
             verts = aper.poly.get_xy()
-            adverts = np.array([(ic.wcs.all_pix2world(x, y, 0)) for (x,y) in verts])                
-            verts = [(ic0.wcs.all_world2pix(ra, dec, 0)) for (ra,dec) in adverts]
-            aper0.poly.set_xy(verts)
+            x, y = pix2pix(ic.wcs, ic0.wcs, verts[:,0], verts[:,1])
+            aper0.poly.set_xy(np.c_[x, y])
         elif aper.type in ['Ellipse', 'Circle']:
             x0,y0 = aper.ellipse.center
             w0    = aper.ellipse.width
             h0    = aper.ellipse.height
             angle = aper.ellipse.angle
-            ra0,dec0 = ic.wcs.all_pix2world(x0, y0, 0)
             ws = w0 * ic.pixscale; hs = h0 * ic.pixscale
-            x0,y0 = ic0.wcs.all_world2pix(ra0, dec0, 0)
+            x0,y0 = pix2pix(ic.wcs, ic0.wcs, x0, y0)
             w0 = ws/ic0.pixscale; h0 = hs/ic0.pixscale
             aper0.ellipse.center = x0, y0
             aper0.ellipse.width = w0
@@ -1070,9 +1364,8 @@ class GUI (QMainWindow):
             w0    = aper.rect.get_width()
             h0    = aper.rect.get_height()
             angle = aper.rect.angle
-            ra0,dec0 = ic.wcs.all_pix2world(x0, y0, 0)
             ws = w0 * ic.pixscale; hs = h0 * ic.pixscale
-            x0,y0 = ic0.wcs.all_world2pix(ra0, dec0, 0)
+            x0,y0 = pix2pix(ic.wcs, ic0.wcs, x0, y0)
             w0 = ws/ic0.pixscale; h0 = hs/ic0.pixscale
             aper0.rect.set_xy((x0,y0))
             aper0.rect.set_width(w0)
@@ -1171,7 +1464,7 @@ class GUI (QMainWindow):
             path = aperture.get_path()
             transform = aperture.get_patch_transform()
             npath = transform.transform_path(path)
-            inpoints = s.points[npath.contains_points(s.points)]
+            inpoints = s.mask.select(s.points[npath.contains_points(s.points)])
             xx,yy = inpoints.T
             # If tab is pix, then compute the center to decide which Voronoi cells it belongs
             if istab == 1:
@@ -1242,8 +1535,7 @@ class GUI (QMainWindow):
                     # Get the pixel of the auxiliary cube from aperture pixel in an image
                     x0, y0 = aperture.get_xy()
                     ic0 = self.ici[0]
-                    ra0, dec0 = ic0.wcs.all_pix2world(x0, y0, 0) 
-                    xxa, yya = self.auxSpecCube1.wcs.all_world2pix(ra0, dec0, 0)
+                    xxa, yya = pix2pix(ic0.wcs, self.auxSpecCube1.wcs, x0, y0)
                     xxa = int (xxa // 1)
                     yya = int (yya // 1)
                     try:
@@ -1307,6 +1599,9 @@ class GUI (QMainWindow):
                                       lines=lines, noise=noise, ncell=ncell)
            
     def onDraw(self,event):
+        if event.button == 2 and len(self.ici) > 0:
+            # End of panning: back to the level of detail of the zoom
+            self.ici[self.itabs.currentIndex()].panImage(False)
         if len(self.ici) <= 1:
             return
         itab = self.itabs.currentIndex()
@@ -1333,13 +1628,12 @@ class GUI (QMainWindow):
                 w0    = aper.ellipse.width
                 h0    = aper.ellipse.height
                 angle = aper.ellipse.angle
-                ra0, dec0 = ic.wcs.all_pix2world(x0, y0, 0)
                 ws = w0 * ic.pixscale; hs = h0 * ic.pixscale
                 for ima in ici:
-                    x0,y0 = ima.wcs.all_world2pix(ra0, dec0, 0)
+                    x1,y1 = pix2pix(ic.wcs, ima.wcs, x0, y0)
                     w0 = ws/ima.pixscale; h0 = hs / ima.pixscale
                     ap = ima.photApertures[ntab]
-                    ap.ellipse.center = x0, y0
+                    ap.ellipse.center = x1, y1
                     ap.ellipse.width = w0
                     ap.ellipse.height = h0
                     ap.ellipse.angle = angle - ic.crota2 + ima.crota2
@@ -1350,14 +1644,13 @@ class GUI (QMainWindow):
                 w0    = aper.rect.get_width()
                 h0    = aper.rect.get_height()
                 angle = aper.rect.angle
-                ra0,dec0 = ic.wcs.all_pix2world(x0, y0, 0)
                 ws = w0 * ic.pixscale; hs = h0 * ic.pixscale
                 for ima in ici:
-                    x0,y0 = ima.wcs.all_world2pix(ra0, dec0, 0)
+                    x1,y1 = pix2pix(ic.wcs, ima.wcs, x0, y0)
                     w0 = ws / ima.pixscale
                     h0 = hs / ima.pixscale
                     ap = ima.photApertures[ntab]
-                    ap.rect.set_xy((x0,y0))
+                    ap.rect.set_xy((x1,y1))
                     ap.rect.set_width(w0)
                     ap.rect.set_height(h0)
                     ap.rect.angle = angle  - ic.crota2 + ima.crota2
@@ -1365,11 +1658,10 @@ class GUI (QMainWindow):
                     ima.changed = True
             elif aper.type == 'Polygon':
                 verts = aper.poly.get_xy()
-                adverts = np.array([(ic.wcs.all_pix2world(x, y, 0)) for (x, y) in verts])                
                 for ima in ici:
-                    verts = [(ima.wcs.all_world2pix(ra, dec, 0)) for (ra, dec) in adverts]
+                    x, y = pix2pix(ic.wcs, ima.wcs, verts[:,0], verts[:,1])
                     ap = ima.photApertures[ntab]
-                    ap.poly.set_xy(verts)
+                    ap.poly.set_xy(np.c_[x, y])
                     ap.updateMarkers()
                     ima.changed = True
 
@@ -1404,11 +1696,10 @@ class GUI (QMainWindow):
         ic.fig.canvas.draw_idle()
         ici = self.ici.copy()
         ici.remove(ic)
-        ra, dec = ic.wcs.all_pix2world(x, y, 0)
         for ima in ici:
-            x,y = ima.wcs.all_world2pix(ra, dec, 0)
-            ima.axes.set_xlim(x)
-            ima.axes.set_ylim(y)
+            xi,yi = pix2pix(ic.wcs, ima.wcs, x, y)
+            ima.axes.set_xlim(xi)
+            ima.axes.set_ylim(yi)
             ima.changed = True
 
     def onDraw2(self,event):
@@ -1834,7 +2125,15 @@ class GUI (QMainWindow):
             self.kernel1.setChecked(k1)
             self.kernel5.setChecked(k5)
             self.kernel9.setChecked(k9)
-            self.ncells = int(regions)   # Number of Voronoi cells
+            if regions == 'S/N':
+                target, okPressed = QInputDialog.getDouble(self, 'Adaptive regions',
+                                                           'Target S/N of the regions',
+                                                           10., 1., 1000., 1)
+                if not okPressed:
+                    return
+                self.computeBins(target)
+            else:
+                self.ncells = int(regions)   # Number of Voronoi cells
             print('selected ', self.ncells, ' regions')
             sc.abslines = int(ablines)  # Number of absorption lines
             sc.emslines = int(emlines)  # Number of emission lines
@@ -1842,7 +2141,9 @@ class GUI (QMainWindow):
             # Create tessellation
             nx = self.specCube.nx
             ny = self.specCube.ny
-            if self.ncells == 1:
+            if regions == 'S/N':
+                pass
+            elif self.ncells == 1:
                 self.sites = np.array([[nx // 2, ny // 2]])
             elif self.ncells == 4:
                 dx = nx // 3
@@ -2053,32 +2354,77 @@ class GUI (QMainWindow):
         self.ncells = len(self.sites)
         print('Computed ', self.ncells, ' regions')
 
+    def computeBins(self, target):
+        """Compute the sites of regions reaching a target S/N (Voronoi binning)."""
+        s = self.specCube
+        signal, noise = signalNoiseMaps(s.flux, getattr(s, 'eflux', None))
+        mask = np.isfinite(signal) & np.isfinite(noise) & (noise > 0) & ~s.mask.mask
+        self.sb.showMessage("Computing regions with S/N " + str(target), 2000)
+        bins = VoronoiBinning(signal, noise, target, mask)
+        if len(bins.sites) < 4:
+            # Too few bins for a tessellation
+            self.sites = np.array([[s.nx // 2, s.ny // 2]])
+        else:
+            self.sites = bins.sites
+        self.ncells = len(self.sites)
+        print('Computed ', self.ncells, ' regions with S/N ', target)
+
+    def cachedCells(self, name, key, compute):
+        """
+        Spectra of cells kept until a quantity of the key changes. The key holds the arrays
+        (compared by identity), so they cannot be confused with new ones.
+        """
+        if self.cells is None:
+            self.cells = {}
+        old = self.cells.get(name)
+        if old is None or len(old[0]) != len(key) or any(
+                a is not b if isinstance(b, np.ndarray) else a != b for a, b in zip(old[0], key)):
+            self.cells[name] = (key, compute())
+        return self.cells[name][1]
+
+    def cellSpectra(self):
+        """Spectra of the Voronoi cells (computed again if the cells, the cube, or the mask change)."""
+        s = self.specCube
+        return self.cachedCells('flux', (self.regions, s.flux, s.mask.version),
+                                lambda: CellSpectra(s.flux, self.regions, s.mask.mask))
+
+    def lineCellSpectra(self, labels):
+        """
+        Spectra without continuum of the cells restricted to the pixels to fit (labels).
+        The pixels depend on cells, exposure, and mask, so these are part of the key.
+        """
+        s = self.specCube
+        key = (self.regions, s.flux, s.exposure, self.continuum, s.mask.version)
+        return self.cachedCells('lines', key,
+                                lambda: CellSpectra(s.flux, labels, subtract=self.continuum))
+
     def updateKDTree(self, event):
         """React to modification of Voronoi cells."""
         sc = self.sci[self.spectra.index('Pix')]
-        nx = self.specCube.nx
-        ny = self.specCube.ny
         self.sites = self.VI.sites
+        # The tree of the sites is small, but only the pixels near the modified site are relabelled
+        # (on a copy, so the cached spectra of the cells are recomputed)
         self.tree = KDTree(self.sites)
-        tq = self.tree.query(self.specCube.points)
-        self.regions = tq[1].reshape(ny, nx)
+        self.regions = updateRegions(self.regions.copy(), self.sites, self.VI.edit,
+                                     self.VI.neighbours, self.VI.oldNeighbours)
         self.ncells = len(self.sites)
         if event == 'voronoi modified':
             print('number of cells is now ', self.ncells)
             pass
         elif event == 'one voronoi site added':
             try:
-                # Add to the list the last value
-                newguess = sc.xguess[-1]
+                # The new site has the guess of the previous one
+                ind = self.VI.edit[1]
+                newguess = sc.xguess[ind - 1]
                 print('Adding guess ', newguess)
-                sc.xguess.append(newguess)
+                sc.xguess.insert(ind, newguess)
                 if len(sc.lines) > 0:
                     for line in sc.lines:
                         if line is None:
                             pass
                         else:
-                            newguess = sc.lguess[line.n][-1]
-                            sc.lguess[line.n].append(newguess)
+                            newguess = sc.lguess[line.n][ind - 1]
+                            sc.lguess[line.n].insert(ind, newguess)
             except BaseException:
                 message = 'Please, define the continuum guess !'
                 self.sb.showMessage(message, 4000)
@@ -2367,6 +2713,8 @@ class GUI (QMainWindow):
                     self.fitLinesRegion()
                 elif loption == 'All':
                     self.fitLinesAll()
+                elif loption == 'Bins':
+                    self.fitLinesBins()
         else:
             message = 'Define a guess for the continuum on the spectrum panel'
             self.sb.showMessage(message, 4000)
@@ -2456,14 +2804,9 @@ class GUI (QMainWindow):
                 mask[i2:i3] = True
                 self.C0 = np.nanmedian(self.specCube.flux[mask,:,:], axis=0)
             else:
-                # Otherwise, find the regions
-                for ncell in range(self.ncells):
-                    i0, i1, i2, i3 = self.getContinuumGuess(ncell)
-                    mask = np.zeros(len(self.specCube.flux), dtype=bool)
-                    mask[i0:i1] = True
-                    mask[i2:i3] = True
-                    j, i = np.where(self.regions == ncell)
-                    self.C0[j, i] = np.nanmedian((self.specCube.flux[:, j, i])[mask,:], axis=0)
+                # Otherwise, use the windows of the regions
+                windows = [self.getContinuumGuess(ncell) for ncell in range(self.ncells)]
+                self.C0[:] = windowMedian(self.specCube.flux, self.regions, windows)
         self.continuum = np.broadcast_to(self.C0, np.shape(self.specCube.flux))
         self.Cs = self.C0.copy() * 0. # Set all slopes to 0
         self.refreshContinuum()
@@ -2497,16 +2840,12 @@ class GUI (QMainWindow):
                     sflux = np.sort(self.specCube.flux[i0:i3, :, :], axis=0)
                 self.C0 = np.nanmedian(sflux[0:npc, :, :], axis=0)
             else:
-                # Otherwise, find the regions
-                for ncell in range(self.ncells):
-                    i0, i1, i2, i3 = self.getContinuumGuess(ncell)
-                    j, i = np.where(self.regions == ncell)
-                    npc = (i3-i0) // n 
-                    if uncorrected:
-                        sflux = np.sort(self.specCube.uflux[i0:i3,j,i], axis=0)
-                    else:
-                        sflux = np.sort(self.specCube.flux[i0:i3,j,i], axis=0)
-                    self.C0[j, i] = np.nanmedian(sflux[0:npc,:], axis=0)
+                # Otherwise, use the windows of the regions
+                windows = [self.getContinuumGuess(ncell) for ncell in range(self.ncells)]
+                if uncorrected:
+                    self.C0[:] = windowMedian(self.specCube.uflux, self.regions, windows, n)
+                else:
+                    self.C0[:] = windowMedian(self.specCube.flux, self.regions, windows, n)
         # If uncorrected, put to zero positive offsets
         if uncorrected:
             idx = self.C0 > 0
@@ -2520,14 +2859,15 @@ class GUI (QMainWindow):
         """Refresh the plotted image of the continuuum."""
         itab = self.bands.index('C0')
         ic = self.ici[itab]
+        # C0 could have been modified in place
+        invalidateStatistics(self.C0)
+        self.touchProducts('C0')
         ic.showImage(image=self.C0)
         ic.image.format_cursor_data = lambda z: "{:.2e} Jy".format(float(z))        
         ih = self.ihi[itab]
         ih.compute_initial_figure(image = self.C0)
-        ih.update_figure(image = self.C0)
+        self.updateHistogram(itab)
         self.addContours(ic)
-        # Update limits of image
-        ic.image.set_clim(ih.limits)
         ic.changed = True
         # Update continuum on pixel tab
         sc = self.sci[self.spectra.index('Pix')]
@@ -2629,8 +2969,7 @@ class GUI (QMainWindow):
                 ic.image.format_cursor_data = lambda z: "{:.1f} km/s".format(float(z))
                 ih = self.ihi[itab]
                 ih.compute_initial_figure(image = sb)
-                ih.update_figure(image = sb)
-                ic.image.set_clim(ih.limits)
+                self.updateHistogram(itab)
                 # Adopt same limits as flux image
                 ic0=self.ici[0]
                 ic.image.axes.set_xlim(ic0.image.axes.get_xlim())
@@ -2732,10 +3071,8 @@ class GUI (QMainWindow):
             # Transform into original cube coordinates
             ic = self.ici[itab]
             ic0 = self.ici[0]
-            ra1,dec1 = ic.wcs.all_pix2world(x1, y1, 0)
-            ra2,dec2 = ic.wcs.all_pix2world(x2, y2, 0)
-            x1,y1 = ic0.wcs.all_world2pix(ra1, dec1, 0)
-            x2,y2 = ic0.wcs.all_world2pix(ra2, dec2, 0)
+            x1,y1 = pix2pix(ic.wcs, ic0.wcs, x1, y1)
+            x2,y2 = pix2pix(ic.wcs, ic0.wcs, x2, y2)
         # Disactive the selector
         self.disactiveSelectors()
         # Untoggle pixel marker
@@ -2792,8 +3129,14 @@ class GUI (QMainWindow):
         points = np.c_[xi, yi]
         # Continuum mask
         self.continuumMask(points, True)
-        # Fit
-        self.fitContinuum(points)
+        # Fit (resumed from the checkpoint if interrupted)
+        sc = self.sci[self.spectra.index('Pix')]
+        t2j = self.specCube.Tb2Jy if self.specCube.instrument == 'GREAT' else 1.
+        inputs = {'Cmask': self.Cmask, 'exposure': self.specCube.exposure, 'kernel': self.kernel,
+                  'slope': sc.guess.slope, 'intcpt': sc.guess.intcpt,
+                  'positive': self.positiveContinuum}
+        checkpoint = self.fitCheckpoint('continuum', inputs, 'C0', lambda a: a['C0'] * t2j)
+        self.runFit(checkpoint, lambda: self.fitContinuum(points, checkpoint))
         # Set flag
         self.fitcont = True
 
@@ -2850,18 +3193,26 @@ class GUI (QMainWindow):
                     self.Cmask[:,j,i] = 0
                     self.Cmask[i0:i1,j,i] = 1
                     self.Cmask[i2:i3,j,i] = 1
+        self.touchProducts('Cmask')
         print('Continuum mask computed')
         # Eventually apply smoothing on the borders of the xguess map to avoid sudden change of continuum
 
-    def fitContinuum(self, points):
+    def fitContinuum(self, points, checkpoint=None):
         """Fit the continuum on a selected set of points."""
+        # Skip the masked pixels
+        points = self.specCube.mask.select(points)
         sc = self.sci[self.spectra.index('Pix')]
         intcp = sc.guess.intcpt
         slope = sc.guess.slope
-        c, c0, cs = multiFitContinuum(self.Cmask, self.specCube.wave, self.specCube.flux,
+        # The cubes are already averaged over the kernel
+        flux, exposure = self.kernelCubes()
+        c, c0, cs = multiFitContinuum(self.Cmask, self.specCube.wave, flux,
                                   self.continuum, self.C0, self.specCube.l0,
                                   points, slope, intcp, self.positiveContinuum,
-                                  self.kernel, exp=self.specCube.exposure)
+                                  1, exp=exposure, checkpoint=checkpoint)
+        # Release the averaged cubes
+        del flux, exposure
+        self.smoothed = None
         self.continuum = c
         print('max continuum is ',np.nanmax(self.continuum))
         self.C0 = c0
@@ -2877,10 +3228,8 @@ class GUI (QMainWindow):
         ic.image.format_cursor_data = lambda z: "{:.2e} Jy".format(float(z))        
         ih = self.ihi[itab]
         ih.compute_initial_figure(image=self.C0*t2j)
-        ih.update_figure(image=self.C0*t2j)
+        self.updateHistogram(itab)
         self.addContours(ic)
-        # Update limits of image
-        ic.image.set_clim(ih.limits)
         # Adopt same limits as flux image
         ic0 = self.ici[0]
         ic.image.axes.set_xlim(ic0.image.axes.get_xlim())
@@ -2913,8 +3262,11 @@ class GUI (QMainWindow):
         self.defineMoments()
         # Compute moment mask
         self.momentsMask(points, True)
-        # Compute moments
-        self.computeMoments(points)
+        # Compute moments (resumed from the checkpoint if interrupted)
+        t2j = self.specCube.Tb2Jy if self.specCube.instrument == 'GREAT' else 1.
+        inputs = {'Mmask': self.Mmask, 'continuum': self.continuum}
+        checkpoint = self.fitCheckpoint('moments', inputs, 'M0', lambda a: a['M0'] * t2j)
+        self.runFit(checkpoint, lambda: self.computeMoments(points, checkpoint))
 
 
     def defineMoments(self):
@@ -2996,6 +3348,15 @@ class GUI (QMainWindow):
         # Compute moments
         self.computeMoments(points)
         
+    def kernelCubes(self):
+        """Flux and exposure cubes averaged over the current kernel (kept until the fit ends)."""
+        s = self.specCube
+        key = (self.kernel, id(s.flux), id(s.exposure))
+        if self.smoothed is None or self.smoothed[0] != key:
+            self.smoothed = (key, smoothCube(s.flux, self.kernel), smoothCube(s.exposure, self.kernel),
+                             s.flux, s.exposure)
+        return self.smoothed[1], self.smoothed[2]
+
     def computeMomentsRegion(self):
         """Fit continuum inside region occupied by the cursor."""
         # position of the cursor
@@ -3043,6 +3404,15 @@ class GUI (QMainWindow):
             print('There are no defined regions')
             return
 
+        # Fit resumed from the checkpoint if interrupted
+        inputs = {'continuum': self.continuum, 'regions': self.regions,
+                  'guesses': guessesInfo(self)}
+        checkpoint = self.fitCheckpoint('lines', inputs, 'L0', lambda a: a['lines'][0][2])
+        self.runFit(checkpoint, lambda: self.fitLinesCells(checkpoint))
+        self.fitLinesDisplay()
+
+    def fitLinesCells(self, checkpoint=None):
+        """Fit the lines in each cell with its guesses."""
         for ncell in range(self.ncells):
             exp = np.nansum(self.specCube.exposure, axis=0)
             mask = (self.regions == ncell) & (exp > 0)
@@ -3060,8 +3430,7 @@ class GUI (QMainWindow):
                 # Compute the mask
                 self.momentsMask(points)
                 # Fit the lines inside the cell
-                self.fitLinesOnly(points, ncell)  
-        self.fitLinesDisplay()
+                self.fitLinesOnly(points, ncell, checkpoint)
         
         
     def fitLinesRegion(self):
@@ -3143,17 +3512,21 @@ class GUI (QMainWindow):
                     i0, i1, i2, i3 = self.getContinuumGuess(ncell)
                     self.Mmask[:,j,i] = 0
                     self.Mmask[i1:i2,j,i] = 1
+        self.touchProducts('Mmask')
         print('Moment mask computed')
         # Eventually apply smoothing on the borders of the xguess map to avoid sudden change of continuum
 
-    def computeMoments(self, points):
+    def computeMoments(self, points, checkpoint=None):
         """Compute moments and velocities."""
+        # Skip the masked pixels
+        points = self.specCube.mask.select(points)
         m = self.Mmask
         moments = [self.M0, self.M1, self.M2, self.M3, self.M4]
         f = self.specCube.flux
         w = self.specCube.wave
         c = self.continuum
-        moments, self.noise = multiComputeMoments(m, w, f, c, moments,points)
+        moments, self.noise = multiComputeMoments(m, w, f, c, moments, points, checkpoint)
+        self.touchProducts('M0', 'M1', 'M2', 'M3', 'M4')
         self.M0, self.M1, self.M2, self.M3, self.M4 = moments
         # Refresh the plotted images
         #bands = ['M0', 'M1', 'M2', 'M3', 'M4']
@@ -3179,9 +3552,8 @@ class GUI (QMainWindow):
                 ic.image.format_cursor_data = lambda z: "{:.2e} ".format(float(z))
             ih = self.ihi[itab]
             ih.compute_initial_figure(image=sb)
-            ih.update_figure(image=sb)
+            self.updateHistogram(itab)
             self.addContours(ic)
-            ic.image.set_clim(ih.limits)
             # Adopt same limits as flux image
             ic0 = self.ici[0]
             ic.image.axes.set_xlim(ic0.image.axes.get_xlim())
@@ -3210,6 +3582,8 @@ class GUI (QMainWindow):
         
     def fitLines(self, points):
         """Fit lines inside a defined region."""
+        # Skip the masked pixels
+        points = self.specCube.mask.select(points)
         m = self.Mmask
         # Find cell and guesses
         sc = self.sci[self.spectra.index('Pix')]
@@ -3226,6 +3600,7 @@ class GUI (QMainWindow):
         w = self.specCube.wave
         c = self.continuum
         multiFitLines(m, w, f, c, lineguesses, sc.model, self.lines, points)
+        self.touchProducts('lines')
         #multiFitLinesSingle(m, w, f, c, lineguesses, sc.model, self.lines, points) # Test only
         print('Number of lines ', len(self.lines))
         # Update L0 and L1 (first two lines)
@@ -3258,9 +3633,8 @@ class GUI (QMainWindow):
                 ic.image.format_cursor_data = lambda z: "{:.2f} km/s".format(float(z))
             ih = self.ihi[itab]
             ih.compute_initial_figure(image=sb)
-            ih.update_figure(image=sb)
+            self.updateHistogram(itab)
             self.addContours(ic)
-            ic.image.set_clim(ih.limits)
             # Adopt same limits as flux image
             ic0 = self.ici[0]
             ic.image.axes.set_xlim(ic0.image.axes.get_xlim())
@@ -3288,8 +3662,10 @@ class GUI (QMainWindow):
         sc.updateSpectrum(cont=self.continuum[:, j, i], cslope=self.Cs[j, i], lines=lines)
         sc.fig.canvas.draw_idle()
         
-    def fitLinesOnly(self, points, ncell):
+    def fitLinesOnly(self, points, ncell, checkpoint=None):
         """Fit lines inside a defined region."""
+        # Skip the masked pixels
+        points = self.specCube.mask.select(points)
         m = self.Mmask
         # Find cell and guesses
         sc = self.sci[self.spectra.index('Pix')]
@@ -3300,8 +3676,107 @@ class GUI (QMainWindow):
         f = self.specCube.flux
         w = self.specCube.wave
         c = self.continuum
-        multiFitLines(m, w, f, c, lineguesses, sc.model, self.lines, points)
+        multiFitLines(m, w, f, c, lineguesses, sc.model, self.lines, points, checkpoint)
+        self.touchProducts('lines')
         #multiFitLinesSingle(m, w, f, c, lineguesses, sc.model, self.lines, points) # Test only
+        self.lineMaps()
+
+    def fitCheckpoint(self, task, inputs, band, image):
+        """
+        Checkpoint of a fit over the cube, saved next to the cube. Its key identifies the
+        cube and the inputs of the fit (arrays are identified by their checksum).
+        Each time it is saved, image(arrays) is displayed on the band to show the pixels done.
+        """
+        s = self.specCube
+        key = {'task': task, 'shape': [s.nz, s.ny, s.nx], 'flux': arrayChecksum(s.flux)}
+        for name, value in inputs.items():
+            key[name] = arrayChecksum(value) if isinstance(value, np.ndarray) else value
+        update = lambda arrays: self.showProgress(band, image(arrays))
+        return Checkpoint(s.filename + '.' + task + '.ckpt', key, self.checkpointInterval, update)
+
+    def runFit(self, checkpoint, fit):
+        """
+        Run a fit over the cube. If it is interrupted, the pixels done are saved in the
+        checkpoint, which is removed once the fit is complete. While the fit runs, the
+        interface is refreshed without taking user input or snapshots of the session.
+        """
+        self.fitRunning = True
+        try:
+            fit()
+        except BaseException:
+            checkpoint.save()
+            raise
+        finally:
+            self.fitRunning = False
+        checkpoint.remove()
+
+    def showProgress(self, band, image):
+        """Display the pixels already done while a fit over the cube is running."""
+        if band in self.bands:
+            itab = self.bands.index(band)
+            ic = self.ici[itab]
+            ic.showImage(image=image)
+            if itab == self.itabs.currentIndex():
+                ic.fig.canvas.draw_idle()
+            else:
+                ic.changed = True
+        self.sb.showMessage("Fitting the cube, partial results saved ", 2000)
+        # Only repaint: user input would start other operations during the fit
+        QApplication.processEvents(QEventLoop.ExcludeUserInputEvents)
+
+    def fitLinesBins(self):
+        """Fit defined lines on the mean spectrum of each cell (one fit per cell)."""
+        if self.ncells > 1:
+            try:
+                self.removeContours()
+            except BaseException:
+                pass
+        else:
+            print('There are no defined regions')
+            return
+        s = self.specCube
+        sc = self.sci[self.spectra.index('Pix')]
+        exp = np.nansum(s.exposure, axis=0)
+        mask = exp > 0
+        mask[0, :] = False
+        mask[-1, :] = False
+        mask[:, 0] = False
+        mask[:, -1] = False
+        yi, xi = np.where(mask == True)
+        points = s.mask.select(np.c_[xi, yi])
+        self.defineLines()
+        self.momentsMask(points)
+        xi, yi = points.T
+        cells = self.regions[yi, xi]
+        # Mean spectrum without continuum of the pixels of each cell
+        labels = np.full((s.ny, s.nx), -1, dtype=int)
+        labels[yi, xi] = cells
+        mean = self.lineCellSpectra(labels).mean
+        f = np.full((s.nz, self.ncells), np.nan)
+        f[:, :np.shape(mean)[1]] = mean
+        # Moment mask of each cell (the same for all the pixels of a cell)
+        m = np.zeros((s.nz, self.ncells), dtype=bool)
+        for ncell in range(self.ncells):
+            inside = np.flatnonzero(cells == ncell)
+            if len(inside) > 0:
+                m[:, ncell] = self.Mmask[:, yi[inside[0]], xi[inside[0]]]
+        lineguesses = [[guess[ncell] for guess in sc.lguess] for ncell in range(self.ncells)]
+        print('Fitting ', self.ncells, ' cells instead of ', len(points), ' pixels')
+        results = multiFitLinesBins(m, s.wave, f, lineguesses, sc.model)
+        self.touchProducts('lines')
+        # Each pixel gets the fit of its cell
+        for ncell, linepars in enumerate(results):
+            inside = cells == ncell
+            xx = xi[inside]
+            yy = yi[inside]
+            for k in range(len(linepars)):
+                for l in range(7):
+                    self.lines[k][l][yy, xx] = linepars[k][l]
+        self.lineMaps()
+        self.fitLinesDisplay()
+
+    def lineMaps(self):
+        """Maps of intensity, velocity, and FWHM of the fitted lines."""
         # Update L0 and L1 (first two lines)
         self.L0 = self.lines[0][2] # the plane no 2 corresponds to the amplitude
         w0 = self.specCube.l0
@@ -3333,9 +3808,8 @@ class GUI (QMainWindow):
                 ic.image.format_cursor_data = lambda z: "{:.2f} km/s".format(float(z))
             ih = self.ihi[itab]
             ih.compute_initial_figure(image=sb)
-            ih.update_figure(image=sb)
+            self.updateHistogram(itab)
             self.addContours(ic)
-            ic.image.set_clim(ih.limits)
             # Adopt same limits as flux image
             ic0 = self.ici[0]
             ic.image.axes.set_xlim(ic0.image.axes.get_xlim())
@@ -3489,7 +3963,7 @@ class GUI (QMainWindow):
         transform = aperture.get_patch_transform()
         npath = transform.transform_path(path)
         s = self.specCube
-        inpoints = s.points[npath.contains_points(s.points)]
+        inpoints = s.mask.select(s.points[npath.contains_points(s.points)])
         xx,yy = inpoints.T        
         fluxAll = np.nansum(s.flux[:,yy,xx], axis=1)
         if s.instrument == 'GREAT':
@@ -3954,8 +4428,7 @@ class GUI (QMainWindow):
             ymax = np.max(y)
             x = (xmin, xmax, xmin, xmax)
             y = (ymin, ymin, ymax, ymax)
-            ra,dec = ic0.wcs.all_pix2world(x, y, 0)
-            x,y = ic.wcs.all_world2pix(ra, dec, 0)            
+            x,y = pix2pix(ic0.wcs, ic.wcs, x, y)
             xmin = np.min(x)
             xmax = np.max(x)
             ymin = np.min(y)
@@ -4030,10 +4503,9 @@ class GUI (QMainWindow):
                 w0    = aper.ellipse.width
                 h0    = aper.ellipse.height
                 angle = aper.ellipse.angle - ic0.crota2 + ic.crota2
-                ra0,dec0 = ic0.wcs.all_pix2world(x0, y0, 0)
                 ws = w0 * ic0.pixscale; hs = h0 * ic0.pixscale
                 # Add ellipse
-                x0,y0 = ic.wcs.all_world2pix(ra0, dec0, 0)
+                x0,y0 = pix2pix(ic0.wcs, ic.wcs, x0, y0)
                 w0 = ws/ic.pixscale; h0 = hs/ic.pixscale
                 ellipse = EllipseInteractor(ic.axes, (x0,y0),w0,h0,angle)
                 ellipse.type = aper.type
@@ -4048,10 +4520,9 @@ class GUI (QMainWindow):
                 h0    = aper.rect.get_height()
                 #print(type(h0))
                 angle = aper.rect.angle - ic0.crota2 + ic.crota2
-                ra0,dec0 = ic0.wcs.all_pix2world(x0, y0, 0)
                 ws = w0 * ic0.pixscale; hs = h0 * ic0.pixscale
                 # Add rectangle
-                x0,y0 = ic.wcs.all_world2pix(ra0, dec0, 0)
+                x0,y0 = pix2pix(ic0.wcs, ic.wcs, x0, y0)
                 w0 = ws/ic.pixscale; h0 = hs/ic.pixscale
                 rectangle = RectangleInteractor(ic.axes, (x0,y0),w0,h0,angle)
                 rectangle.type = aper.type
@@ -4064,8 +4535,8 @@ class GUI (QMainWindow):
                 rectangle.modSignal.connect(self.onModifiedAperture)
             elif aper.type == 'Polygon':
                 verts = aper.poly.get_xy()
-                adverts = np.array([(ic0.wcs.all_pix2world(x, y, 0)) for (x,y) in verts])
-                verts = [(ic.wcs.all_world2pix(ra, dec, 0)) for (ra,dec) in adverts]
+                x, y = pix2pix(ic0.wcs, ic.wcs, verts[:,0], verts[:,1])
+                verts = np.c_[x, y]
                 # Add polygon
                 poly = PolygonInteractor(ic.axes,verts)                
                 poly.showverts = aper.showverts
@@ -4078,10 +4549,9 @@ class GUI (QMainWindow):
                 w0    = aper.rect.get_width()
                 h0    = aper.rect.get_height()
                 angle = aper.rect.angle - ic0.crota2 + ic.crota2
-                ra0,dec0 = ic0.wcs.all_pix2world(x0, y0, 0)
                 ws = w0 * ic0.pixscale; hs = h0 * ic0.pixscale
                 # Add rectangle
-                x0,y0 = ic.wcs.all_world2pix(ra0, dec0, 0)
+                x0,y0 = pix2pix(ic0.wcs, ic.wcs, x0, y0)
                 w0 = ws/ic.pixscale; h0 = hs/ic.pixscale
                 pixel = PixelInteractor(ic.axes, (x0,y0), w0)
                 pixel.type = aper.type
@@ -4113,12 +4583,20 @@ class GUI (QMainWindow):
             self.blink = 'off'
             self.timer.stop()
         
+    def closeEvent(self, event):
+        """The window is not closed while a fit over the cube runs."""
+        if self.fitRunning:
+            event.ignore()
+        else:
+            event.accept()
+
     def fileQuit(self):
         """ Quitting the program """
         try:
             self.checkVersion.stop()
         except:
             pass
+        self.autosaveSession(wait=True)
         self.close()
 
     def trimCubeOld(self):  
@@ -4166,9 +4644,10 @@ class GUI (QMainWindow):
             if response == QMessageBox.Yes:
                 self.sb.showMessage("Trimming the cube ", 2000)
                 self.trimCube1D(indmin,indmax)
-                self.saveCube()
-                # Load trimmed cube
-                self.reloadFile()
+                # Display the trimmed cube without reading it again
+                self.openCube()
+                self.initializeCube()
+                self.askSaveCube('trimmed')
             elif QMessageBox.No:
                 self.sb.showMessage("Trimming aborted ", 2000)
             else:
@@ -4196,59 +4675,38 @@ class GUI (QMainWindow):
             if response == QMessageBox.Yes:
                 self.sb.showMessage("Cropping the cube ", 2000)
                 self.cropCube2D(center,size)
-                self.saveCube()
-                # Load cropped cube
-                self.reloadFile()
+                # Display the cropped cube without reading it again
+                self.openCube()
+                self.initializeCube()
+                self.askSaveCube('cropped')
             elif response == QMessageBox.No:
                 self.sb.showMessage("Cropping aborted ", 2000)
             else:
                 pass
 
+    def askSaveCube(self, operation):
+        """Propose to save the modified cube (written in the background)."""
+        flags = QMessageBox.Yes | QMessageBox.No
+        question = "Do you want to save the " + operation + " cube ?"
+        response = QMessageBox.question(self, "Question", question, flags)
+        if response == QMessageBox.Yes:
+            self.saveCube()
+
     def cropCube2D(self, center, size):
         """ Generate cropped cube """
         from astropy.nddata import Cutout2D
         ic0 = self.ici[0]
         co = Cutout2D(ic0.oimage,center,size,wcs=ic0.wcs)
         bb = co.bbox_original
-        self.specCube.flux = self.specCube.flux[:,bb[0][0]:bb[0][1]+1,bb[1][0]:bb[1][1]+1]
-        self.specCube.wcs = co.wcs
-        if self.specCube.instrument == 'FIFI-LS':
-            self.specCube.eflux = self.specCube.eflux[:,bb[0][0]:bb[0][1]+1,bb[1][0]:bb[1][1]+1]
-            self.specCube.uflux = self.specCube.uflux[:,bb[0][0]:bb[0][1]+1,bb[1][0]:bb[1][1]+1]
-            self.specCube.euflux = self.specCube.euflux[:,bb[0][0]:bb[0][1]+1,bb[1][0]:bb[1][1]+1]
-            self.specCube.x = self.specCube.x[bb[1][0]:bb[1][1]+1]
-            self.specCube.y = self.specCube.y[bb[0][0]:bb[0][1]+1]
-            self.specCube.exposure = self.specCube.exposure[:,bb[0][0]:bb[0][1]+1,bb[1][0]:bb[1][1]+1]
-        elif self.specCube.instrument == 'PACS':
-            self.specCube.exposure = self.specCube.exposure[:,bb[0][0]:bb[0][1]+1,bb[1][0]:bb[1][1]+1]
-        elif self.specCube.instrument == 'FORCAST':
-            self.specCube.eflux = self.specCube.eflux[:,bb[0][0]:bb[0][1]+1,bb[1][0]:bb[1][1]+1]
-            self.specCube.exposure = self.specCube.exposure[:,bb[0][0]:bb[0][1]+1,bb[1][0]:bb[1][1]+1]
-        # Create a grid of points
-        nz,ny,nx = np.shape(self.specCube.flux)
-        xi = np.arange(nx); yi = np.arange(ny)
-        xi,yi = np.meshgrid(xi,yi)
-        self.points = np.array([np.ravel(xi),np.ravel(yi)]).transpose()
+        # Views of the original cubes (no copy)
+        cropSpectralCube(self.specCube, bb[0][0], bb[0][1]+1, bb[1][0], bb[1][1]+1)
+        self.resetCubeCaches()
 
     def trimCube1D(self,xmin,xmax):
         """ Generate trimmed cube """
-        self.specCube.flux = self.specCube.flux[xmin:xmax,:,:]
-        self.specCube.wave = self.specCube.wave[xmin:xmax]
-        nz,ny,nx = np.shape(self.specCube.flux)
-        self.specCube.n = nz
-        # Cut the cubes
-        if self.specCube.instrument == 'FIFI-LS':
-            self.specCube.eflux = self.specCube.eflux[xmin:xmax,:,:]
-            self.specCube.uflux = self.specCube.uflux[xmin:xmax,:,:]
-            self.specCube.euflux = self.specCube.euflux[xmin:xmax,:,:]
-            self.specCube.exposure = self.specCube.exposure[xmin:xmax,:,:]
-            self.specCube.atran = self.specCube.atran[xmin:xmax]
-            self.specCube.response = self.specCube.response[xmin:xmax]
-        if self.specCube.instrument == 'PACS':
-            self.specCube.exposure = self.specCube.exposure[xmin:xmax,:,:]
-        if self.specCube.instrument == 'FORCAST':
-            self.specCube.eflux = self.specCube.eflux[xmin:xmax,:,:]
-            self.specCube.exposure = self.specCube.exposure[xmin:xmax,:,:]
+        # Views of the original cubes (no copy)
+        trimSpectralCube(self.specCube, xmin, xmax)
+        self.resetCubeCaches()
 
     def saveFits(self):
         """ Save the displayed image as a FITS file """
@@ -4526,18 +4984,27 @@ class GUI (QMainWindow):
         # Dialog to save file
         fd = QFileDialog()
         fd.setLabelText(QFileDialog.Accept, "Save as")
-        fd.setNameFilters(["Fits Files (*.fits)","All Files (*)"])
+        fd.setNameFilters(fitsNameFilters())
         fd.setOptions(QFileDialog.DontUseNativeDialog)
         fd.setViewMode(QFileDialog.List)            
         if (fd.exec()):
             fileName = fd.selectedFiles()
             outfile = fileName[0]
-            # Update name in cube to allow automatical reloading
-            self.specCube.filename = outfile
+            # Update name in cube, once saved, to allow automatical reloading
+            cube = self.specCube
+            def renameCube(outfile):
+                cube.filename = outfile
+            # The continuum is subtracted while writing the cubes
             if cont and self.continuum is not None:
-                flux = self.specCube.flux - self.continuum
+                continuum = self.continuum
+            else:
+                continuum = None
+            # Masked pixels are saved as NaN
+            if self.specCube.mask.count > 0:
+                mask = self.specCube.mask.mask
             else:
-                flux = self.specCube.flux
+                mask = None
+            flux = self.specCube.flux
             # Reusable header
             header = self.specCube.wcs.to_header()
             header.remove('WCSAXES')
@@ -4576,30 +5043,25 @@ class GUI (QMainWindow):
                 # Primary header
                 hdu = fits.PrimaryHDU()
                 hdu.header.extend(header)
-                if cont and self.continuum is not None:
-                    uflux = self.specCube.uflux - self.continuum
-                else:
-                    uflux = self.specCube.uflux
                 # Extensions
-                hdu1 = self.addExtension(flux,'FLUX','Jy',header)
-                hdu2 = self.addExtension(self.specCube.eflux,'ERROR','Jy',header)
-                hdu3 = self.addExtension(uflux,'UNCORRECTED_FLUX','Jy',header)
-                hdu4 = self.addExtension(self.specCube.euflux,'UNCORRECTED_ERROR','Jy',header)
+                hdu1 = StreamedHDU(flux,'FLUX','Jy',header, subtract=continuum, mask=mask)
+                hdu2 = StreamedHDU(self.specCube.eflux,'ERROR','Jy',header)
+                hdu3 = StreamedHDU(self.specCube.uflux,'UNCORRECTED_FLUX','Jy',header,
+                                   subtract=continuum, mask=mask)
+                hdu4 = StreamedHDU(self.specCube.euflux,'UNCORRECTED_ERROR','Jy',header)
                 hdu5 = self.addExtension(self.specCube.wave,'WAVELENGTH','um',None)
                 hdu6 = self.addExtension(self.specCube.x,'X',None,None)
                 hdu7 = self.addExtension(self.specCube.y,'Y',None,None)
                 hdu8 = self.addExtension(self.specCube.atran,'TRANSMISSION',None,None)
                 hdu9 = self.addExtension(self.specCube.response,'RESPONSE',None,None)
-                hdu10 = self.addExtension(self.specCube.exposure * nexp / exptime,'EXPOSURE_MAP',None,header)
+                hdu10 = StreamedHDU(self.specCube.exposure,'EXPOSURE_MAP',None,header, scale=nexp / exptime)
                 if self.specCube.watran is not None:
                     uatran = np.array([self.specCube.watran, self.specCube.uatran])
                     hdu11 = self.addExtension(uatran,'UNSMOOTHED_TRANSMISSION',None,None)
-                    hdul = fits.HDUList([hdu, hdu1, hdu2, hdu3, hdu4, hdu5, hdu6, hdu7, hdu8, hdu9, hdu10, hdu11])
+                    hdul = [hdu, hdu1, hdu2, hdu3, hdu4, hdu5, hdu6, hdu7, hdu8, hdu9, hdu10, hdu11]
                 else:
-                    hdul = fits.HDUList([hdu, hdu1, hdu2, hdu3, hdu4, hdu5, hdu6, hdu7, hdu8, hdu9, hdu10])            
-                #hdul.info()    
-                hdul.writeto(outfile,overwrite=True) 
-                hdul.close()
+                    hdul = [hdu, hdu1, hdu2, hdu3, hdu4, hdu5, hdu6, hdu7, hdu8, hdu9, hdu10]
+                self.writeFits(hdul, outfile, saved=renameCube)
             elif self.specCube.instrument == 'GREAT':
                 header['OBJECT'] = (self.specCube.objname, 'Object Name')
                 c = 299792458.0  # speed of light in m/s 
@@ -4610,17 +5072,15 @@ class GUI (QMainWindow):
                 #eta_mb =0.67
                 #calib = 971.
                 #factor = calib*eta_fss*eta_mb
-                temperature = flux * self.npix_per_beam #/ factor  # Flux is already a Tb
-                # Primary header
-                hdu = fits.PrimaryHDU(temperature)
+                # Primary header (flux is already a Tb)
                 header['NAXIS'] = (3,'Number of axis')
                 header['BMAJ'] = self.specCube.header['BMAJ']
                 header['BMIN'] = self.specCube.header['BMIN']
                 header['DATAMAX'] = self.specCube.header['DATAMAX']
-                hdu.header.extend(header)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto(outfile,overwrite=True) 
-                hdul.close()
+                hdu = StreamedHDU(flux, header=header, subtract=continuum,
+                                  scale=self.npix_per_beam, mask=mask)
+                hdul = [hdu]
+                self.writeFits(hdul, outfile, saved=renameCube)
             elif self.specCube.instrument == 'FORCAST':
                 header['OBJECT'] = (self.specCube.objname, 'Object Name')
                 c = 299792458.0  # speed of light in m/s 
@@ -4629,13 +5089,12 @@ class GUI (QMainWindow):
                 hdu = fits.PrimaryHDU()
                 hdu.header.extend(header)
                 # Extensions
-                hdu1 = self.addExtension(flux,'FLUX','Jy',header)
-                hdu2 = self.addExtension(self.specCube.eflux**2,'VARIANCE','Jy2',header)
-                hdu3 = self.addExtension(self.specCube.exposure * self.specCube.nz,
-                                         'EXPOSURE', None, header)
-                hdul = fits.HDUList([hdu, hdu1, hdu2, hdu3])
-                hdul.writeto(outfile, overwrite=True) 
-                hdul.close()
+                hdu1 = StreamedHDU(flux,'FLUX','Jy',header, subtract=continuum, mask=mask)
+                hdu2 = StreamedHDU(self.specCube.eflux,'VARIANCE','Jy2',header, power=2)
+                hdu3 = StreamedHDU(self.specCube.exposure, 'EXPOSURE', None, header,
+                                   scale=self.specCube.nz)
+                hdul = [hdu, hdu1, hdu2, hdu3]
+                self.writeFits(hdul, outfile, saved=renameCube)
             elif self.specCube.instrument == 'PACS':
                 """ Experimental """
                 header['NAXIS'] = (3,'Number of axis')
@@ -4646,9 +5105,9 @@ class GUI (QMainWindow):
                 hdu = fits.PrimaryHDU()
                 hdu.header.extend(header)
                 # Extensions
-                hdu1 = self.addExtension(flux,'image','Jy',header)
-                hdu2 = self.addExtension(self.specCube.exposure,'coverage',None,header)
-                hdu3 = self.addExtension(self.specCube.eflux,'error',None,header)
+                hdu1 = StreamedHDU(flux,'image','Jy',header, subtract=continuum, mask=mask)
+                hdu2 = StreamedHDU(self.specCube.exposure,'coverage',None,header)
+                hdu3 = StreamedHDU(self.specCube.eflux,'error',None,header)
                 # Writing the wavelength table
                 wave = [np.array([[x] for x in self.specCube.wave])]
                 layer=np.array([np.arange(len(self.specCube.wave))])
@@ -4659,9 +5118,8 @@ class GUI (QMainWindow):
                 hdw = fits.BinTableHDU.from_columns(coldefs)
                 hdw.header['EXTNAME'] = 'wcs-tab'
                 hdw.header.extend(header)
-                hdul = fits.HDUList([hdu, hdu1, hdu2, hdu3, hdw])            
-                hdul.writeto(outfile,overwrite=True) 
-                hdul.close()
+                hdul = [hdu, hdu1, hdu2, hdu3, hdw]
+                self.writeFits(hdul, outfile, saved=renameCube)
             elif self.specCube.instrument == 'CARMA':
                 # This works only for cropped (not trimmed) cubes
                 header['NAXIS'] = (3,'Number of axis')
@@ -4680,11 +5138,10 @@ class GUI (QMainWindow):
                 header['CRVAL3'] = self.specCube.header['CRVAL3']
                 header['CDELT3'] = self.specCube.header['CDELT3']
                 header['CUNIT3'] = ('m/s','Velocity unit')
-                hdu = fits.PrimaryHDU(flux * self.specCube.npix_per_beam)
-                hdu.header.extend(header)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto(outfile,overwrite=True) 
-                hdul.close()
+                hdu = StreamedHDU(flux, header=header, subtract=continuum,
+                                  scale=self.specCube.npix_per_beam, mask=mask)
+                hdul = [hdu]
+                self.writeFits(hdul, outfile, saved=renameCube)
             elif self.specCube.instrument == 'ALMA':
                 header['NAXIS'] = (3,'Number of axis')
                 c = 299792458.0  # speed of light in m/s 
@@ -4702,13 +5159,11 @@ class GUI (QMainWindow):
                 header['CRVAL3'] = self.specCube.header['CRVAL3']
                 header['CDELT3'] = self.specCube.header['CDELT3']
                 header['CUNIT3'] = self.specCube.header['CUNIT3']
-                # Flip the cube before saving to order in frequency
-                flux = np.flip(flux, axis=0) * self.specCube.npix_per_beam
-                hdu = fits.PrimaryHDU(flux)
-                hdu.header.extend(header)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto(outfile,overwrite=True) 
-                hdul.close()
+                # Flip the cube while saving to order in frequency
+                hdu = StreamedHDU(flux, header=header, subtract=continuum,
+                                  scale=self.specCube.npix_per_beam, flip=True, mask=mask)
+                hdul = [hdu]
+                self.writeFits(hdul, outfile, saved=renameCube)
             elif self.specCube.instrument == 'MMA':
                 header['NAXIS'] = (3,'Number of axis')
                 c = 299792.458  # speed of light in km/s 
@@ -4726,11 +5181,10 @@ class GUI (QMainWindow):
                 header['CRVAL3'] = self.specCube.header['CRVAL3']
                 header['CDELT3'] = self.specCube.header['CDELT3']
                 header['CUNIT3'] = ('km/s','Velocity unit')
-                hdu = fits.PrimaryHDU(flux * self.specCube.npix_per_beam)
-                hdu.header.extend(header)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto(outfile,overwrite=True) 
-                hdul.close()
+                hdu = StreamedHDU(flux, header=header, subtract=continuum,
+                                  scale=self.specCube.npix_per_beam, mask=mask)
+                hdul = [hdu]
+                self.writeFits(hdul, outfile, saved=renameCube)
             elif self.specCube.instrument == 'HALPHA':
                 header['NAXIS'] = (3,'Number of axis')
                 header['OBJECT'] = (self.specCube.objname, 'Object Name')
@@ -4741,14 +5195,33 @@ class GUI (QMainWindow):
                 header['CRVAL3'] = self.specCube.header['CRVAL3']
                 header['CDELT3'] = self.specCube.header['CDELT3']
                 header['CUNIT3'] = ('m/s','Velocity unit')
-                hdu = fits.PrimaryHDU(flux)
-                hdu.header.extend(header)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto(outfile,overwrite=True) 
-                hdul.close()
+                hdu = StreamedHDU(flux, header=header, subtract=continuum, mask=mask)
+                hdul = [hdu]
+                self.writeFits(hdul, outfile, saved=renameCube)
             else:
                 pass  
         
+    def writeFits(self, hdus, outfile, saved=None):
+        """Write the HDUs in a thread, so the interface is not blocked.
+        Files with extension .fz have their image extensions tile compressed.
+        The function saved is called with the name of the file once it is written."""
+        if self.writeThread is not None and self.writeThread.isRunning():
+            # Only one file written at a time
+            self.writeThread.wait()
+        name = os.path.basename(outfile)
+        compression = 'GZIP_2' if outfile.endswith('.fz') else None
+        if compression is not None and not compressionSupported():
+            self.sb.showMessage("Compressed files cannot be written with this version of astropy", 2000)
+            return
+        self.sb.showMessage("Saving " + name + " ... ")
+        self.writeThread = WriteFits(hdus, outfile, compression, parent=self)
+        self.writeThread.progress.connect(
+            lambda percent: self.sb.showMessage("Saving " + name + " ... " + str(percent) + "%"))
+        self.writeThread.sendMessage.connect(lambda message: self.sb.showMessage(message, 2000))
+        if saved is not None:
+            self.writeThread.saved.connect(saved)
+        self.writeThread.start()
+
     def saveLines(self):
         """Save fitted continuum and lines."""
         if self.lines is None:
@@ -4760,14 +5233,14 @@ class GUI (QMainWindow):
             # Dialog to save file
             fd = QFileDialog()
             fd.setLabelText(QFileDialog.Accept, "Save as")
-            fd.setNameFilters(["Fits Files (*.fits)","All Files (*)"])
+            fd.setNameFilters(fitsNameFilters())
             fd.setOptions(QFileDialog.DontUseNativeDialog)
             fd.setViewMode(QFileDialog.List)            
             if (fd.exec()):
                 fileName = fd.selectedFiles()
                 outfile = fileName[0]
                 filename, file_extension = os.path.splitext(outfile)
-                if file_extension != '.fits' :
+                if file_extension not in ['.fits', '.fz']:
                     file_extension = '.fits'
                     outfile = filename + file_extension
                 header = self.specCube.wcs.to_header()
@@ -4792,16 +5265,9 @@ class GUI (QMainWindow):
                     else:
                         istr = ''
                     x, sigma, A, alpha, ex, esigma, eA = line
-                    # Find closest wavelength
-                    ny, nx = np.shape(x)
-                    continuum = np.zeros((ny, nx))
-                    for ix in range(nx):
-                        for iy in range(ny):
-                            if np.isnan(x[iy,ix]):
-                                continuum[iy,ix] = np.nan
-                            else:
-                                wmin = np.argmin(np.abs(x[iy, ix] - w))
-                                continuum[iy,ix] = self.continuum[wmin, iy, ix] * t2j
+                    x = self.specCube.mask.image(x)
+                    # Continuum at the closest wavelength
+                    continuum = continuumAt(x, w, self.continuum) * t2j
                     # Compute FWHM
                     FWHM = 2 * np.sqrt(2*np.log(2)) * sigma
                     #eFWHM = 2 * np.sqrt(2*np.log(2)) * esigma
@@ -4817,9 +5283,7 @@ class GUI (QMainWindow):
                     hdul.append(self.addExtension(eFWHMv,'ERRFWHM'+istr,'km/s',header))
                     hdul.append(self.addExtension(A,'FLUX'+istr,'W/m2',header))
                     hdul.append(self.addExtension(eA,'ERRFLUX'+istr,'W/m2',header))
-                hdul = fits.HDUList(hdul)
-                hdul.writeto(outfile,overwrite=True) 
-                hdul.close()
+                self.writeFits(hdul, outfile)
  
     
     def saveMoments(self):
@@ -4833,14 +5297,14 @@ class GUI (QMainWindow):
             # Dialog to save file
             fd = QFileDialog()
             fd.setLabelText(QFileDialog.Accept, "Save as")
-            fd.setNameFilters(["Fits Files (*.fits)","All Files (*)"])
+            fd.setNameFilters(fitsNameFilters())
             fd.setOptions(QFileDialog.DontUseNativeDialog)
             fd.setViewMode(QFileDialog.List)            
             if (fd.exec()):
                 fileName = fd.selectedFiles()
                 outfile = fileName[0]
                 filename, file_extension = os.path.splitext(outfile)
-                if file_extension != '.fits' :
+                if file_extension not in ['.fits', '.fz']:
                     file_extension = '.fits'
                     outfile = filename + file_extension
                 header = self.specCube.wcs.to_header()
@@ -4855,15 +5319,212 @@ class GUI (QMainWindow):
                 hdu.header.extend(header)
                 hdul = [hdu]
                 # self.C0, self.M0, self.v, self.sv
-                hdul.append(self.addExtension(self.C0, 'CONTINUUM', 'Jy', header))
-                hdul.append(self.addExtension(self.M0, 'INTENSITY', 'W/m2', header))
-                hdul.append(self.addExtension(self.v, 'VELOCITY', 'km/s', header))
-                hdul.append(self.addExtension(self.sv, 'FWHM', 'km/s', header))
-                hdul = fits.HDUList(hdul)
-                hdul.writeto(outfile,overwrite=True) 
-                hdul.close()
+                mask = self.specCube.mask.image
+                hdul.append(self.addExtension(mask(self.C0), 'CONTINUUM', 'Jy', header))
+                hdul.append(self.addExtension(mask(self.M0), 'INTENSITY', 'W/m2', header))
+                hdul.append(self.addExtension(mask(self.v), 'VELOCITY', 'km/s', header))
+                hdul.append(self.addExtension(mask(self.sv), 'FWHM', 'km/s', header))
+                self.writeFits(hdul, outfile)
             
 
+    def saveProducts(self):
+        """Save continuum, moments, lines, tessellation, and guesses in one product store."""
+        s = self.specCube
+        arrays = []
+        units = [('continuum', 'Jy'), ('C0', 'Jy'), ('Cs', 'Jy/um'), ('M0', 'W/m2'),
+                 ('M1', 'um'), ('M2', 'um2'), ('M3', None), ('M4', None), ('noise', 'Jy'),
+                 ('v', 'km/s'), ('sv', 'km/s'), ('L0', 'W/m2'), ('L1', 'W/m2'),
+                 ('v0', 'km/s'), ('v1', 'km/s'), ('d0', 'km/s'), ('d1', 'km/s')]
+        for name, unit in units:
+            data = getattr(self, name, None)
+            if data is not None:
+                arrays.append((name, data, {'unit': unit}))
+        if getattr(self, 'lines', None) is not None:
+            planes = ['center', 'sigma', 'flux', 'alpha', 'errcenter', 'errsigma', 'errflux']
+            arrays.append(('lines', self.lines, {'planes': planes}))
+        if len(arrays) == 0:
+            message = 'No products to save'
+            print(message)
+            self.sb.showMessage(message, 1000)
+            return
+        arrays.append(('wave', s.wave, {'unit': 'um'}))
+        arrays.append(('mask', s.mask.mask, {}))
+        if self.ncells > 1 and getattr(self, 'regions', None) is not None:
+            arrays.append(('regions', self.regions, {}))
+            arrays.append(('sites', np.asarray(self.sites, dtype=float), {}))
+        info = [('cube', {'filename': s.filename, 'instrument': s.instrument,
+                          'object': s.objname, 'shape': [s.nz, s.ny, s.nx],
+                          'wavref': s.l0, 'redshift': s.redshift,
+                          'wcs': dict(s.wcs.to_header())}),
+                ('settings', {'kernel': self.kernel, 'ncells': self.ncells})]
+        try:
+            guesses = guessesInfo(self)
+        except BaseException:
+            guesses = None
+        if guesses is not None:
+            info.append(('guesses', guesses))
+        # Dialog to save file
+        fd = QFileDialog()
+        fd.setLabelText(QFileDialog.Accept, "Save as")
+        fd.setNameFilters(["Product store (*.zip)","All Files (*)"])
+        fd.setOptions(QFileDialog.DontUseNativeDialog)
+        fd.setViewMode(QFileDialog.List)
+        if (fd.exec()):
+            outfile = fd.selectedFiles()[0]
+            if not outfile.endswith('.zip'):
+                outfile += '.zip'
+            if self.productThread is not None and self.productThread.isRunning():
+                self.productThread.wait()
+            self.sb.showMessage("Saving the products ... ")
+            self.productThread = WriteProducts(arrays, info, outfile, parent=self)
+            self.productThread.sendMessage.connect(lambda message: self.sb.showMessage(message, 2000))
+            self.productThread.start()
+
+    def sessionArrays(self):
+        """Arrays saved in the session (None if not defined)."""
+        names = ['continuum', 'Cmask', 'C0', 'Cs', 'Mmask', 'M0', 'M1', 'M2', 'M3', 'M4',
+                 'noise', 'v', 'sv', 'L0', 'L1', 'v0', 'v1', 'd0', 'd1', 'lines', 'regions']
+        arrays = {name: getattr(self, name, None) for name in names}
+        arrays['mask'] = self.specCube.mask.mask
+        return arrays
+
+    def sessionState(self):
+        """Reference of the cube, settings, guesses, and apertures of the session."""
+        s = self.specCube
+        cube = fileReference(s.filename)
+        cube['shape'] = [s.nz, s.ny, s.nx]
+        settings = {'kernel': self.kernel, 'ncells': self.ncells, 'all': self.all,
+                    'fitcont': self.fitcont, 'abslines': self.abslines, 'emslines': self.emslines,
+                    'colorMap': self.colorMap, 'colorMapDirection': self.colorMapDirection,
+                    'stretchMap': self.stretchMap, 'bands': self.bands,
+                    'band': self.bands[self.itabs.currentIndex()]}
+        state = {'cube': cube, 'settings': settings}
+        try:
+            guesses = guessesInfo(self)
+            if guesses is not None:
+                state['guesses'] = guesses
+        except BaseException:
+            pass
+        apertures = []
+        for istab in range(2, len(self.sci)):
+            if self.stabs.tabText(istab) == 'PSF':
+                continue
+            try:
+                apertures.append(apertureInfo(self, istab, 0))
+            except BaseException:
+                pass
+        state['apertures'] = apertures
+        return state
+
+    def saveSession(self):
+        """Choose the directory of the session, save it, and save it periodically after."""
+        try:
+            self.specCube
+        except AttributeError:
+            self.sb.showMessage("First load a cube ", 2000)
+            return
+        directory = QFileDialog.getExistingDirectory(self, "Directory of the session",
+                                                     options=QFileDialog.DontUseNativeDialog)
+        if directory == '':
+            return
+        if self.sessionThread is not None and self.sessionThread.isRunning():
+            self.sessionThread.wait()
+        self.session = Session(directory)
+        self.autosaveSession()
+        self.sessionTimer.start(int(self.sessionInterval * 60000))
+
+    def autosaveSession(self, wait=False):
+        """Save in a thread what changed since the last snapshot of the session
+        (waiting for the end of the writing if wait)."""
+        if self.session is None or self.fitRunning:
+            return
+        if self.sessionThread is not None and self.sessionThread.isRunning():
+            if not wait:
+                # The previous snapshot is still being written
+                return
+            self.sessionThread.wait()
+        try:
+            arrays = self.sessionArrays()
+            versions = dict(self.productVersions)
+            versions['mask'] = self.specCube.mask.version
+            state = self.sessionState()
+        except BaseException as e:
+            print('Session not saved: ', e)
+            return
+        self.sessionThread = SaveSession(self.session, arrays, state, versions, parent=self)
+        self.sessionThread.sendMessage.connect(lambda message: self.sb.showMessage(message, 1000))
+        self.sessionThread.start()
+        if wait:
+            self.sessionThread.wait()
+
+    def touchProducts(self, *names):
+        """Count the modifications in place of products (saved again in the session)."""
+        for name in names:
+            self.productVersions[name] = self.productVersions.get(name, 0) + 1
+
+    def resumeSession(self):
+        """Open the cube of a session and restore its state. The saved products are
+        memory-mapped, unless the cube changed since the session was saved."""
+        directory = QFileDialog.getExistingDirectory(self, "Directory of the session",
+                                                     options=QFileDialog.DontUseNativeDialog)
+        if directory == '':
+            return
+        session = Session(directory)
+        if not session.exists():
+            self.sb.showMessage("No session saved in this directory ", 2000)
+            return
+        if self.sessionThread is not None and self.sessionThread.isRunning():
+            self.sessionThread.wait()
+        state, arrays = session.load()
+        self.productVersions = {}
+        cube = state['cube']
+        settings = state['settings']
+        if not os.path.exists(cube['filename']):
+            self.sb.showMessage("The cube of the session is not available ", 2000)
+            return
+        self.colorMap = settings['colorMap']
+        self.colorMapDirection = settings['colorMapDirection']
+        self.stretchMap = settings['stretchMap']
+        self.loadFile(cube['filename'])
+        self.initializeCube()
+        s = self.specCube
+        reference = fileReference(cube['filename'])
+        unchanged = (reference['size'] == cube['size'] and reference['mtime'] == cube['mtime']
+                     and [s.nz, s.ny, s.nx] == cube['shape'])
+        if unchanged and 'mask' in arrays:
+            s.mask = MaskLayer((s.ny, s.nx), arrays['mask'])
+        if 'guesses' in state:
+            applyGuesses(self, state['guesses'])
+        for aperture in state.get('apertures', []):
+            applyAperture(self, aperture)
+        if unchanged:
+            for name, data in arrays.items():
+                if name != 'mask':
+                    setattr(self, name, data)
+            for name in ['all', 'fitcont', 'abslines', 'emslines']:
+                setattr(self, name, settings[name])
+            products = ['C0', 'M0', 'M1', 'M2', 'M3', 'M4', 'v', 'sv',
+                        'L0', 'L1', 'v0', 'v1', 'd0', 'd1']
+            for band in settings['bands']:
+                if band not in products or getattr(self, band, None) is None:
+                    continue
+                if band in self.bands:
+                    ic = self.ici[self.bands.index(band)]
+                    ic.showImage(getattr(self, band))
+                    ic.changed = True
+                else:
+                    self.addBand(band)
+            if settings['band'] in self.bands:
+                self.itabs.setCurrentIndex(self.bands.index(settings['band']))
+            message = "Session resumed "
+        else:
+            # Products computed on another version of the cube are not used
+            message = "The cube changed since the session was saved: products not restored "
+        self.sb.showMessage(message, 3000)
+        print(message)
+        self.session = session
+        self.sessionTimer.start(int(self.sessionInterval * 60000))
+
     def addExtension(self,data, extname, unit, hdr):
         from astropy.io import fits
         hdu = fits.ImageHDU()
@@ -5193,34 +5854,7 @@ class GUI (QMainWindow):
                 xx = xx[mask2d]
                 yy = yy[mask2d]
                 # Mask images and cubes
-                self.specCube.flux[:,yy,xx] = np.nan
-                icis = [self.ici[0]]
-                if self.specCube.instrument == 'FIFI-LS':
-                    print('Masking uflux')
-                    self.specCube.uflux[:,yy,xx] = np.nan
-                    icis.append(self.ici[1])
-                for ic0 in icis:
-                    image = ic0.oimage
-                    image[yy,xx] = np.nan
-                    cmin = ic0.cmin; cmax=ic0.cmax
-                    ic0.updateImage(image)
-                    ic0.updateScale(cmin,cmax)
-                # mask C0, Mi, v, sv
-                sbands = [self.C0, self.M0, self.v, self.sv,
-                          self.L0, self.L1,self.v0,self.v1,self.d0,self.d1]
-                bands = ['C0','M0','v','sv','L0','L1','v0','v1','d0','d1']
-                for b,sb in zip(bands,sbands):
-                    if sb is not None:
-                        itab = self.bands.index(b)
-                        sb[yy,xx] = np.nan
-                        ic = self.ici[itab]
-                        ih = self.ihi[itab]
-                        clim = ic.image.get_clim()
-                        ic.updateImage(sb)
-                        ic.fig.canvas.draw_idle()
-                        ih.axes.cla()
-                        ih.compute_initial_figure(image=sb, xmin=clim[0],xmax=clim[1])
-                        ic.updateScale(clim[0],clim[1])
+                self.applyMask(yy, xx)
             else:
                 self.sb.showMessage('Contours are considered only in cube or derivated images',4000)
         else:
@@ -5298,32 +5932,7 @@ class GUI (QMainWindow):
             xx,yy = inpoints.T
             poly.remove()            
             self.sb.showMessage("Masking data ", 2000)
-            self.specCube.flux[:,yy,xx] = np.nan
-            icis = [self.ici[0]]
-            if self.specCube.instrument == 'FIFI-LS':
-                self.specCube.uflux[:,yy,xx] = np.nan
-                icis.append(self.ici[1])
-            for ic0 in icis:
-                image = ic0.oimage
-                image[yy,xx] = np.nan
-                cmin = ic0.cmin; cmax=ic0.cmax
-                ic0.updateImage(image)
-                ic0.updateScale(cmin,cmax)
-            # mask C0, Mi, v, sv
-            sbands = [self.C0, self.M0, self.M1, self.M2, self.M3, self.M4, 
-                      self.v, self.sv,self.L0,self.L1,self.v0,self.v1,self.d0,self.d1]
-            bands = ['C0','M0','M1','M2','M3','M4','v','sv','L0','L1','v0','v1','d0','d1']
-            for b,sb in zip(bands,sbands):
-                if sb is not None:
-                    itab = self.bands.index(b)
-                    sb[yy,xx] = np.nan
-                    ic0 = self.ici[itab]
-                    ih = self.ihi[itab]
-                    clim = ic0.image.get_clim()
-                    ic0.updateImage(sb)
-                    ic0.updateScale(clim[0],clim[1])
-                    ih.axes.cla()
-                    ih.compute_initial_figure(image=sb, xmin=clim[0],xmax=clim[1])
+            self.applyMask(yy, xx)
             x,y = ic.zoomlimits
             ic.axes.set_xlim(x)
             ic.axes.set_ylim(y)
@@ -5331,21 +5940,50 @@ class GUI (QMainWindow):
         elif QMessageBox.No:
             poly.remove()
         
-    def computeZeroMoment(self):        
-        c = 299792458. # m/s
-        w = self.specCube.wave
-        dw = [] 
-        dw.append([w[1]-w[0]])
-        dw.append(list((w[2:]-w[:-2])*0.5))
-        dw.append([w[-1]-w[-2]])
-        dw = np.concatenate(dw)
-        nz,ny,nx = np.shape(self.specCube.flux)
-        self.M0 = np.zeros((ny,nx))
-        for i in range(nx):
-            for j in range(ny):
-                Snu = self.specCube.flux[:,j,i]
-                Slambda = c*(Snu-np.nanmedian(Snu))/(w*w)*1.e6   # [Jy * Hz / um]
-                self.M0[j,i] = np.nansum(Slambda*dw)*1.e-26 # [Jy Hz]  (W/m2 = Jy*Hz*1.e-26)
+    def applyMask(self, yy, xx):
+        """Add the pixels (yy,xx) to the mask of the cube."""
+        if self.specCube.mask.set(yy, xx) is not None:
+            self.refreshMask()
+
+    def undoMask(self):
+        """Remove the last pixels masked."""
+        if self.specCube.mask.undo() is None:
+            self.sb.showMessage("No mask to undo ", 2000)
+        else:
+            self.refreshMask()
+
+    def redoMask(self):
+        """Mask again the last pixels unmasked."""
+        if self.specCube.mask.redo() is None:
+            self.sb.showMessage("No mask to redo ", 2000)
+        else:
+            self.refreshMask()
+
+    def refreshMask(self):
+        """Show the images of the cube and the spectra with the new mask."""
+        itab = self.itabs.currentIndex()
+        for i, (ic, ih) in enumerate(zip(self.ici, self.ihi)):
+            if ic.maskLayer is None or ic.dimage is None:
+                continue
+            clim = ic.image.get_clim()
+            ic.refreshMask()
+            ic.updateScale(clim[0], clim[1])
+            ih.axes.cla()
+            ih.compute_initial_figure(image=ic.oimage, xmin=clim[0], xmax=clim[1])
+            ih.changed = True
+            if i == itab:
+                ic.fig.canvas.draw_idle()
+            else:
+                ic.changed = True
+        # Total spectrum and spectra of the apertures
+        if self.all:
+            self.updateAll()
+            self.sci[self.spectra.index('All')].fig.canvas.draw_idle()
+        self.onModifiedAperture('mask changed')
+
+    def computeZeroMoment(self):
+        """Median subtracted integrated intensity of the cube [W/m2]."""
+        self.M0 = zeroMomentMap(self.specCube.flux, self.specCube.wave)
         
     def zeroMoment(self):
         """ Compute and display zero moment of flux """
@@ -5378,8 +6016,7 @@ class GUI (QMainWindow):
         ic0 = self.ici[0]
         x = ic0.axes.get_xlim()
         y = ic0.axes.get_ylim()
-        ra,dec = ic0.wcs.all_pix2world(x, y, 0)
-        x,y = ic.wcs.all_world2pix(ra, dec, 0)            
+        x,y = pix2pix(ic0.wcs, ic.wcs, x, y)
         ic.axes.set_xlim(x)
         ic.axes.set_ylim(y)
         ic.changed = True
@@ -5447,9 +6084,7 @@ class GUI (QMainWindow):
                 ih0.levels = list(np.arange(ih0.min,ih0.max,(ih0.max-ih0.min)/8))
             else:
                 # What about percentiles ?
-                data = ic0.oimage.ravel()
-                data = data[np.isfinite(data)]
-                levels = np.percentile(data,[98, 99, 99.5])
+                levels = imageStatistics(ic0.oimage).percentile([98, 99, 99.5])
                 print('levels ', levels)
                 ih0.levels = list(levels)
                 #levels = ih0.median + np.array([0.1,1,2,3,5,10]) * ih0.sdev
@@ -5458,12 +6093,13 @@ class GUI (QMainWindow):
         else:
             ih0.levels = levels
         #print('Contour levels are: ',ih0.levels)
-        if self.specCube.instrument != 'FIFI-LS':
-            ismo = ndimage.gaussian_filter(ic0.oimage, sigma=1.0, order=0)
-        else:
-            ismo = ic0.oimage
-        ic0.contour = ic0.axes.contour(ismo, ih0.levels, colors=self.colorContour[0])
-        ic0.fig.canvas.draw_idle()
+        # Lines are computed in a thread and drawn once ready
+        if ic0.contour is not None:
+            for coll in ic0.contour.collections:
+                coll.remove()
+        ic0.contour = ContourLines(ic0.axes, self.colorContour[0])
+        self.contourThread.smoothed = None
+        self.requestContours(itab)
         # Add levels to histogram
         ih0.drawLevels()
         # Connect signal event to action
@@ -5480,42 +6116,42 @@ class GUI (QMainWindow):
 
     def onModifyContours(self, n):
         """ Called by mysignal in the histogram canvas if contour levels change """
-        # In some cases, computing contours can be computationally intense. So
-        # we call threads in the case of new/modified contours
-        # Unfortunately this does not work because matplotlib is not thread safe.        
+        # The geometry of new/modified contours is computed in a thread,
+        # while the lines are drawn in the main thread (matplotlib is not thread safe).
         itab = self.itabs.currentIndex()
         ic0 = self.ici[itab]
-        ih0 = self.ihi[itab]
         if ic0.contour is not None:
-            ncontours = len(ic0.contour.collections)
-            if n >= 1000:
-                # Add a brand new level
-                n -= 1000
-                if self.specCube.instrument != 'FIFI-LS':
-                    ismo = ndimage.gaussian_filter(ic0.oimage, sigma=0.5, order=0)
-                else:
-                    ismo = ic0.oimage
-                new = ic0.axes.contour(ismo, [ih0.levels[n]], colors=self.colorContour[0])
-                # Insert new contour in the contour collection
-                ic0.contour.collections.insert(n, new.collections[0])                
-            elif n <= -1000:
-                n = - n - 1000
-                # Remove contour from image
-                if n < ncontours:
-                    ic0.axes.collections.remove(ic0.contour.collections[n])
-                    # Delete element from contour collection list
-                    ic0.contour.collections.pop(n)
-                else:
-                    print('contour ',n,' does not exist')
-            else:
-                # Move level by removing contour and adding it at new level
-                if n < ncontours:
-                    ic0.axes.collections.remove(ic0.contour.collections[n])
-                    new = ic0.axes.contour(ic0.oimage, [ih0.levels[n]], colors=self.colorContour[0])
-                    ic0.contour.collections[n] = new.collections[0]
-                else:
-                    print('contour ',n,' does not exist')
+            self.requestContours(itab)
+
+    def requestContours(self, itab):
+        """Compute the lines of the contour levels not yet drawn."""
+        ic0 = self.ici[itab]
+        ih0 = self.ihi[itab]
+        levels = list(ih0.levels)
+        missing = ic0.contour.missing(levels)
+        self.contourId += 1
+        if len(missing) == 0:
+            # Only removed levels
+            ic0.contour.update(levels, {})
             self.modifyOtherImagesContours(itab)
+            return
+        if self.specCube.instrument != 'FIFI-LS':
+            sigma = 1.0
+        else:
+            sigma = None
+        self.contourThread.submit((self.contourId, itab, ic0.oimage, sigma, levels, missing))
+
+    def onContoursReady(self, result):
+        """Draw the contour lines computed by the thread."""
+        ident, itab, levels, lines = result
+        # Discard stale requests
+        if ident != self.contourId or itab >= len(self.ici):
+            return
+        ic0 = self.ici[itab]
+        if not isinstance(ic0.contour, ContourLines):
+            return
+        ic0.contour.update(levels, lines)
+        self.modifyOtherImagesContours(itab)
                 
     def modifyOtherImagesContours(self, i0):
         """ Once the new contours are computed, propagate them to other images """        
@@ -5526,11 +6162,7 @@ class GUI (QMainWindow):
         ici.remove(ic0)
         for ic in ici:
             if ic.contour is not None:
-                # Remove previous contours
-                for coll in ic.contour.collections:
-                    coll.remove()
-                ic.contour = None
-                # Compute new contours
+                # Update contours (only new or moved levels) when showing the image
                 ic.contour0 = i0
                 #levels =  sorted(ih0.levels)
                 #ic.contour = ic.axes.contour(ic0.oimage, levels, colors=self.colorContour,
@@ -5551,18 +6183,7 @@ class GUI (QMainWindow):
                 #self.specCube.atran[:] = atmed
                 # The uncorrected flux should be interpolated over the corrected flux wavelength
                 # grid after applying the baryshift correction ...
-                self.computeFluxAtm(atran)
-                # self.specCube.flux = self.specCube.uflux/atmed
-                # Redraw the spectrum
-                for istab in range(len(self.stabs)):
-                    if self.stabs.tabText(istab) != 'PSF':
-                        self.sci[istab].updateSpectrum(atran=atran)
-                # tab with total flux
-                self.doZoomAll('new AT')
-                # tabs with apertures
-                self.onModifiedAperture('new AT')
-                # Update image
-                self.slideCube('new AT')
+                self.computeFluxAtm(atran, atran)
             else:
                 self.sb.showMessage("This operation is possible with FIFI-LS cubes only", 2000)    
         except:
@@ -5580,54 +6201,47 @@ class GUI (QMainWindow):
                 #self.specCube.atran[:] = atmed
                 # The uncorrected flux should be interpolated over the corrected flux wavelength
                 # grid after applying the baryshift correction ...
-                self.computeFluxAtm(at[idx])
-                self.specCube.atran = atran
-                # self.specCube.flux = self.specCube.uflux/atmed
-                # Redraw the spectrum
-                for istab in range(len(self.stabs)):
-                    if self.stabs.tabText(istab) != 'PSF':
-                        self.sci[istab].updateSpectrum(atran=atran)
-                # tab with total flux
-                self.doZoomAll('new AT')
-                # tabs with apertures
-                self.onModifiedAperture('new AT')
-                # Update image
-                self.slideCube('new AT')
+                self.computeFluxAtm(at[idx], atran)
             else:
                 self.sb.showMessage("This operation is possible with FIFI-LS cubes only", 2000)    
         except:
             self.sb.showMessage("First choose a cube ", 1000)
         
-    def computeFluxAtm(self, atmed):
-        nz, ny, nx = np.shape(self.specCube.uflux)
-        x = self.specCube.wave
-        xr = x * (1+self.specCube.baryshift)
-        for i in range(ny):
-            for j in range(nx):
-                uflux = self.specCube.uflux[:, i, j]
-                euflux = self.specCube.euflux[:, i, j]
-                offset = 0
-                #offset = np.nanmedian(uflux)
-                self.specCube.flux[:, i, j] = np.interp(x, xr, (uflux - offset)/ atmed + offset)
-                self.specCube.eflux[:, i, j] = np.interp(x, xr, (euflux - offset)/ atmed + offset)
+    def computeFluxAtm(self, atmed, atran):
+        """Correct in a thread the uncorrected flux with the transmission atmed."""
+        if self.atmThread is not None and self.atmThread.isRunning():
+            self.sb.showMessage("Atmospheric correction already running ", 2000)
+            return
+        self.sb.showMessage("Correcting the atmospheric transmission ... ")
+        self.atmThread = CorrectAtmosphere(self.specCube, atmed, atran, parent=self)
+        self.atmThread.corrected.connect(self.onFluxAtm)
+        self.atmThread.start()
+
+    def onFluxAtm(self, atran, flux, eflux):
+        """Use the corrected cubes and refresh spectra and images."""
+        self.specCube.flux = flux
+        self.specCube.eflux = eflux
+        self.resetCubeCaches()
+        self.specCube.atran = atran # update atran
+        # Redraw the spectrum
+        for istab in range(len(self.stabs)):
+            if self.stabs.tabText(istab) != 'PSF':
+                self.sci[istab].updateSpectrum(atran=atran)
+        # tab with total flux
+        self.doZoomAll('new AT')
+        # tabs with apertures
+        self.onModifiedAperture('new AT')
+        # Update image
+        self.slideCube('new AT')
+        self.sb.showMessage("Atmospheric correction applied ", 2000)
         
-    def readAtran(self, detchan, order):
-        import os
-        from astropy.io import fits
-        path0, file0 = os.path.split(__file__)
-        # print('Path for Atran is ', path0)
-        if detchan == 'BLUE':
-            file = 'AtranBlue'+str(order)+'.fits.gz'
-        else:
-            file = 'AtranRed.fits.gz'
-        path = path0+'/data/'
-        hdl = fits.open(path+file)
-        wt = hdl['WAVELENGTH'].data
-        atran = hdl['ATRAN'].data
-        altitudes = hdl['ALTITUDE'].data
-        wvzs = hdl['WVZ'].data
-        hdl.close()
-        return (wt, atran, altitudes, wvzs)
+    def atmTransmission(self, wvz):
+        """Transmission on the cube wavelengths for a zenithal water vapor."""
+        s = self.specCube
+        za = 0.5 * (s.za[0] + s.za[1])
+        altitude = 0.5 * (s.altitude[0] + s.altitude[1])
+        model = atranModel(s.channel, s.order)
+        return model.transmission(altitude, wvz, za, s.wave)
             
     def fluxNewAT(self):
         try:
@@ -5639,69 +6253,78 @@ class GUI (QMainWindow):
                 altitude = 0.5 * (self.specCube.altitude[0] + self.specCube.altitude[1])
                 wvz = self.getWVZ(altitude,za)
                 print('Selected Zenithal Water Vapor: ', wvz)
-                # Download a new AT curve and apply it to the uflux
-                atrandata = self.readAtran(self.specCube.channel, self.specCube.order)
-                wt, atran, altitudes, wvs = atrandata
-                imin = np.argmin(np.abs(altitudes-altitude))
-                at = atran[imin]
-                
-                angle = za * np.pi/180.
-                a = 6371 + 12.5  # Earth radius + altitude (~12.5 km)
-                c = 38           # Rest of stratosphere (~ 38 km)
-                b = a + c      
-                alpha = np.arcsin(a/b * np.sin(angle)) # From law of sinus
-                dx = np.sqrt(a*a + b*b - 2*a*b*np.cos(angle-alpha)) # From law of cosinus
-                depth = dx / c
-                #angle = za * np.pi/180.
-                #cos_angle = np.cos(angle)
-                ##depth = 1. / cos_angle  # Flat Earth approximation
-                #r = 6383.5/50.  # assuming r_earth = 6371 km, altitude = 12.5 km, and 50 km of more stratosphere
-                #rcos = r * cos_angle
-                #depth = -rcos + np.sqrt(rcos * rcos + 1 + 2 * r) # Taking into account Earth curvature
-                imin = np.argmin(np.abs(wvs-wvz))
-                at = at[imin]**depth
-                atmed = np.interp(self.specCube.wave, wt , at)
-                atran = atmed
+                if wvz is None:
+                    return
+                # New AT curve (interpolated in the ATRAN grid) applied to the uflux
+                atran = self.atmTransmission(wvz)
+                atmed = atran
                 atmed[atmed < 0.3] = np.nan   # Do not correct for too low atmospheric transmission
-                self.computeFluxAtm(atmed)
-                self.specCube.atran = atran # update atran
-                for istab in range(len(self.stabs)):
-                    if self.stabs.tabText(istab) != 'PSF':
-                        self.sci[istab].updateSpectrum(atran=atran)
-                # tab with total flux
-                self.doZoomAll('new AT')
-                # tabs with apertures
-                self.onModifiedAperture('new AT')
-                # Update image
-                self.slideCube('new AT')
+                self.computeFluxAtm(atmed, atran)
             else:
                 self.sb.showMessage("This operation is possible with FIFI-LS cubes only", 2000)    
         except:
             self.sb.showMessage("First choose a cube ", 1000)
         
     def getWVZ(self, alt, za):
-        wvzline, okPressed = QInputDialog.getDouble(self, "Altitude: " + str(alt) + 
-                                                    " Zenithal Angle: " + str(za),
-                                                    "Water vapor at zenith", 5, 1.5, 10., 2)
-        if okPressed:
-            return wvzline
+        """Choose the zenithal water vapor previewing the correction on the displayed spectra."""
+        dialog = WVZDialog(alt, za, parent=self)
+        dialog.wvzSignal.connect(self.previewWVZ)
+        self.previewWVZ(dialog.save())
+        if dialog.exec_():
+            return dialog.save()
         else:
+            # Back to the current correction
+            for istab in range(len(self.stabs)):
+                if self.stabs.tabText(istab) == 'PSF':
+                    continue
+                sc = self.sci[istab]
+                sc.updateSpectrum(f=sc.spectrum.flux, atran=self.specCube.atran)
+                sc.fig.canvas.draw_idle()
             return None
 
+    def previewWVZ(self, wvz):
+        """Correct the spectra of the tabs (not the cube) with the transmission of a water vapor."""
+        s = self.specCube
+        atran = self.atmTransmission(wvz)
+        atmed = atran.copy()
+        atmed[atmed < 0.3] = np.nan   # Do not correct for too low atmospheric transmission
+        # The correction is linear, so it can be applied to the sum of the uncorrected spectra
+        operator = shiftOperator(s.wave, s.wave * (1 + s.baryshift), atmed)
+        for istab in range(len(self.stabs)):
+            if self.stabs.tabText(istab) == 'PSF':
+                continue
+            sc = self.sci[istab]
+            uflux = getattr(sc.spectrum, 'uflux', None)
+            if uflux is None:
+                continue
+            sc.updateSpectrum(f=operator @ uflux, atran=atran)
+            sc.fig.canvas.draw_idle()
+
     def reloadFile(self):
         """Reload the file."""        
         try:
             filename = self.specCube.filename
             self.loadFile(filename)
+            self.initializeCube()
+        except:
+            self.sb.showMessage("ERROR: You have to load a file first", 2000)
+            return
+
+    def initializeCube(self):
+        """Compute images, spectra, and auxiliary quantities of the cube just opened."""
+        try:
             self.initializeImages()
             self.initializeSpectra()
             self.initializeSlider()
             if self.specCube.instrument in ['GREAT','HI','HALPHA','VLA','ALMA','MUSE','IRAM','CARMA','MMA','PCWI']:
                 self.specCube.computeExpFromNan()
+                self.clearChannelCache()
                 #idx = np.isfinite(self.specCube.flux)
                 #print('No of bad ', np.sum(~idx))
                 if self.specCube.instrument  == 'GREAT':
                     self.slideCube('exp computed')
+            # Cumulative cubes are computed when the slicer is first used
+            self.cumulative = None
             self.all = False
             self.fitcont = False
             # Set default number of lines to fit across the cube
@@ -5713,9 +6336,8 @@ class GUI (QMainWindow):
             if len(self.extraimages) > 0:
                 for extraimage in self.extraimages:
                     self.newImageTab(extraimage)
-
         except:
-            self.sb.showMessage("ERROR: You have to load a file first", 2000)
+            self.sb.showMessage("ERROR: The cube cannot be displayed", 2000)
             return
         
     def newFile(self):
@@ -5745,6 +6367,9 @@ class GUI (QMainWindow):
                 if self.specCube.instrument in ['GREAT','HI','HALPHA','VLA','ALMA','MUSE','IRAM','CARMA','MMA','PCWI']:
                     #print('compute Exp from Nan')
                     self.specCube.computeExpFromNan()
+                    self.clearChannelCache()
+                # Cumulative cubes are computed when the slicer is first used
+                self.cumulative = None
                 self.all = False
                 self.fitcont = False
                 # Set default number of lines to fit across the cube
@@ -5775,6 +6400,12 @@ class GUI (QMainWindow):
             except:
                 self.sb.showMessage("ERROR: The selected file is not a good spectral cube ", 2000)
                 return
+        self.openCube()
+
+    def openCube(self):
+        """Open the image and spectral tabs of the current cube."""
+        # Contours of the previous tabs
+        self.contourCache.clear()
         # Delete pre-existing spectral tabs
         try:
             for stab in reversed(range(len(self.sci))):
@@ -5964,6 +6595,18 @@ class GUI (QMainWindow):
         self.v  = None
         self.sv = None
         self.lines = None
+        # Cumulative sums along the wavelength (computed once the exposure is defined)
+        self.cumulative = None
+        # Spectra of the Voronoi cells
+        self.cells = None
+        # Cubes averaged over the kernel
+        self.smoothed = None
+        # Cache of channel images
+        self.playTimer.stop()
+        if self.prefetch is not None:
+            self.prefetch.stop()
+        self.channelCache = ChannelCache(self.channelImage, self.channelCacheSize * 1024 * 1024)
+        self.prefetch = PrefetchChannels(self.channelCache, parent=self)
         # Selectors
         self.PS = None
         self.ES = None
@@ -5991,9 +6634,9 @@ class GUI (QMainWindow):
         #print('aperture at ', data)
         self.photoApertures.append(photoAperture(n,'pixel',data))
         for ic in self.ici:
-            x0, y0 = ic.wcs.all_world2pix(r0, d0, 0)
+            x1, y1 = pix2pix(ic0.wcs, ic.wcs, x0, y0)
             w = ws / ic.pixscale
-            pixel = PixelInteractor(ic.axes, (x0, y0), w)
+            pixel = PixelInteractor(ic.axes, (x1, y1), w)
             ic.photApertures.append(pixel)
             cidap=pixel.mySignal.connect(self.onRemoveAperture)
             ic.photApertureSignal.append(cidap)
@@ -6165,20 +6808,7 @@ class GUI (QMainWindow):
         itab = self.itabs.currentIndex()
         ic0 = self.ici[itab]
         for ima in imas:
-            if ima == 'Flux':
-                if self.specCube.instrument == 'GREAT':
-                    #print('update image of great cube')
-                    #idx = np.isfinite(self.specCube.flux[n,:,:])
-                    #print('NaN are ',np.sum(~idx))
-                    image = self.specCube.flux[n,:,:] * self.specCube.Tb2Jy
-                else:
-                    image = self.specCube.flux[n,:,:]
-            elif ima == 'uFlux':
-                image = self.specCube.uflux[n,:,:]
-            elif ima == 'Exp':
-                image = self.specCube.exposure[n,:,:]
-            else:
-                pass
+            image = self.channelCache.get((ima, n))
             ic = self.ici[self.bands.index(ima)]
             # Update only data to go faster
             ic.updateImage(image)
@@ -6193,6 +6823,212 @@ class GUI (QMainWindow):
                 ic.changed = True
             ih = self.ihi[self.bands.index(ima)]
             ih.changed = True
+        self.prefetchChannels(n, imas)
+
+    def channelImage(self, key):
+        """Image of a channel of the cube as displayed."""
+        ima, n = key
+        if ima == 'Flux':
+            if self.specCube.instrument == 'GREAT':
+                image = self.specCube.flux[n,:,:] * self.specCube.Tb2Jy
+            else:
+                image = self.specCube.flux[n,:,:]
+        elif ima == 'uFlux':
+            image = self.specCube.uflux[n,:,:]
+        elif ima == 'Exp':
+            image = self.specCube.exposure[n,:,:]
+        return image
+
+    def prefetchChannels(self, n, imas):
+        """Load in background the channels around channel n."""
+        keys = []
+        for i in range(1, self.channelPrefetch + 1):
+            for m in [n + i, n - i]:
+                if m >= 0 and m < self.specCube.nz:
+                    keys.extend([(ima, m) for ima in imas])
+        keys = [key for key in keys if key not in self.channelCache]
+        self.prefetch.keys = keys
+        if len(keys) > 0 and not self.prefetch.isRunning():
+            self.prefetch.start()
+
+    def channelRange(self):
+        """Channels selected by the slicer or all the channels."""
+        if self.slicer is None:
+            return 0, self.specCube.nz
+        sc = self.sci[self.spectra.index('Pix')]
+        xmin = self.slicer.xl
+        xmax = self.slicer.xr
+        if sc.xunit == 'THz':
+            c = 299792458.0  # speed of light in m/s
+            xmin, xmax = c/xmax*1.e-6, c/xmin*1.e-6
+        indmin, indmax = np.searchsorted(self.specCube.wave, (xmin, xmax))
+        indmax = min(len(self.specCube.wave), max(indmax, indmin + 1))
+        return indmin, indmax
+
+    def playChannels(self):
+        """Animate the channels of the cube on the current image tab."""
+        try:
+            s = self.specCube
+        except BaseException:
+            self.sb.showMessage("First choose a cube ", 1000)
+            return
+        if self.playTimer.isActive():
+            return
+        fps, okPressed = QInputDialog.getDouble(self, "Play channels", "Frames per second",
+                                                self.playFps, 0.5, 60., 1)
+        if not okPressed:
+            return
+        self.playFps = fps
+        if self.slider is None:
+            self.initializeSlider()
+        itab = self.itabs.currentIndex()
+        if self.bands[itab] not in ['Flux', 'uFlux', 'Exp']:
+            itab = self.bands.index('Flux')
+            self.itabs.setCurrentIndex(itab)
+        sc = self.sci[self.stabs.currentIndex()]
+        w = self.slider.x
+        if sc.xunit == 'THz':
+            c = 299792458.0  # speed of light in m/s
+            w = c / w * 1.e-6
+        self.playChannel = np.argmin(np.abs(s.wave - w))
+        self.playBand = self.bands[itab]
+        self.ici[itab].startAnimation()
+        self.playTimer.start(int(1000. / fps))
+
+    def playNextChannel(self):
+        """Show the next channel blitting only the image."""
+        indmin, indmax = self.channelRange()
+        n = self.playChannel + 1
+        if n < indmin or n >= indmax:
+            n = indmin
+        self.playChannel = n
+        ic = self.ici[self.bands.index(self.playBand)]
+        ic.blitImage(self.channelCache.get((self.playBand, n)))
+        self.prefetchChannels(n, [self.playBand])
+        self.sb.showMessage('Channel {:d} at {:.5f} um'.format(n, self.specCube.wave[n]))
+
+    def stopChannels(self):
+        """Stop the animation and move the slider to the last channel shown."""
+        if not self.playTimer.isActive():
+            return
+        self.playTimer.stop()
+        self.sb.clearMessage()
+        ic = self.ici[self.bands.index(self.playBand)]
+        ic.stopAnimation()
+        sc = self.sci[self.stabs.currentIndex()]
+        x = self.specCube.wave[self.playChannel]
+        if sc.xunit == 'THz':
+            c = 299792458.0  # speed of light in m/s
+            x = c / x * 1.e-6
+        self.slider.x = x
+        self.slider.line.set_xdata([x])
+        self.slider.region.set_x(x - self.slider.dx * 0.5)
+        sc.fig.canvas.draw_idle()
+        self.slideCube('stop playing')
+
+    def exportChannelMaps(self):
+        """Export channel maps or a velocity mosaic as PNG files or MP4 movie."""
+        import tempfile
+        try:
+            s = self.specCube
+        except BaseException:
+            self.sb.showMessage("First choose a cube ", 1000)
+            return
+        kinds = ['channel maps', 'velocity mosaic']
+        kind, okPressed = QInputDialog.getItem(self, "Export", "Export as", kinds, 0, False)
+        if not okPressed:
+            return
+        if kind == 'velocity mosaic':
+            npanels, okPressed = QInputDialog.getInt(self, "Velocity mosaic", "Number of panels",
+                                                     9, 2, 64)
+            if not okPressed:
+                return
+        fd = QFileDialog()
+        fd.setWindowTitle('Export channel maps')
+        fd.setLabelText(QFileDialog.Accept, "Export as")
+        if kind == 'channel maps':
+            fd.setNameFilters(["MP4 Files (*.mp4)", "PNG Files (*.png)", "All Files (*)"])
+        else:
+            fd.setNameFilters(["PNG Files (*.png)", "All Files (*)"])
+        fd.setOptions(QFileDialog.DontUseNativeDialog)
+        fd.setViewMode(QFileDialog.List)
+        if not fd.exec():
+            return
+        outfile = fd.selectedFiles()[0]
+        filename, file_extension = os.path.splitext(outfile)
+        if file_extension not in ['.png', '.mp4']:
+            file_extension = '.png'
+            outfile = filename + file_extension
+        if kind == 'velocity mosaic' and file_extension == '.mp4':
+            file_extension = '.png'
+            outfile = filename + file_extension
+        # Reuse colormap, stretch and contours of the current cube image
+        itab = self.itabs.currentIndex()
+        band = self.bands[itab]
+        if band not in ['Flux', 'uFlux']:
+            band = 'Flux'
+        ic = self.ici[self.bands.index(band)]
+        cmap = ic.image.get_cmap()
+        stretch = ic.norm.stretch
+        clim = (ic.cmin, ic.cmax)
+        contour = None
+        if self.contours == 'on' and self.tabContour[0] is not None:
+            ict = self.ici[self.tabContour[0]]
+            ihc = self.ihi[self.tabContour[0]]
+            if s.instrument != 'FIFI-LS':
+                ismo = ndimage.gaussian_filter(ict.oimage, sigma=1.0, order=0)
+            else:
+                ismo = ict.oimage
+            contour = (ismo, ict.wcs.to_header(), sorted(ihc.levels), self.colorContour[0])
+        header = s.wcs.to_header()
+        indmin, indmax = self.channelRange()
+        c = 299792458.0e-3  # speed of light in km/s
+        w0 = s.l0 * (1. + s.redshift)
+        self.sb.showMessage("Rendering the channel maps ...")
+        QApplication.processEvents()
+        if kind == 'channel maps':
+            if file_extension == '.mp4':
+                tmpdir = tempfile.mkdtemp()
+                base = os.path.join(tmpdir, 'frame')
+            else:
+                base = filename
+            frames = []
+            for k, n in enumerate(range(indmin, indmax)):
+                title = '{:.5f} $\\mu$m  v = {:.1f} km/s'.format(s.wave[n], c * (s.wave[n] / w0 - 1.))
+                image = s.mask.image(np.asarray(self.channelImage((band, n)), dtype=float))
+                frames.append((base + '_{:04d}.png'.format(k), [image], [title]))
+            multiRenderFigures(frames, header, cmap, stretch, clim, contour)
+            if file_extension == '.mp4':
+                import shutil
+                if framesToMovie(base + '_%04d.png', outfile, self.playFps):
+                    message = 'Movie exported to ' + outfile
+                else:
+                    for f, images, titles in frames:
+                        shutil.move(f, filename + f[len(base):])
+                    message = 'ffmpeg not available: frames exported as ' + filename + '_*.png'
+                shutil.rmtree(tmpdir, ignore_errors=True)
+            else:
+                message = 'Channel maps exported as ' + filename + '_*.png'
+        else:
+            if self.cumulative is None:
+                self.computeCumulativeCubes()
+            edges = np.linspace(indmin, indmax, npanels + 1).astype(int)
+            images = []
+            titles = []
+            for i0, i1 in zip(edges[:-1], edges[1:]):
+                if i1 <= i0:
+                    continue
+                image = self.cumulative[band].average(i0, i1)
+                if band == 'Flux' and s.instrument == 'GREAT':
+                    image = image * s.Tb2Jy
+                images.append(s.mask.image(image))
+                v0 = c * (s.wave[i0] / w0 - 1.)
+                v1 = c * (s.wave[i1 - 1] / w0 - 1.)
+                titles.append('{:.1f} - {:.1f} km/s'.format(v0, v1))
+            multiRenderFigures([(outfile, images, titles)], header, cmap, stretch, clim, contour)
+            message = 'Velocity mosaic exported to ' + outfile
+        print(message)
+        self.sb.showMessage(message, 4000)
 
     def switchUnits(self, event):
         """React to switch in units of the spectrum canvas."""
@@ -6264,7 +7100,10 @@ class GUI (QMainWindow):
         s = self.specCube
         spectrum = self.spectra[0]
         sc = self.sci[self.spectra.index(spectrum)]
-        fluxAll = np.nansum(s.flux, axis=(1,2))
+        # Limits of the region summed (whole image)
+        self.allLimits = None
+        total = self.totalSpectrum()
+        fluxAll = total['f']
         if s.instrument == 'GREAT':
             spec = Spectrum(s.wave, fluxAll*s.Tb2Jy, instrument=s.instrument,
                             redshift=s.redshift, l0=s.l0, Tb2Jy=s.Tb2Jy, 
@@ -6274,16 +7113,16 @@ class GUI (QMainWindow):
                             redshift=s.redshift, l0=s.l0, yunit='Jy',
                             pixscale=s.pixscale)
         elif s.instrument in ['PACS', 'FORCAST']:
-            expAll = np.nanmean(s.exposure, axis=(1,2))
-            efluxAll = np.sqrt(np.nansum(s.eflux*s.eflux, axis=(1,2)))
+            expAll = total['exp']
+            efluxAll = total['ef']
             spec = Spectrum(s.wave, fluxAll,  eflux=efluxAll, 
                             exposure=expAll,instrument=s.instrument,
                             redshift=s.redshift, l0=s.l0, yunit='Jy',
                             pixscale=s.pixscale)
         elif s.instrument == 'FIFI-LS':
-            ufluxAll = np.nansum(s.uflux, axis=(1,2))
-            expAll = np.nanmean(s.exposure, axis=(1,2))
-            efluxAll = np.sqrt(np.nansum(s.eflux*s.eflux, axis=(1,2)))
+            ufluxAll = total['uf']
+            expAll = total['exp']
+            efluxAll = total['ef']
             spec = Spectrum(s.wave, fluxAll, eflux=efluxAll, uflux= ufluxAll,
                             exposure=expAll, atran = s.atran, instrument=s.instrument,
                             redshift=s.redshift, baryshift = s.baryshift, l0=s.l0, yunit='Jy')
@@ -6296,6 +7135,49 @@ class GUI (QMainWindow):
         sc.span.active = False
         self.all = True
 
+    def totalSpectrum(self, limits=None):
+        """
+        Total spectra of the pixels not masked inside the limits (y0, y1, x0, x1) or in the
+        whole image: flux (f) and, depending on the instrument, error (ef), exposure (exp),
+        and flux uncorrected for the atmosphere (uf).
+        """
+        s = self.specCube
+        if limits is None:
+            y0, y1, x0, x1 = 0, s.ny, 0, s.nx
+        else:
+            y0, y1, x0, x1 = limits
+        if s.mask.count == 0:
+            region = (slice(None), slice(y0, y1), slice(x0, x1))
+            axis = (1, 2)
+        else:
+            # Only the columns of the pixels not masked
+            yy, xx = np.nonzero(~s.mask.mask[y0:y1, x0:x1])
+            region = (slice(None), yy + y0, xx + x0)
+            axis = 1
+        total = {'f': np.nansum(s.flux[region], axis=axis)}
+        if s.instrument in ['PACS', 'FORCAST', 'FIFI-LS']:
+            total['exp'] = np.nanmean(s.exposure[region], axis=axis)
+            total['ef'] = np.sqrt(np.nansum(s.eflux[region]**2, axis=axis))
+        if s.instrument == 'FIFI-LS':
+            total['uf'] = np.nansum(s.uflux[region], axis=axis)
+        return total
+
+    def updateAll(self):
+        """Recompute the total spectrum of the region zoomed and show it."""
+        s = self.specCube
+        sc = self.sci[self.spectra.index('All')]
+        total = self.totalSpectrum(self.allLimits)
+        if s.instrument == 'GREAT':
+            total['f'] = total['f'] * s.Tb2Jy
+        # Spectrum used by the previews of the atmospheric correction
+        sc.spectrum.flux = total['f']
+        if 'uf' in total:
+            sc.spectrum.uflux = total['uf']
+        if 'ef' in total:
+            sc.spectrum.eflux = total['ef']
+            sc.spectrum.exposure = total['exp']
+        sc.updateSpectrum(**total)
+
     def onSelect(self, xmin, xmax):
         """ Consider only a slice of the cube when computing the image """
         if self.slice == 'on':
@@ -6377,21 +7259,43 @@ class GUI (QMainWindow):
         elif self.specCube.instrument == 'FIFI-LS':
             imas = ['Flux','uFlux','Exp']
         # x,y = self.zoomlimits
+        if self.cumulative is None:
+            self.computeCumulativeCubes()
         for ima in imas:
             ic = self.ici[self.bands.index(ima)]
             #ih = self.ihi[self.bands.index(ima)]
-            if ima == 'Flux':
-                image = np.nanmean(self.specCube.flux[indmin:indmax,:,:], axis=0)
-            elif ima == 'uFlux':
-                image = np.nanmean(self.specCube.uflux[indmin:indmax,:,:], axis=0)
+            # Averages from differences of cumulative sums
+            if ima in ['Flux', 'uFlux']:
+                image = self.cumulative[ima].average(indmin, indmax)
             elif ima == 'Exp':
-                image = np.nansum(self.specCube.exposure[indmin:indmax,:,:], axis=0)
+                image = self.cumulative[ima].total(indmin, indmax)
             else:
                 pass
             # Update image
             ic.updateImage(image)
             ic.fig.canvas.draw_idle()            
         
+    def computeCumulativeCubes(self):
+        """Compute the cumulative sums along the wavelength used by the slicer."""
+        s = self.specCube
+        self.cumulative = {'Flux': CumulativeCube(s.flux)}
+        if s.instrument in ['PACS', 'FORCAST', 'FIFI-LS']:
+            self.cumulative['Exp'] = CumulativeCube(s.exposure, counts=False)
+        if s.instrument == 'FIFI-LS':
+            self.cumulative['uFlux'] = CumulativeCube(s.uflux)
+
+    def clearChannelCache(self):
+        """Stop the prefetching and empty the cache of channel images."""
+        self.prefetch.stop()
+        self.channelCache.clear()
+
+    def resetCubeCaches(self):
+        """Discard the quantities derived from the cube after the cube changes."""
+        self.cumulative = None
+        self.cells = None
+        self.smoothed = None
+        self.clearChannelCache()
+
     def removeContours(self):
         """Remove previous contours on image and histogram."""
         for ic in self.ici:
@@ -6437,12 +7341,12 @@ class GUI (QMainWindow):
         ic.zoomlimits = [(xmin, xmax), (ymin, ymax)]
         x = [xmin, xmax, xmin, xmax]
         y = [ymin, ymin, ymax, ymax]
-        ra, dec = ic.wcs.all_pix2world(x, y, 0)
+        xc, yc = x, y
         # If not in the flux image, compute values for the flux image
         band = self.bands.index('Flux')
         if itab != band:
             ic0 = self.ici[band]
-            x, y = ic0.wcs.all_world2pix(ra, dec, 0)
+            x, y = pix2pix(ic.wcs, ic0.wcs, xc, yc)
         x = [np.min(x), np.max(x)]
         y = [np.min(y), np.max(y)]
         # Compute limits for new total spectrum
@@ -6458,7 +7362,7 @@ class GUI (QMainWindow):
         ici = self.ici.copy()
         ici.remove(ic)
         for ima in ici:
-            x, y = ima.wcs.all_world2pix(ra, dec, 0)
+            x, y = pix2pix(ic.wcs, ima.wcs, xc, yc)
             x = [np.min(x), np.max(x)]
             y = [np.min(y), np.max(y)]
             ima.axes.callbacks.disconnect(ima.cid)
@@ -6467,21 +7371,8 @@ class GUI (QMainWindow):
             ima.zoomlimits = (x, y) 
             ima.changed = True
             ima.cid = ima.axes.callbacks.connect('ylim_changed', self.doZoomAll)
-        fluxAll = np.nansum(self.specCube.flux[:, y0:y1, x0:x1], axis=(1, 2))
-        if s.instrument in ['GREAT']:
-            t2j = self.specCube.Tb2Jy
-            sc.updateSpectrum(f=fluxAll*t2j)
-        elif s.instrument in ['HI','HALPHA','VLA','ALMA','MUSE','IRAM','CARMA','MMA','PCWI']:
-            sc.updateSpectrum(f=fluxAll)
-        elif s.instrument in ['PACS','FORCAST']:
-            expAll = np.nanmean(s.exposure[:, y0:y1, x0:x1], axis=(1, 2))
-            efluxAll = np.sqrt(np.nansum(s.eflux[:, y0:y1, x0:x1]**2, axis=(1, 2)))
-            sc.updateSpectrum(f=fluxAll,ef=efluxAll, exp=expAll)            
-        elif self.specCube.instrument == 'FIFI-LS':
-            ufluxAll = np.nansum(s.uflux[:, y0:y1, x0:x1], axis=(1, 2))
-            expAll = np.nanmean(s.exposure[:, y0:y1, x0:x1], axis=(1, 2))
-            efluxAll = np.sqrt(np.nansum(s.eflux[:, y0:y1, x0:x1]**2, axis=(1, 2)))
-            sc.updateSpectrum(f=fluxAll, ef=efluxAll, uf=ufluxAll, exp=expAll)
+        self.allLimits = (y0, y1, x0, x1)
+        self.updateAll()
 
     def doZoomSpec(self,event):
         """ In the future impose the same limits to all the spectral tabs """
@@ -228,7 +228,8 @@ def computeMoments(p,m,w,dw,f):
             
     return p, M0, M1, M2, M3, M4, sigma
 
-def multiComputeMoments(m,w,f,c,moments,points):
+def multiComputeMoments(m,w,f,c,moments,points,checkpoint=None):
+    """Compute the moments on the points (the pixels done are saved in the checkpoint)."""
 
     # To avoid forking error in MAC OS-X
     try:
@@ -241,75 +242,225 @@ def multiComputeMoments(m,w,f,c,moments,points):
     n3,n2,n1 = np.shape(moments)
     noise = np.zeros((n2,n1))
 
+    # Skip the pixels done by a previous run
+    if checkpoint is not None:
+        arrays = {'M' + str(k): moments[k] for k in range(5)}
+        arrays['noise'] = noise
+        checkpoint.attach(arrays)
+        points = checkpoint.pending(points)
     
     # Compute dw
-    dw = [] 
-    dw.append([w[1]-w[0]])
-    dw.append(list((w[2:]-w[:-2])*0.5))
-    dw.append([w[-1]-w[-2]])
-    dw = np.concatenate(dw)
+    dw = channelWidths(w)
 
     with mp.Pool(processes=mp.cpu_count()) as pool:
         res = [pool.apply_async(computeMoments, (p,m[:,p[1],p[0]],w,dw,f[:,p[1],p[0]]-c[:,p[1],p[0]])) for p in points]
-        results = [r.get() for r in res]
-
-        
-    for p, M0, M1, M2, M3, M4, sigma in results:
-        i,j = p
-        moments[0][j,i] = M0
-        moments[1][j,i] = M1
-        moments[2][j,i] = M2
-        moments[3][j,i] = M3
-        moments[4][j,i] = M4
-        noise[j,i] = sigma
+        # Store the results as they arrive
+        for r in res:
+            p, M0, M1, M2, M3, M4, sigma = r.get()
+            i,j = p
+            moments[0][j,i] = M0
+            moments[1][j,i] = M1
+            moments[2][j,i] = M2
+            moments[3][j,i] = M3
+            moments[4][j,i] = M4
+            noise[j,i] = sigma
+            if checkpoint is not None:
+                checkpoint.mark(p)
             
     return moments, noise
     
 
-def multiFitContinuum(m, w, f, c, c0, w0, points, slope, intcp, posCont, kernel, exp=None):
+def channelWidths(w):
+    """Width of each channel of a wavelength grid."""
+    dw = np.empty(len(w))
+    dw[0] = w[1] - w[0]
+    dw[1:-1] = (w[2:] - w[:-2]) * 0.5
+    dw[-1] = w[-1] - w[-2]
+    return dw
+
+def integrateSpectra(f, w, continuum=None, channels=None, chunksize=64 * 1024 * 1024):
+    """
+    Integrated intensity [W/m2] of the spectra of a cube (f in Jy, w in um).
+    Arguments:
+        continuum  continuum subtracted before integrating: None, a value, a map (ny,nx)
+                   or a cube with the same shape as f
+        channels   range (i0, i1) of channels to integrate (all by default)
+    Undefined values are ignored. The cube is processed a few rows at a time
+    to limit the memory used by temporary arrays.
+    """
+    c = 299792458. # m/s
+    w = np.asarray(w, dtype=float)
+    # Conversion of Jy into Jy Hz / um times the channel width, and Jy Hz into W/m2
+    k = c / (w * w) * 1.e6 * channelWidths(w) * 1.e-26
+    i0, i1 = (0, len(w)) if channels is None else channels
+    k = k[i0:i1]
+    nz, ny, nx = np.shape(f)
+    cont = None if continuum is None else np.asarray(continuum, dtype=float)
+    intensity = np.empty((ny, nx))
+    nrows = max(1, chunksize // max(1, (i1 - i0) * nx * 8))
+    for j0 in range(0, ny, nrows):
+        j1 = min(ny, j0 + nrows)
+        block = np.array(f[i0:i1, j0:j1, :], dtype=float)
+        if cont is not None:
+            if cont.ndim == 3:
+                block -= cont[i0:i1, j0:j1, :]
+            elif cont.ndim == 2:
+                block -= cont[j0:j1, :]
+            else:
+                block -= cont
+        block[~np.isfinite(block)] = 0.
+        intensity[j0:j1, :] = np.tensordot(k, block, axes=1)
+    return intensity
+
+def closestChannel(x, w):
+    """
+    Index of the channel of the grid w closest to each wavelength x (as np.argmin(np.abs(x-w)),
+    including the choice of the first channel in case of tie). The grid has to be monotonic.
+    Undefined wavelengths give the index 0.
+    """
+    w = np.asarray(w, dtype=float)
+    x = np.asarray(x, dtype=float)
+    n = len(w)
+    decreasing = n > 1 and w[0] > w[-1]
+    ws = w[::-1] if decreasing else w
+    xs = np.where(np.isfinite(x), x, ws[0])
+    i1 = np.clip(np.searchsorted(ws, xs), 1, max(1, n - 1))
+    i0 = i1 - 1
+    if n == 1:
+        return np.zeros(np.shape(x), dtype=int)
+    d0 = np.abs(xs - ws[i0])
+    d1 = np.abs(ws[i1] - xs)
+    if decreasing:
+        # The first channel of the original grid is the one of larger index
+        i = np.where(d1 <= d0, i1, i0)
+        return n - 1 - i
+    return np.where(d0 <= d1, i0, i1)
+
+def continuumAt(x, w=None, continuum=None, intercept=None, slope=None, w0=0.):
+    """
+    Continuum at the wavelengths x (e.g. the map of the centers of a fitted line).
+    With a continuum cube (nz, ny, nx) and x of shape (ny, nx), the channel of w closest
+    to x is taken for each spectrum. Otherwise, the linear continuum
+    intercept + slope * (x - w0) is evaluated (parameters can be maps or values).
+    The continuum is NaN where x is undefined.
+    """
+    x = np.asarray(x, dtype=float)
+    if continuum is not None:
+        idx = closestChannel(x, w)
+        c = np.take_along_axis(continuum, idx[None, ...], axis=0)[0]
+    else:
+        c = intercept + (0. if slope is None else slope * (x - w0))
+    return np.where(np.isfinite(x), c, np.nan)
+
+def zeroMomentMap(f, w, chunksize=64 * 1024 * 1024):
+    """Integrated intensity [W/m2] of each spectrum after subtracting its median."""
+    import warnings
+    nz, ny, nx = np.shape(f)
+    median = np.empty((ny, nx))
+    nrows = max(1, chunksize // max(1, nz * nx * 8))
+    with warnings.catch_warnings():
+        # Spaxels without data have an undefined median
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for j0 in range(0, ny, nrows):
+            j1 = min(ny, j0 + nrows)
+            median[j0:j1, :] = np.nanmedian(f[:, j0:j1, :], axis=0)
+    return integrateSpectra(f, w, continuum=median, chunksize=chunksize)
+    
+
+def smoothCube(cube, kernel=1, sigma=None, chunksize=64 * 1024 * 1024):
+    """
+    Spatial average of the planes of a cube ignoring the undefined values.
+    Arguments:
+        kernel   1 (no smoothing), 5 (pixel and its 4 neighbours), or 9 (3x3 pixels)
+        sigma    width (in pixels) of a Gaussian kernel used instead
+    The filters are separable (the 5 pixel kernel is the sum of two 1D kernels minus
+    the central pixel) and are applied to the values and to the weights of the
+    defined values, a few channels at a time.
+    """
+    from scipy.ndimage import correlate1d, gaussian_filter1d
+    if sigma is None and kernel == 1:
+        return cube
+    box = np.ones(3)
+
+    def filt(a):
+        if sigma is not None:
+            a = gaussian_filter1d(a, sigma, axis=1, mode='constant')
+            return gaussian_filter1d(a, sigma, axis=2, mode='constant')
+        elif kernel == 9:
+            a = correlate1d(a, box, axis=1, mode='constant')
+            return correlate1d(a, box, axis=2, mode='constant')
+        else:
+            return (correlate1d(a, box, axis=1, mode='constant')
+                    + correlate1d(a, box, axis=2, mode='constant') - a)
+
+    nz, ny, nx = np.shape(cube)
+    out = np.empty((nz, ny, nx), dtype=np.result_type(cube, np.float32))
+    nchan = max(1, chunksize // max(1, ny * nx * 8))
+    for z0 in range(0, nz, nchan):
+        z1 = min(nz, z0 + nchan)
+        block = np.asarray(cube[z0:z1], dtype=float)
+        defined = np.isfinite(block)
+        values = filt(np.where(defined, block, 0.))
+        weights = filt(defined.astype(float))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[z0:z1] = np.where(weights > 1.e-6, values / weights, np.nan)
+    return out
+
+def multiFitContinuum(m, w, f, c, c0, w0, points, slope, intcp, posCont, kernel, exp=None,
+                      checkpoint=None):
+    """
+    Fit the continuum on the points. Returns the continuum cube, the continuum at the
+    reference wavelength w0, and the slope. The fitted pixels are saved in the checkpoint
+    by their parameters (continuum at w0 and slope).
+    """
     # To avoid forking error in MAC OS-X
     try:
         mp.set_start_method('spawn')
         print('started spawing')
     except RuntimeError:
         pass
-    if kernel == 1:
-        ik = np.array([0])
-        jk = np.array([0])
-    elif kernel == 5:
-        ik = np.array([-1,0,0,0,1])
-        jk = np.array([0,-1,0,1,0])
-    elif kernel == 9:
-        ik = np.array([-1,-1,-1,0,0,0,1,1,1])
-        jk = np.array([-1,0,1,-1,0,1,-1,0,1])
-    else:
+    if kernel not in [1, 5, 9]:
         print ('unsupported kernel, use one pixel only')
-        ik = np.array([0])
-        jk = np.array([0])
-    if exp is None:
-        with mp.Pool(processes=mp.cpu_count()) as pool:
-            res = [pool.apply_async(fitContinuum, (p,slope,intcp,posCont,m[:,p[1],p[0]],w,
-                                                   f[:,p[1]+ik,p[0]+jk])) for p in points]
-            results = [r.get() for r in res]
-    else:
-        with mp.Pool(processes=mp.cpu_count()) as pool:
-            res = [pool.apply_async(fiteContinuum, 
-                                    (p, slope, intcp, posCont, m[:,p[1],p[0]], w,
-                                     f[:,p[1]+ik,p[0]+jk],exp[:,p[1]+ik,p[0]+jk])) for p in points]
-            results = [r.get() for r in res] 
+        kernel = 1
+    # Average the spectra over the kernel once (cubes already smoothed are passed with kernel 1)
+    if kernel != 1:
+        f = smoothCube(f, kernel)
+        if exp is not None:
+            exp = smoothCube(exp, kernel)
     print('c is writeable ', c.flags)
     c_ = c.copy()
     c0_ = c0.copy()  # continuum at ref wav
     cs_ = c0.copy()  # slope of cont
-    for p, pars in results:
-        if pars is not None:
-            i, j = p
-            c_[:, j, i] = residuals(pars, w)
-            c0_[j, i] = residuals(pars, w0)
-            try:
-                cs_[j, i] = pars['m'].value
-            except:
-                cs_[j, i] = 0.
+    # Skip the pixels done by a previous run (the continuum is recomputed from the parameters)
+    if checkpoint is not None:
+        fitted = np.zeros(np.shape(c0), dtype=bool)
+        done = checkpoint.attach({'C0': c0_, 'Cs': cs_, 'fitted': fitted})
+        j, i = np.where(done & fitted)
+        c_[:, j, i] = w[:, None] * cs_[j, i] + (c0_[j, i] - cs_[j, i] * w0)
+        points = checkpoint.pending(points)
+    with mp.Pool(processes=mp.cpu_count()) as pool:
+        if exp is None:
+            res = [pool.apply_async(fitContinuum, (p,slope,intcp,posCont,m[:,p[1],p[0]],w,
+                                                   f[:,p[1],p[0],None])) for p in points]
+        else:
+            res = [pool.apply_async(fiteContinuum, 
+                                    (p, slope, intcp, posCont, m[:,p[1],p[0]], w,
+                                     f[:,p[1],p[0],None],exp[:,p[1],p[0],None])) for p in points]
+        # Store the results as they arrive
+        for r in res:
+            p, pars = r.get()
+            if pars is not None:
+                i, j = p
+                c_[:, j, i] = residuals(pars, w)
+                c0_[j, i] = residuals(pars, w0)
+                try:
+                    cs_[j, i] = pars['m'].value
+                except:
+                    cs_[j, i] = 0.
+                if checkpoint is not None:
+                    fitted[j, i] = True
+            if checkpoint is not None:
+                checkpoint.mark(p)
     return c_, c0_, cs_
 
 # Fit of lines
@@ -431,7 +582,8 @@ def fitLines(p, m, w, f, lines, fitmodel):
         nlines = len(lines)
         return p, np.full((nlines, 7), np.nan)
 
-def multiFitLines(m, w, f, c, lineguesses, model, linefits, points):
+def multiFitLines(m, w, f, c, lineguesses, model, linefits, points, checkpoint=None):
+    """Fit the lines on the points (the pixels done are saved in the checkpoint)."""
 
     # To avoid forking error in MAC OS-X
     try:
@@ -442,6 +594,12 @@ def multiFitLines(m, w, f, c, lineguesses, model, linefits, points):
     
     print('Fit model is ',model)
 
+    # Skip the pixels done by a previous run
+    if checkpoint is not None:
+        checkpoint.attach({'lines': linefits})
+        points = checkpoint.pending(points)
+
+    n = len(lineguesses)
     with mp.Pool(processes=mp.cpu_count()) as pool:
         res = [pool.apply_async(fitLines, 
                                 (p, 
@@ -450,17 +608,36 @@ def multiFitLines(m, w, f, c, lineguesses, model, linefits, points):
                                  f[:,p[1],p[0]]-c[:,p[1],p[0]], 
                                  lineguesses, model)
                                 ) for p in points]
-        results = [r.get() for r in res]
-
-    n = len(lineguesses)
-    for p, linepars in results:
-        i,j = p
-        for k in range(n):
-            for l in range(7):
-                linefits[k][l][j,i] = linepars[k][l]
+        # Store the results as they arrive
+        for r in res:
+            p, linepars = r.get()
+            i,j = p
+            for k in range(n):
+                for l in range(7):
+                    linefits[k][l][j,i] = linepars[k][l]
+            if checkpoint is not None:
+                checkpoint.mark(p)
             
     return 1
 
+def multiFitLinesBins(m, w, f, lineguesses, model):
+    """Fit the lines on the spectra of bins (columns of m and f), each with its own guesses."""
+
+    # To avoid forking error in MAC OS-X
+    try:
+        mp.set_start_method('spawn')
+        print('started spawing')
+    except RuntimeError:
+        pass
+
+    nz, nbins = np.shape(f)
+    with mp.Pool(processes=mp.cpu_count()) as pool:
+        res = [pool.apply_async(fitLines, (k, m[:, k], w, f[:, k], lineguesses[k], model))
+               for k in range(nbins)]
+        results = [r.get() for r in res]
+
+    return [linepars for k, linepars in results]
+
 def multiFitLinesSingle(m, w, f, c, lineguesses, model, linefits, points):
 
     print('Fit model is ',model)
@@ -502,17 +679,12 @@ def residualsPsf(p, x, y, data=None, err=None):
             return (model - data.flatten())/err.flatten()
 
 def histoImage(image, percent, xmin=None, xmax=None):
-    #ima = image.ravel()
-    #mask = np.isfinite(ima)
-    #ima = ima[mask]
-    ima = image[np.isfinite(image)]
+    from sospex.cache import imageStatistics
+    # Sorted unique values and statistics are computed once for each image
+    stats = imageStatistics(image)
+    ima = stats.unique
     nh = len(ima)
     if nh > 0:
-        ima = np.sort(ima)
-        # Take uniq to avoid repeated values (which could be border values)
-        u, indices = np.unique(ima, return_index=True)
-        ima = ima[indices]
-        nh = len(ima)
         s = np.size(ima)
         if percent is None:
             percent = 99.0
@@ -521,10 +693,10 @@ def histoImage(image, percent, xmin=None, xmax=None):
         smin = int(s*p1)
         smax = min(int(s*p2)-1,s-1)
         nbins=256
-        imedian = np.median(ima)
-        sdev = np.nanmedian(np.abs(ima - np.nanmedian(ima))) * 1.4826 # Gauss distr
-        imin = np.min(ima)
-        imax = np.max(ima)
+        imedian = stats.umedian
+        sdev = stats.usdev
+        imin = ima[0]
+        imax = ima[-1]
         epsilon = sdev/3.            
         # Define the interval containing 99% of the values
         if xmin == None:
@@ -761,7 +933,7 @@ def fitApertureLines(sc, intercept, slope):
         sigmaErr = pars[li + 'sigma'].stderr   # Observed
         A =  pars[li+'amplitude'].value * norm
         Aerr = pars[li+'amplitude'].stderr * norm
-        c0 = intc + slop * center # Continuum at line center
+        c0 = float(continuumAt(center, intercept=intc, slope=slop)) # Continuum at line center
         if slop == 0:
             ec0 = eintc
         else:
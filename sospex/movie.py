@@ -0,0 +1,80 @@
+import numpy as np
+import multiprocessing as mp
+
+
+def renderFigure(filename, images, titles, header, cmap, stretch, clim,
+                 contour=None, dpi=100):
+    """
+    Render one or more channel maps in a figure with the Agg backend and save it.
+    Arguments:
+        images   list of images (a mosaic is created if more than one)
+        titles   list of titles of the panels
+        header   header with the celestial WCS of the images
+        cmap     matplotlib colormap
+        stretch  astropy stretch used by the image normalization
+        clim     intensity limits
+        contour  tuple (image, header, levels, color) or None
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from astropy.visualization import ImageNormalize
+    from astropy.wcs import WCS
+    wcs = WCS(header)
+    n = len(images)
+    ncols = int(np.ceil(np.sqrt(n)))
+    nrows = int(np.ceil(n / ncols))
+    fig = Figure(figsize=(5 * ncols, 5 * nrows), dpi=dpi)
+    FigureCanvasAgg(fig)
+    if contour is not None:
+        cimage, cheader, levels, color = contour
+        cwcs = WCS(cheader)
+    for i, (image, title) in enumerate(zip(images, titles)):
+        ax = fig.add_subplot(nrows, ncols, i + 1, projection=wcs)
+        norm = ImageNormalize(vmin=clim[0], vmax=clim[1], stretch=stretch)
+        ax.imshow(image, origin='lower', cmap=cmap, interpolation='nearest', norm=norm)
+        if contour is not None:
+            ax.contour(cimage, levels, colors=color, transform=ax.get_transform(cwcs))
+            ax.set_xlim(-0.5, image.shape[1] - 0.5)
+            ax.set_ylim(-0.5, image.shape[0] - 0.5)
+        ax.coords[0].set_major_formatter('hh:mm:ss')
+        if i % ncols == 0:
+            ax.set_ylabel('Dec')
+        else:
+            ax.coords[1].set_ticklabel_visible(False)
+        if i >= n - ncols:
+            ax.set_xlabel('R.A.')
+        else:
+            ax.coords[0].set_ticklabel_visible(False)
+        ax.set_title(title)
+    fig.savefig(filename)
+    return filename
+
+
+def multiRenderFigures(frames, header, cmap, stretch, clim, contour=None, dpi=100):
+    """Render in parallel frames given as (filename, images, titles)."""
+    # To avoid forking error in MAC OS-X
+    try:
+        mp.set_start_method('spawn')
+        print('started spawing')
+    except RuntimeError:
+        pass
+    with mp.Pool(processes=mp.cpu_count()) as pool:
+        res = [pool.apply_async(renderFigure, (filename, images, titles, header, cmap,
+                                               stretch, clim, contour, dpi))
+               for filename, images, titles in frames]
+        results = [r.get() for r in res]
+    return results
+
+
+def framesToMovie(pattern, outfile, fps):
+    """Assemble PNG frames in a MP4 movie with ffmpeg."""
+    import shutil
+    import subprocess
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        print('ffmpeg is not installed, the frames are saved as PNG files')
+        return False
+    command = [ffmpeg, '-y', '-framerate', str(fps), '-i', pattern,
+               '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', outfile]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
@@ -0,0 +1,128 @@
+import os
+import json
+import zlib
+import weakref
+import numpy as np
+from sospex.store import jsonDefault
+
+
+def arrayChecksum(data, chunksize=64 * 1024 * 1024):
+    """Checksum of the shape, type, and values of an array, computed by chunks."""
+    data = np.asarray(data)
+    crc = zlib.crc32((str(data.shape) + data.dtype.str).encode())
+    if data.ndim == 0:
+        return '{:08x}'.format(zlib.crc32(np.ascontiguousarray(data).tobytes(), crc))
+    rowbytes = max(1, int(np.prod(data.shape[1:])) * data.dtype.itemsize)
+    nrows = max(1, chunksize // rowbytes)
+    for k0 in range(0, data.shape[0], nrows):
+        crc = zlib.crc32(np.ascontiguousarray(data[k0:k0 + nrows]).data, crc)
+    return '{:08x}'.format(crc)
+
+
+def fileReference(filename):
+    """Name, size, and modification time of a file (to check that it did not change)."""
+    stat = os.stat(filename)
+    return {'filename': os.path.abspath(filename), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+class Session(object):
+    """
+    Snapshot of the analysis of a cube kept in a directory:
+        session.json      reference of the cube, settings, guesses, apertures, and array files
+        <name>.<n>.npy    arrays (products, masks, tessellation)
+    Each snapshot writes only the arrays replaced, or modified in place according to their
+    version, since the previous one, so it can be taken often. Arrays are always written
+    in new files and session.json is replaced atomically, so the arrays of a restored
+    session, memory-mapped (copy-on-write) on their files, are never overwritten.
+    Files no more used are removed when possible (not while mapped on Windows).
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}    # file of each array in the last snapshot
+        self.saved = {}    # array (weak reference) and version of the last snapshot
+        self.stale = []    # files to remove
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def exists(self):
+        return os.path.exists(self.path('session.json'))
+
+    def newFile(self, name):
+        """Name of a file not yet used for an array."""
+        n = 0
+        for filename in os.listdir(self.directory):
+            parts = filename.split('.')
+            if len(parts) == 3 and parts[0] == name and parts[1].isdigit():
+                n = max(n, int(parts[1]))
+        return name + '.' + str(n + 1) + '.npy'
+
+    def modified(self, name, data, version):
+        """True if the array is not the one saved or if it was modified since."""
+        if name not in self.saved or not os.path.exists(self.path(self.files[name])):
+            return True
+        ref, saved = self.saved[name]
+        return ref() is not data or saved != version
+
+    def save(self, arrays, state, versions=None):
+        """
+        Save the arrays (dictionary name: array, None if undefined) and the state.
+        The versions (dictionary name: counter) identify the modifications in place.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if versions is None:
+            versions = {}
+        files = {}
+        saved = {}
+        for name, data in arrays.items():
+            if data is None:
+                continue
+            version = versions.get(name, 0)
+            if self.modified(name, data, version):
+                filename = self.newFile(name)
+                tmpfile = self.path(filename) + '.part'
+                with open(tmpfile, 'wb') as f:
+                    np.save(f, data, allow_pickle=False)
+                os.replace(tmpfile, self.path(filename))
+            else:
+                filename = self.files[name]
+            files[name] = filename
+            saved[name] = (weakref.ref(data), version)
+        state = dict(state)
+        state['arrays'] = files
+        filename = self.path('session.json')
+        with open(filename + '.part', 'w') as f:
+            json.dump(state, f, indent=1, default=jsonDefault)
+        os.replace(filename + '.part', filename)
+        # Files of the previous snapshot no more used
+        self.stale += [f for f in self.files.values() if f not in files.values()]
+        self.files = files
+        self.saved = saved
+        self.removeStale()
+
+    def removeStale(self):
+        stale = []
+        for filename in self.stale:
+            try:
+                if os.path.exists(self.path(filename)):
+                    os.remove(self.path(filename))
+            except OSError:
+                # Still mapped: removed after the next snapshot
+                stale.append(filename)
+        self.stale = stale
+
+    def load(self):
+        """State and arrays (memory-mapped) of the last snapshot."""
+        with open(self.path('session.json')) as f:
+            state = json.load(f)
+        arrays = {}
+        self.files = {}
+        self.saved = {}
+        for name, filename in state.get('arrays', {}).items():
+            if not filename.endswith('.npy'):
+                # Sessions saved with the checksums of the arrays
+                filename = name + '.npy'
+            arrays[name] = np.load(self.path(filename), mmap_mode='c', allow_pickle=False)
+            self.files[name] = filename
+            self.saved[name] = (weakref.ref(arrays[name]), 0)
+        return state, arrays
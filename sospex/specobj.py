@@ -136,6 +136,8 @@ class specCubeAstro(object):
         # Alternative way
         # self.points = np.array([np.ravel(xi), np.ravel(yi)]).transpose()
         self.points = np.c_[np.ravel(xi), np.ravel(yi)]
+        # Mask of spatial pixels
+        self.mask = MaskLayer((self.ny, self.nx))
         # Time used for reading
         elapsed_time = time.process_time() - t
         print('Reading of cube completed in ', elapsed_time,' s')
@@ -673,6 +675,8 @@ class specCube(object):
         # Alternative way
         # self.points = np.array([np.ravel(xi), np.ravel(yi)]).transpose()
         self.points = np.c_[np.ravel(xi), np.ravel(yi)]
+        # Mask of spatial pixels
+        self.mask = MaskLayer((self.ny, self.nx))
         # Time used for reading
         elapsed_time = time.process_time() - t
         print('Reading of cube completed in ', elapsed_time,' s')
@@ -1250,6 +1254,187 @@ class specCube(object):
             else:
                 return 1.9163 * l * l - 187.35 * l + 5496.9
 
+class CumulativeCube(object):
+    """
+    Cumulative sums (and counts of finite values) along the spectral axis of a cube.
+    The sum over channels [i0,i1) is the difference of the cumulative sums at i1 and i0.
+    To halve the memory, the sums are stored in single precision from the start of blocks
+    of channels, while the sums at the start of each block are kept in double precision.
+    """
+    def __init__(self, cube, counts=True, block=64, chunksize=64 * 1024 * 1024):
+        self.counts = counts
+        self.block = block
+        self.chunksize = chunksize   # bytes of cube used in each step
+        self.compute(cube)
+
+    def compute(self, cube):
+        """Compute the cumulative sums over the full cube."""
+        nz, ny, nx = np.shape(cube)
+        self.nz = nz
+        K = self.block
+        nblocks = -(-nz // K)
+        # Sums from the start of the block of each channel and sums before each block
+        self.local = np.zeros((nz + 1, ny, nx), dtype=np.float32)
+        self.start = np.zeros((nblocks + 1, ny, nx), dtype=np.float64)
+        if self.counts:
+            self.count = np.zeros((nz + 1, ny, nx), dtype=np.min_scalar_type(nz))
+        else:
+            self.count = None
+        # Channels processed at each step (whole blocks) to limit the temporary arrays
+        nchunk = max(1, self.chunksize // max(1, ny * nx * 8) // K) * K
+        for k0 in range(0, nz, nchunk):
+            k1 = min(nz, k0 + nchunk)
+            block = np.array(cube[k0:k1], dtype=np.float64)
+            finite = np.isfinite(block)
+            block[~finite] = 0.
+            for b0 in range(k0, k1, K):
+                b1 = min(k1, b0 + K)
+                partial = np.cumsum(block[b0 - k0:b1 - k0], axis=0)
+                self.local[b0 + 1:b1 + 1] = partial
+                self.start[b0 // K + 1] = self.start[b0 // K] + partial[-1]
+            if self.counts:
+                np.cumsum(finite, axis=0, out=self.count[k0 + 1:k1 + 1])
+                self.count[k0 + 1:k1 + 1] += self.count[k0]
+
+    def cumulative(self, i):
+        """Sum of the finite values in the channels [0,i)."""
+        return self.start[max(i - 1, 0) // self.block] + self.local[i]
+
+    def total(self, i0, i1):
+        """Sum of the finite values in the channels [i0,i1)."""
+        i0, i1 = self.limits(i0, i1)
+        return self.cumulative(i1) - self.cumulative(i0)
+
+    def average(self, i0, i1):
+        """Mean of the finite values in the channels [i0,i1), NaN where no value is finite."""
+        i0, i1 = self.limits(i0, i1)
+        s = self.cumulative(i1) - self.cumulative(i0)
+        n = self.count[i1].astype(np.float64) - self.count[i0]
+        image = np.full(np.shape(s), np.nan)
+        np.divide(s, n, out=image, where=n > 0)
+        return image
+
+    def limits(self, i0, i1):
+        i0 = int(np.clip(i0, 0, self.nz))
+        i1 = int(np.clip(i1, i0, self.nz))
+        return i0, i1
+
+class MaskLayer(object):
+    """
+    Mask of the spatial pixels of a cube, applied when displaying, extracting and fitting
+    the data, so the cube itself is never modified.
+    Each modification is stored as the flat indices of the pixels which changed state,
+    so it can be undone and redone.
+    """
+    def __init__(self, shape, mask=None):
+        self.shape = tuple(shape)
+        if mask is None:
+            self.mask = np.zeros(self.shape, dtype=bool)
+        else:
+            self.mask = np.array(mask, dtype=bool)
+        self.count = int(np.sum(self.mask))
+        self.history = []
+        self.position = 0   # number of modifications applied
+        self.version = 0    # changed at each modification, undo, or redo
+        self.itype = np.min_scalar_type(max(1, self.mask.size - 1))
+
+    def set(self, yy, xx, masked=True):
+        """Mask (or unmask) the pixels (yy,xx). Returns the pixels which changed."""
+        flat = self.mask.reshape(-1)
+        idx = np.unique(np.ravel_multi_index((np.asarray(yy, dtype=int), np.asarray(xx, dtype=int)),
+                                             self.shape))
+        idx = idx[flat[idx] != masked].astype(self.itype)
+        if len(idx) == 0:
+            return None
+        flat[idx] = masked
+        self.count += len(idx) if masked else -len(idx)
+        # A new modification discards the undone ones
+        del self.history[self.position:]
+        self.history.append((masked, idx))
+        self.position += 1
+        self.version += 1
+        return np.unravel_index(idx, self.shape)
+
+    def undo(self):
+        """Revert the last modification. Returns the pixels which changed (None if no history)."""
+        if self.position == 0:
+            return None
+        self.position -= 1
+        self.version += 1
+        masked, idx = self.history[self.position]
+        self.mask.reshape(-1)[idx] = not masked
+        self.count += -len(idx) if masked else len(idx)
+        return np.unravel_index(idx, self.shape)
+
+    def redo(self):
+        """Apply again the last undone modification."""
+        if self.position == len(self.history):
+            return None
+        masked, idx = self.history[self.position]
+        self.mask.reshape(-1)[idx] = masked
+        self.count += len(idx) if masked else -len(idx)
+        self.position += 1
+        self.version += 1
+        return np.unravel_index(idx, self.shape)
+
+    def image(self, data):
+        """Copy of an image (or cube) with NaN on the masked pixels (the data if nothing is masked)."""
+        if self.count == 0 or np.shape(data)[-2:] != self.shape:
+            return data
+        return np.where(self.mask, np.nan, data)
+
+    def select(self, points):
+        """Points (x,y) which are not masked."""
+        if self.count == 0 or len(points) == 0:
+            return points
+        points = np.asarray(points)
+        return points[~self.mask[points[:, 1].astype(int), points[:, 0].astype(int)]]
+
+    def crop(self, y0, y1, x0, x1):
+        """New layer with the mask of a part of the image (without history)."""
+        mask = self.mask[y0:y1, x0:x1]
+        return MaskLayer(mask.shape, mask)
+
+
+def trimSpectralCube(cube, i0, i1):
+    """
+    Keep the channels i0:i1 of a cube. The cubes are views of the original ones
+    (nothing is copied) and the spectral axis is updated consistently.
+    """
+    for name in ['flux', 'eflux', 'uflux', 'euflux', 'exposure']:
+        if getattr(cube, name, None) is not None:
+            setattr(cube, name, getattr(cube, name)[i0:i1])
+    for name in ['wave', 'atran', 'response']:
+        values = getattr(cube, name, None)
+        if values is not None and np.size(values) > 1:
+            setattr(cube, name, values[i0:i1])
+    cube.nz = cube.n = len(cube.wave)
+    if getattr(cube, 'crpix3', None) is not None:
+        cube.crpix3 -= i0
+    # Index of the ref wavelength
+    cube.n0 = int(np.argmin(np.abs(cube.wave - cube.l0)))
+    if cube.n0 <= 0:
+        cube.n0 = cube.nz // 2
+
+def cropSpectralCube(cube, y0, y1, x0, x1):
+    """
+    Keep the spatial pixels [y0:y1, x0:x1] of a cube. The cubes are views of the
+    original ones (nothing is copied); WCS, grid of points, and mask are updated.
+    """
+    for name in ['flux', 'eflux', 'uflux', 'euflux', 'exposure']:
+        if getattr(cube, name, None) is not None:
+            setattr(cube, name, getattr(cube, name)[:, y0:y1, x0:x1])
+    if getattr(cube, 'x', None) is not None:
+        cube.x = cube.x[x0:x1]
+    if getattr(cube, 'y', None) is not None:
+        cube.y = cube.y[y0:y1]
+    cube.wcs = cube.wcs[y0:y1, x0:x1]
+    cube.nz, cube.ny, cube.nx = np.shape(cube.flux)
+    xi, yi = np.meshgrid(np.arange(cube.nx), np.arange(cube.ny))
+    cube.points = np.c_[np.ravel(xi), np.ravel(yi)]
+    cube.mask = cube.mask.crop(y0, y1, x0, x1)
+
+
 class ExtSpectrum(object):
     """ class for external spectrum """
     def __init__(self, infile):
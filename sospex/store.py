@@ -0,0 +1,141 @@
+import io
+import json
+import zipfile
+import numpy as np
+
+
+def jsonDefault(obj):
+    """Convert numpy values for the JSON encoder."""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    elif isinstance(obj, np.floating):
+        return float(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError('Object of type ' + type(obj).__name__ + ' is not JSON serializable')
+
+
+class ProductStore(object):
+    """
+    Analysis products of a cube kept in one compressed container (a zip file).
+    Each array is split in chunks along its first axis (channels of a cube, rows of a map),
+    stored as compressed .npy members, so an array or a part of it can be read without
+    reading (or decompressing) the rest of the file. Other products (guesses, settings)
+    are stored as JSON members.
+    Arguments:
+        filename    name of the container
+        mode        'r' to read, 'w' to create, 'a' to add products
+        chunkbytes  approximate size of the chunks (uncompressed)
+    Products cannot be rewritten: a new container has to be created to update them.
+    """
+    def __init__(self, filename, mode='r', chunkbytes=4 * 1024 * 1024, compresslevel=4):
+        self.filename = filename
+        self.mode = mode
+        self.chunkbytes = chunkbytes
+        self.zf = zipfile.ZipFile(filename, mode, compression=zipfile.ZIP_DEFLATED,
+                                  compresslevel=compresslevel, allowZip64=True)
+        self.cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.zf.close()
+
+    def names(self):
+        """Names of the arrays in the store."""
+        return [n[:-len('/meta.json')] for n in self.zf.namelist() if n.endswith('/meta.json')]
+
+    def __contains__(self, name):
+        return name + '/meta.json' in self.zf.namelist() or name + '.json' in self.zf.namelist()
+
+    def meta(self, name):
+        """Shape, type, and chunking of an array (and its attributes)."""
+        if name not in self.cache:
+            self.cache[name] = json.loads(self.zf.read(name + '/meta.json'))
+        return self.cache[name]
+
+    def write(self, name, data, attrs=None):
+        """Add an array to the store, chunk by chunk (data can be a view or a memory map)."""
+        if name in self:
+            raise ValueError('Product ' + name + ' already stored')
+        shape = np.shape(data)
+        dtype = np.asarray(data[:1] if len(shape) > 0 else data).dtype
+        if len(shape) == 0:
+            chunk = 1
+            self.writeArray(name + '/0.npy', np.asarray(data))
+        else:
+            rowbytes = max(1, int(np.prod(shape[1:])) * dtype.itemsize)
+            chunk = max(1, self.chunkbytes // rowbytes)
+            for i, k0 in enumerate(range(0, shape[0], chunk)):
+                self.writeArray(name + '/' + str(i) + '.npy', np.asarray(data[k0:k0 + chunk]))
+        meta = {'shape': list(shape), 'dtype': dtype.str, 'chunk': chunk, 'attrs': attrs or {}}
+        self.zf.writestr(name + '/meta.json', json.dumps(meta, default=jsonDefault))
+        self.cache[name] = meta
+
+    def writeArray(self, member, array):
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+        self.zf.writestr(member, buffer.getvalue())
+
+    def readChunk(self, name, i):
+        return np.load(io.BytesIO(self.zf.read(name + '/' + str(i) + '.npy')), allow_pickle=False)
+
+    def read(self, name, index=None):
+        """
+        Read an array, or part of it. The index selects along the first axis (an integer
+        or a slice), followed by optional indices of the other axes, e.g.
+            store.read('continuum', (slice(10, 20),))  channels 10 to 19
+            store.read('lines', (0, 2))                third plane of the first line
+        Only the chunks containing the selection are read.
+        """
+        meta = self.meta(name)
+        shape = meta['shape']
+        if len(shape) == 0:
+            return self.readChunk(name, 0)
+        if index is None:
+            index = (slice(None),)
+        elif not isinstance(index, tuple):
+            index = (index,)
+        first, rest = index[0], index[1:]
+        n = shape[0]
+        chunk = meta['chunk']
+        if isinstance(first, (int, np.integer)):
+            k = int(first) + n if first < 0 else int(first)
+            if not 0 <= k < n:
+                raise IndexError('index ' + str(first) + ' out of range for ' + name)
+            return self.readChunk(name, k // chunk)[(k % chunk,) + rest]
+        start, stop, step = first.indices(n)
+        rows = range(start, stop, step)
+        if len(rows) == 0:
+            return np.empty([0] + shape[1:], dtype=np.dtype(meta['dtype']))[(slice(None),) + rest]
+        c0 = min(rows[0], rows[-1]) // chunk
+        c1 = max(rows[0], rows[-1]) // chunk
+        block = np.concatenate([self.readChunk(name, i) for i in range(c0, c1 + 1)])
+        local = np.asarray(rows) - c0 * chunk
+        return block[(local,) + rest]
+
+    def attrs(self, name):
+        """Attributes of an array."""
+        return self.meta(name)['attrs']
+
+    def writeJSON(self, name, obj):
+        """Add a product which is not an array (dictionaries, lists, values)."""
+        if name in self:
+            raise ValueError('Product ' + name + ' already stored')
+        self.zf.writestr(name + '.json', json.dumps(obj, default=jsonDefault))
+
+    def readJSON(self, name):
+        return json.loads(self.zf.read(name + '.json'))
+
+
+def stackProducts(filenames, name, index=None):
+    """Stack the same product (or the same part of it) read from several stores."""
+    arrays = []
+    for filename in filenames:
+        with ProductStore(filename) as store:
+            arrays.append(store.read(name, index))
+    return np.stack(arrays)
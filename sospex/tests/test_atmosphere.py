@@ -0,0 +1,60 @@
+from sospex.atmosphere import shiftOperator, applyOperator
+import numpy as np
+
+def test_shift():
+    rng = np.random.default_rng(3)
+    nz, ny, nx = 50, 6, 7
+    x = np.linspace(157., 158., nz)
+    xr = x * (1 + 3.e-4)
+    atmed = rng.uniform(0.5, 1., nz)
+    cube = rng.normal(10., 1., (nz, ny, nx))
+    cube[20, 2, 3] = np.nan
+    cube[:, 4, 5] = np.nan
+    operator = shiftOperator(x, xr, atmed)
+    # A few rows at a time
+    corrected = applyOperator(operator, cube, chunksize=nz * nx * 8 * 2)
+    expected = np.empty_like(cube)
+    for j in range(ny):
+        for i in range(nx):
+            expected[:, j, i] = np.interp(x, xr, cube[:, j, i] / atmed)
+    assert np.allclose(corrected, expected, rtol=1.e-12, equal_nan=True)
+    # The undefined values propagate only to their neighbours
+    assert np.sum(np.isnan(corrected[:, 2, 3])) == np.sum(np.isnan(expected[:, 2, 3])) <= 2
+    # Into an existing array
+    out = np.empty_like(cube, dtype=np.float32)
+    assert applyOperator(operator, cube, out=out) is out
+    assert np.allclose(out, expected, rtol=1.e-6, equal_nan=True)
+
+def test_atran(tmp_path):
+    from sospex.atmosphere import AtranModel, atmosphericDepth
+    from astropy.io import fits
+    rng = np.random.default_rng(4)
+    wave = np.linspace(150., 160., 40)
+    altitudes = np.array([41000., 38000., 43000.])   # not sorted
+    wvzs = np.array([2., 5., 10., 20.])
+    atran = rng.uniform(0.3, 1., (3, 4, 40))
+    filename = str(tmp_path / 'AtranTest.fits')
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(wave, name='WAVELENGTH'),
+                  fits.ImageHDU(atran, name='ATRAN'), fits.ImageHDU(altitudes, name='ALTITUDE'),
+                  fits.ImageHDU(wvzs, name='WVZ')]).writeto(filename)
+    cachedir = tmp_path / 'cache'
+    model = AtranModel(filename, cachedir=str(cachedir))
+    assert sorted(f.name for f in cachedir.iterdir()) == sorted(
+        'AtranTest_' + name + '.npy' for name in ['WAVELENGTH', 'ATRAN', 'ALTITUDE', 'WVZ'])
+    # Grid nodes
+    for i, altitude in enumerate(altitudes):
+        for j, wvz in enumerate(wvzs):
+            assert np.allclose(model.transmission(altitude, wvz, 0.), atran[i, j])
+    depth = atmosphericDepth(40.)
+    assert np.allclose(model.transmission(38000., 5., 40.), atran[1, 1] ** depth)
+    # Linear interpolation between nodes, clipped outside the grid
+    expected = 0.5 * (atran[0, 2] + atran[0, 3])
+    assert np.allclose(model.transmission(41000., 15., 0.), expected)
+    assert np.allclose(model.transmission(50000., 1., 0.), atran[2, 0])
+    # Resampled on another wavelength grid
+    w = np.linspace(152., 158., 25)
+    assert np.allclose(model.transmission(43000., 10., 0., wave=w),
+                       np.interp(w, wave, atran[2, 2]))
+    # The cache is used by the next model
+    model = AtranModel(filename, cachedir=str(cachedir))
+    assert isinstance(model.atran, np.memmap)
@@ -0,0 +1,85 @@
+from sospex.binning import VoronoiBinning
+import numpy as np
+
+def test_target():
+    ny, nx = 30, 40
+    yy, xx = np.mgrid[:ny, :nx]
+    signal = 100 * np.exp(-((xx - 20)**2 + (yy - 15)**2) / (2 * 6**2)) + 1
+    noise = np.full((ny, nx), 2.)
+    signal[0, 0] = np.nan
+    binning = VoronoiBinning(signal, noise, 10.)
+    regions = binning.regions()
+    assert regions[0, 0] == -1
+    assert np.all(regions[binning.mask] >= 0)
+    npix = np.bincount(regions[regions >= 0], minlength=len(binning.sites))
+    sn = np.bincount(regions[regions >= 0], weights=signal[regions >= 0]) / np.sqrt(npix * 4.)
+    # Bins reach the target S/N (within the tolerance of the accretion)
+    assert np.mean(sn >= 8.) > 0.95
+    assert np.median(sn) >= 10.
+    # Pixels above the target are not binned, the faint ones are
+    assert np.all(npix[regions[signal / noise >= 20]] == 1)
+    assert np.all(npix[regions[(signal / noise < 1.) & binning.mask]] > 10)
+    # Target not reachable: a single bin
+    binning = VoronoiBinning(np.ones((5, 5)), np.ones((5, 5)), 100.)
+    assert len(binning.sites) == 1
+
+def test_cells():
+    from sospex.binning import CellSpectra
+    import warnings
+    rng = np.random.default_rng(6)
+    nz, ny, nx = 12, 8, 9
+    cube = rng.normal(3., 1., (nz, ny, nx))
+    cube[2, 1, 1] = np.nan
+    cube[:, 5, 6] = np.nan
+    continuum = rng.normal(1., 0.1, (nz, ny, nx))
+    labels = rng.integers(-1, 6, (ny, nx))
+    labels[labels == 4] = 5     # cell 4 is empty
+    mask = np.zeros((ny, nx), dtype=bool)
+    mask[3, :4] = True
+    # A few channels at a time
+    cells = CellSpectra(cube, labels, mask=mask, subtract=continuum, chunksize=3 * ny * nx * 8)
+    assert cells.ncells == 6
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for k in range(6):
+            # As done before for each cell
+            yy, xx = np.where((labels == k) & ~mask)
+            spectra = (cube - continuum)[:, yy, xx]
+            assert cells.npix[k] == len(yy)
+            assert np.allclose(cells.sum[:, k], np.nansum(spectra, axis=1))
+            assert np.array_equal(cells.count[:, k], np.sum(np.isfinite(spectra), axis=1))
+            assert np.allclose(cells.mean[:, k], np.nanmean(spectra, axis=1), equal_nan=True)
+            assert np.allclose(cells.variance[:, k], np.nanvar(spectra, axis=1), equal_nan=True)
+            assert np.allclose(cells.median[:, k], np.nanmedian(spectra, axis=1), equal_nan=True)
+    assert np.all(np.isnan(cells.mean[:, 4]))
+
+def test_regions():
+    from sospex.binning import updateRegions
+    from scipy.spatial import Voronoi, cKDTree
+    def neighbours(sites):
+        near = [set() for site in sites]
+        for i, j in Voronoi(sites).ridge_points:
+            near[i].add(j)
+            near[j].add(i)
+        return near
+    def nearest(sites):
+        yy, xx = np.mgrid[:40, :50]
+        return cKDTree(sites).query(np.c_[xx.ravel(), yy.ravel()])[1].reshape(40, 50)
+    rng = np.random.default_rng(7)
+    sites = rng.uniform(0, 50, (15, 2)) * [1, 0.8]
+    regions = nearest(sites)
+    old = neighbours(sites)
+    # Move a site
+    sites[4] = [25.3, 17.8]
+    regions = updateRegions(regions, sites, ('move', 4), neighbours(sites), old)
+    assert np.array_equal(regions, nearest(sites))
+    # Delete a site
+    old = neighbours(sites)
+    sites = np.delete(sites, 7, axis=0)
+    regions = updateRegions(regions, sites, ('delete', 7), neighbours(sites), old)
+    assert np.array_equal(regions, nearest(sites))
+    # Insert a site
+    old = neighbours(sites)
+    sites = np.insert(sites, 2, [10.2, 30.1], axis=0)
+    regions = updateRegions(regions, sites, ('insert', 2), neighbours(sites), old)
+    assert np.array_equal(regions, nearest(sites))
@@ -0,0 +1,27 @@
+from sospex.cache import ChannelCache
+import numpy as np
+
+def test_eviction():
+    cube = np.arange(10 * 4 * 5, dtype=np.float32).reshape(10, 4, 5)
+    loaded = []
+    def loader(key):
+        loaded.append(key)
+        return cube[key[1]]
+    # Budget of three planes
+    cache = ChannelCache(loader, budget=3 * cube[0].nbytes)
+    for n in range(3):
+        assert np.array_equal(cache.get(('Flux', n)), cube[n])
+    cache.get(('Flux', 0))     # plane 0 is now the most recently used
+    cache.prefetch(('Flux', 3))
+    assert ('Flux', 1) not in cache
+    assert all(('Flux', n) in cache for n in [0, 2, 3])
+    assert cache.nbytes == 3 * cube[0].nbytes
+    # Cached planes are not loaded again
+    cache.get(('Flux', 2))
+    assert loaded == [('Flux', 0), ('Flux', 1), ('Flux', 2), ('Flux', 3)]
+    # The last plane is kept even if larger than the budget
+    cache.budget = 1
+    cache.get(('Flux', 5))
+    assert list(cache.planes) == [('Flux', 5)]
+    cache.clear()
+    assert cache.nbytes == 0 and ('Flux', 5) not in cache
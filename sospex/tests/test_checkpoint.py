@@ -0,0 +1,34 @@
+from sospex.checkpoint import Checkpoint
+import numpy as np
+
+def test_restore(tmp_path):
+    filename = str(tmp_path / 'cube.fits.lines.ckpt')
+    key = {'task': 'lines', 'flux': '0a1b2c3d'}
+    lines = np.full((1, 7, 4, 5), np.nan)
+    noise = np.zeros((4, 5))
+    shown = []
+    checkpoint = Checkpoint(filename, key, interval=0., update=shown.append)
+    done = checkpoint.attach({'lines': lines, 'noise': noise})
+    assert not done.any()
+    points = np.array([[1, 2], [3, 0], [4, 3]])
+    for i, j in points[:2]:
+        lines[0, :, j, i] = i + j
+        noise[j, i] = 1.
+        checkpoint.mark((i, j))
+    assert len(shown) == 2
+    # New run with the same inputs: pixels done restored and skipped
+    lines2 = np.full((1, 7, 4, 5), np.nan)
+    noise2 = np.zeros((4, 5))
+    checkpoint = Checkpoint(filename, dict(key))
+    done = checkpoint.attach({'lines': lines2, 'noise': noise2})
+    assert np.sum(done) == 2
+    assert np.array_equal(lines2, lines, equal_nan=True)
+    assert np.array_equal(noise2, noise)
+    assert np.array_equal(checkpoint.pending(points), points[2:])
+    # Different inputs: nothing restored
+    checkpoint = Checkpoint(filename, {'task': 'lines', 'flux': 'ffffffff'})
+    done = checkpoint.attach({'lines': np.full((1, 7, 4, 5), np.nan), 'noise': np.zeros((4, 5))})
+    assert not done.any()
+    assert np.array_equal(checkpoint.pending(points), points)
+    checkpoint.remove()
+    assert not (tmp_path / 'cube.fits.lines.ckpt').exists()
@@ -0,0 +1,26 @@
+from sospex.specobj import CumulativeCube
+import numpy as np
+import warnings
+
+def test_bandaverage():
+    cube = np.random.rand(40, 6, 5).astype(np.float32)
+    cube[cube < 0.2] = np.nan
+    cube[:, 1, 2] = np.nan
+    # Small chunks to check the accumulation across chunks
+    cc = CumulativeCube(cube, chunksize=6 * 5 * 8 * 7)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        mean = np.nanmean(cube[5:31], axis=0)
+    assert np.allclose(cc.average(5, 31), mean, equal_nan=True)
+    assert np.allclose(cc.total(5, 31), np.nansum(cube[5:31], axis=0))
+
+def test_blocks():
+    cube = np.random.rand(70, 4, 3).astype(np.float32) + 1000.
+    cube[3:50, 2, 1] = np.nan
+    # Blocks of channels shorter than the chunks and not dividing the cube
+    cc = CumulativeCube(cube, block=8, chunksize=4 * 3 * 8 * 20)
+    # Single precision inside the blocks: error of the order of 1e-7 of the block sums
+    atol = 1e-6 * 8 * 1001.
+    for i0, i1 in [(0, 70), (7, 9), (8, 16), (13, 61), (69, 70), (20, 20)]:
+        total = np.nansum(cube[i0:i1].astype(np.float64), axis=0)
+        assert np.allclose(cc.total(i0, i1), total, rtol=0, atol=atol)
@@ -0,0 +1,41 @@
+from sospex.fitswriter import StreamedHDU, writeStreamed, compressionSupported
+from astropy.io import fits
+import numpy as np
+import pytest
+
+def streamedHDUs(flux, continuum, mask):
+    return [StreamedHDU(flux, header=fits.Header([('OBJECT', 'test')])),
+            StreamedHDU(flux, 'FLUX', 'Jy', subtract=continuum, scale=2., mask=mask, flip=True),
+            StreamedHDU(flux, 'VAR', power=2)]
+
+def checkFile(outfile, flux, continuum, mask):
+    expected = np.where(mask, np.nan, (flux - continuum) * 2.)[::-1]
+    with fits.open(outfile) as hdul:
+        assert hdul[0].header['OBJECT'] == 'test'
+        assert np.array_equal(hdul[0].data, flux)
+        assert hdul['FLUX'].header['BUNIT'] == 'Jy'
+        assert np.allclose(hdul['FLUX'].data, expected, equal_nan=True)
+        assert np.allclose(hdul['VAR'].data, flux ** 2)
+
+def test_streamed(tmp_path):
+    flux = np.random.rand(20, 6, 5).astype(np.float32)
+    continuum = np.random.rand(20, 6, 5).astype(np.float32)
+    mask = np.zeros((6, 5), dtype=bool)
+    mask[2, 3] = True
+    outfile = str(tmp_path / 'cube.fits')
+    # Small chunks to write each cube in several parts
+    writeStreamed(streamedHDUs(flux, continuum, mask), outfile, chunksize=6 * 5 * 4 * 3)
+    checkFile(outfile, flux, continuum, mask)
+    assert not (tmp_path / 'cube.fits.part').exists()
+
+def test_compressed(tmp_path):
+    if not compressionSupported():
+        pytest.skip('compression not available')
+    flux = np.random.rand(20, 6, 5).astype(np.float32)
+    continuum = np.random.rand(20, 6, 5).astype(np.float32)
+    mask = np.zeros((6, 5), dtype=bool)
+    outfile = str(tmp_path / 'cube.fits.fz')
+    writeStreamed(streamedHDUs(flux, continuum, mask), outfile, compression='GZIP_2')
+    with fits.open(outfile) as hdul:
+        assert isinstance(hdul['FLUX'], fits.CompImageHDU)
+    checkFile(outfile, flux, continuum, mask)
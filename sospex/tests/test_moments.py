@@ -0,0 +1,78 @@
+from sospex.moments import zeroMomentMap, integrateSpectra
+import numpy as np
+import warnings
+
+def test_zeromoment():
+    rng = np.random.default_rng(5)
+    nz, ny, nx = 30, 5, 6
+    w = np.linspace(157., 158., nz)
+    f = rng.normal(5., 1., (nz, ny, nx))
+    f[3, 1, 2] = np.nan
+    f[:, 4, 0] = np.nan
+    # Per spaxel, as done before
+    c = 299792458. # m/s
+    dw = np.concatenate([[w[1]-w[0]], (w[2:]-w[:-2])*0.5, [w[-1]-w[-2]]])
+    M0 = np.zeros((ny, nx))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for i in range(nx):
+            for j in range(ny):
+                Snu = f[:,j,i]
+                Slambda = c*(Snu-np.nanmedian(Snu))/(w*w)*1.e6
+                M0[j,i] = np.nansum(Slambda*dw)*1.e-26
+    # A few rows at a time
+    m0 = zeroMomentMap(f, w, chunksize=nz * nx * 8 * 2)
+    assert np.allclose(m0, M0, rtol=1.e-10, atol=1.e-30)
+    assert m0[4, 0] == 0
+    # Range of channels with a continuum cube
+    continuum = rng.normal(5., 0.1, (nz, ny, nx))
+    intensity = integrateSpectra(f, w, continuum=continuum, channels=(5, 20))
+    k = c / (w * w) * 1.e6 * dw * 1.e-26
+    expected = np.nansum((k[:, None, None] * (f - continuum))[5:20], axis=0)
+    assert np.allclose(intensity, expected, rtol=1.e-10, atol=1.e-30)
+
+def test_smooth():
+    from sospex.moments import smoothCube
+    rng = np.random.default_rng(8)
+    nz, ny, nx = 7, 6, 8
+    f = rng.normal(5., 1., (nz, ny, nx))
+    f[2, 3, 3] = np.nan
+    f[:, 1, 5] = np.nan
+    kernels = {5: (np.array([-1,0,0,0,1]), np.array([0,-1,0,1,0])),
+               9: (np.array([-1,-1,-1,0,0,0,1,1,1]), np.array([-1,0,1,-1,0,1,-1,0,1]))}
+    for kernel, (ik, jk) in kernels.items():
+        # A few channels at a time
+        smoothed = smoothCube(f, kernel, chunksize=2 * ny * nx * 8)
+        # Average over the kernel, as done before for each point
+        # (on the borders, only the pixels inside the image)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for j in range(ny):
+                for i in range(nx):
+                    inside = (j + ik >= 0) & (j + ik < ny) & (i + jk >= 0) & (i + jk < nx)
+                    expected = np.nanmean(f[:, j + ik[inside], i + jk[inside]], axis=1)
+                    assert np.allclose(smoothed[:, j, i], expected, equal_nan=True)
+    assert smoothCube(f, 1) is f
+
+def test_closest():
+    from sospex.moments import closestChannel, continuumAt
+    rng = np.random.default_rng(9)
+    w = np.sort(rng.uniform(150., 160., 40))
+    x = np.r_[rng.uniform(148., 162., 200), w[[0, 7, 39]], 0.5 * (w[10] + w[11])]
+    for grid in [w, w[::-1]]:
+        # As np.argmin, including the first channel in case of tie
+        expected = np.array([np.argmin(np.abs(v - grid)) for v in x])
+        assert np.array_equal(closestChannel(x, grid), expected)
+    # Continuum at the line centers
+    nz, ny, nx = 40, 3, 4
+    continuum = rng.normal(1., 0.1, (nz, ny, nx))
+    centers = rng.uniform(150., 160., (ny, nx))
+    centers[1, 2] = np.nan
+    c = continuumAt(centers, w, continuum=continuum)
+    for j in range(ny):
+        for i in range(nx):
+            if np.isfinite(centers[j, i]):
+                assert c[j, i] == continuum[np.argmin(np.abs(centers[j, i] - w)), j, i]
+    assert np.isnan(c[1, 2])
+    c = continuumAt(centers, intercept=2., slope=0.5, w0=155.)
+    assert np.allclose(c[0, 0], 2. + 0.5 * (centers[0, 0] - 155.)) and np.isnan(c[1, 2])
@@ -0,0 +1,37 @@
+from sospex.session import Session, arrayChecksum
+import numpy as np
+import os
+
+def test_checksum():
+    a = np.random.rand(30, 4, 5)
+    # Small chunks give the same checksum
+    assert arrayChecksum(a) == arrayChecksum(a, chunksize=4 * 5 * 8 * 7)
+    b = a.copy()
+    b[29, 3, 4] += 1
+    assert arrayChecksum(a) != arrayChecksum(b)
+
+def test_incremental(tmp_path):
+    directory = str(tmp_path / 'session')
+    session = Session(directory)
+    continuum = np.random.rand(10, 4, 5)
+    moments = np.random.rand(4, 5)
+    session.save({'continuum': continuum, 'M0': moments, 'lines': None}, {'band': 'Flux'})
+    files = dict(session.files)
+    # Nothing changed: nothing written
+    session.save({'continuum': continuum, 'M0': moments}, {'band': 'M0'})
+    assert session.files == files
+    # Modified in place (new version) or replaced: written in new files
+    moments[0, 0] = -1.
+    session.save({'continuum': continuum.copy(), 'M0': moments}, {'band': 'M0'}, {'M0': 1})
+    assert all(session.files[name] != files[name] for name in files)
+    assert sorted(os.listdir(directory)) == sorted(list(session.files.values()) + ['session.json'])
+    # Resumed session: memory-mapped arrays, copy-on-write
+    resumed = Session(directory)
+    state, arrays = resumed.load()
+    assert state['band'] == 'M0'
+    assert np.array_equal(arrays['M0'], moments)
+    assert np.array_equal(arrays['continuum'], continuum)
+    arrays['M0'][1, 1] = -2.
+    resumed.save(arrays, state)
+    state, arrays = Session(directory).load()
+    assert arrays['M0'][1, 1] == moments[1, 1]
@@ -0,0 +1,69 @@
+from sospex.specobj import MaskLayer
+import numpy as np
+
+def test_undo():
+    layer = MaskLayer((4, 5))
+    yy, xx = layer.set([0, 1, 1], [0, 2, 2])
+    assert sorted(zip(yy, xx)) == [(0, 0), (1, 2)]
+    assert layer.set([0], [0]) is None   # already masked: no modification
+    layer.set([1, 3], [2, 4])
+    assert layer.count == 3
+    first = layer.mask.copy()
+    version = layer.version
+    # Undo and redo the last modification
+    layer.undo()
+    assert layer.count == 2 and not layer.mask[3, 4] and layer.mask[1, 2]
+    assert layer.version > version
+    layer.undo()
+    assert layer.count == 0 and not layer.mask.any()
+    assert layer.undo() is None
+    layer.redo()
+    layer.redo()
+    assert np.array_equal(layer.mask, first) and layer.count == 3
+    assert layer.redo() is None
+    # A new modification discards the undone ones
+    layer.undo()
+    layer.set([0], [0], masked=False)
+    assert layer.redo() is None
+    assert layer.count == 1 and layer.mask[1, 2]
+    # Masked pixels are NaN in the images and skipped in the points
+    image = layer.image(np.ones((4, 5)))
+    assert np.isnan(image[1, 2]) and np.sum(np.isnan(image)) == 1
+    points = np.array([[2, 1], [0, 0], [4, 3]])
+    assert np.array_equal(layer.select(points), points[1:])
+
+def test_trimcrop():
+    from sospex.specobj import trimSpectralCube, cropSpectralCube
+    from astropy.wcs import WCS
+    from types import SimpleNamespace
+    nz, ny, nx = 20, 6, 8
+    w = WCS(naxis=2)
+    w.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    w.wcs.crval = [83.8, -5.4]
+    w.wcs.crpix = [4.5, 3.5]
+    w.wcs.cdelt = [-1. / 3600, 1. / 3600]
+    flux = np.arange(nz * ny * nx, dtype=float).reshape(nz, ny, nx)
+    crval3, cdelt3, crpix3 = 157., 0.01, 1.
+    wave = cdelt3 * (np.arange(nz) - crpix3 + 1) + crval3
+    cube = SimpleNamespace(flux=flux, eflux=flux * 0.1, exposure=np.ones_like(flux),
+                           wave=wave, atran=np.ones(nz), l0=157.1, crpix3=crpix3,
+                           wcs=w, x=np.arange(nx), y=np.arange(ny),
+                           mask=MaskLayer((ny, nx)))
+    cube.mask.set([1, 4], [2, 6])
+    trimSpectralCube(cube, 5, 15)
+    assert np.shape(cube.flux) == (10, ny, nx) and cube.nz == cube.n == 10
+    assert np.array_equal(cube.flux, flux[5:15]) and len(cube.atran) == 10
+    # The spectral axis from the header keywords is unchanged
+    assert np.allclose(cdelt3 * (np.arange(10) - cube.crpix3 + 1) + crval3, cube.wave)
+    assert cube.wave[cube.n0] == wave[10]
+    cropSpectralCube(cube, 1, 5, 2, 7)
+    assert (cube.nz, cube.ny, cube.nx) == (10, 4, 5)
+    assert np.array_equal(cube.flux, flux[5:15, 1:5, 2:7])
+    assert np.array_equal(cube.exposure, np.ones((10, 4, 5)))
+    assert np.array_equal(cube.x, np.arange(2, 7)) and np.array_equal(cube.y, np.arange(1, 5))
+    # Same sky positions of the pixels
+    assert np.allclose(cube.wcs.all_pix2world(0, 0, 0), w.all_pix2world(2, 1, 0))
+    assert len(cube.points) == 20 and np.array_equal(cube.points[6], [1, 1])
+    # Pixels masked in the cropped part
+    assert cube.mask.shape == (4, 5) and cube.mask.count == 2
+    assert cube.mask.mask[0, 0] and cube.mask.mask[3, 4]
@@ -0,0 +1,30 @@
+from sospex.store import ProductStore, stackProducts
+import numpy as np
+import pytest
+
+def test_read(tmp_path):
+    cube = np.random.rand(50, 4, 3)
+    lines = np.random.rand(2, 7, 4, 3)
+    outfile = str(tmp_path / 'products.zip')
+    # Small chunks to read across chunks
+    with ProductStore(outfile, 'w', chunkbytes=4 * 3 * 8 * 6) as store:
+        store.write('continuum', cube, {'unit': 'Jy'})
+        store.write('lines', lines)
+        store.write('ncells', np.int64(3))
+        store.writeJSON('guesses', {'model': 'Gaussian', 'x': [1, 2]})
+        with pytest.raises(ValueError):
+            store.write('lines', lines)
+    with ProductStore(outfile) as store:
+        assert sorted(store.names()) == ['continuum', 'lines', 'ncells']
+        assert store.attrs('continuum') == {'unit': 'Jy'}
+        assert np.array_equal(store.read('continuum'), cube)
+        assert np.array_equal(store.read('continuum', (slice(10, 20),)), cube[10:20])
+        assert np.array_equal(store.read('continuum', slice(45, 3, -7)), cube[45:3:-7])
+        assert np.array_equal(store.read('continuum', (-1, 2)), cube[-1, 2])
+        assert np.array_equal(store.read('lines', (0, 2)), lines[0, 2])
+        assert store.read('continuum', slice(5, 5)).shape == (0, 4, 3)
+        assert store.read('ncells') == 3
+        assert store.readJSON('guesses')['x'] == [1, 2]
+        with pytest.raises(IndexError):
+            store.read('continuum', 50)
+    assert np.array_equal(stackProducts([outfile, outfile], 'lines', (1,)), np.stack([lines[1]] * 2))
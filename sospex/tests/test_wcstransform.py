@@ -0,0 +1,74 @@
+from sospex.wcstransform import PixelTransform
+from astropy.wcs import WCS
+import numpy as np
+
+def makeWCS(crval, crpix, cdelt, ctype=('RA---TAN', 'DEC--TAN'), rotation=0.):
+    w = WCS(naxis=2)
+    w.wcs.ctype = list(ctype)
+    w.wcs.crval = crval
+    w.wcs.crpix = crpix
+    c, s = np.cos(np.radians(rotation)), np.sin(np.radians(rotation))
+    w.wcs.cd = np.array([[-cdelt * c, cdelt * s], [cdelt * s, cdelt * c]])
+    w.wcs.set()
+    return w
+
+def exact(wcs1, wcs2, x, y):
+    ra, dec = wcs1.all_pix2world(x, y, 0)
+    return wcs2.all_world2pix(ra, dec, 0)
+
+def test_affine():
+    wcs1 = makeWCS([83.8, -5.4], [20.5, 15.5], 1. / 3600)
+    wcs2 = makeWCS([83.8, -5.4], [101., 80.], 0.4 / 3600, rotation=30.)
+    transform = PixelTransform(wcs1, wcs2, shape=(30, 40))
+    assert transform.kind == 'affine'
+    x, y = np.meshgrid(np.linspace(-10, 50, 13), np.linspace(-10, 40, 11))
+    x2, y2 = transform(x, y)
+    xe, ye = exact(wcs1, wcs2, x, y)
+    assert np.max(np.hypot(x2 - xe, y2 - ye)) < 1.e-6
+
+def test_polynomial():
+    # Different tangent points and projections: approximated within the tolerance
+    wcs1 = makeWCS([83.8, -5.4], [20.5, 15.5], 6. / 3600)
+    wcs2 = makeWCS([83.9, -5.3], [50., 60.], 2. / 3600, ctype=('RA---SIN', 'DEC--SIN'))
+    transform = PixelTransform(wcs1, wcs2, shape=(30, 40), tolerance=0.01)
+    assert transform.kind == 'polynomial'
+    assert transform.error <= 0.01
+    rng = np.random.default_rng(1)
+    x = rng.uniform(-0.5, 39.5, 200)
+    y = rng.uniform(-0.5, 29.5, 200)
+    x2, y2 = transform(x, y)
+    xe, ye = exact(wcs1, wcs2, x, y)
+    assert np.max(np.hypot(x2 - xe, y2 - ye)) <= 0.01
+    # Outside the image the exact transformation is used
+    x2, y2 = transform(np.array([-20., 60.]), np.array([45., -8.]))
+    xe, ye = exact(wcs1, wcs2, np.array([-20., 60.]), np.array([45., -8.]))
+    assert np.allclose(x2, xe) and np.allclose(y2, ye)
+    # Scalars
+    xs, ys = transform(3., 4.)
+    assert isinstance(xs, float)
+    xe, ye = exact(wcs1, wcs2, 3., 4.)
+    assert np.hypot(xs - xe, ys - ye) <= 0.01
+
+def test_readout():
+    from sospex.wcstransform import SkyReadout
+    from astropy.coordinates import SkyCoord
+    import astropy.units as u
+    wcs = makeWCS([83.8, -5.4], [20.5, 15.5], 6. / 3600, ctype=('RA---SIN', 'DEC--SIN'),
+                  rotation=20.)
+    readout = SkyReadout(wcs, shape=(30, 40))
+    assert readout.grid is not None
+    rng = np.random.default_rng(2)
+    points = np.c_[rng.uniform(-0.5, 39.5, 300), rng.uniform(-0.5, 29.5, 300)]
+    # Outside the image the complete WCS is used
+    points = np.r_[points, [[-30., 12.], [80., 70.]]]
+    world = wcs.all_pix2world(points, 0)
+    radec = SkyCoord(world[:, 0] * u.deg, world[:, 1] * u.deg, frame='icrs')
+    ra, dec = np.array([readout(x, y) for x, y in points]).T
+    assert np.max(radec.separation(SkyCoord(ra * u.deg, dec * u.deg)).arcsec) < 1.e-3
+    # Same strings as the astropy formatting (but for rounding of values at a half digit)
+    same = 0
+    for (x, y), r, d in zip(points, radec.ra, radec.dec):
+        expected = '{:s} {:s} ({:4.0f},{:4.0f})'.format(r.to_string(u.hour, sep=':', precision=2),
+                                                        d.to_string(sep=':', precision=1), x, y)
+        same += readout.format(x, y) == expected
+    assert same >= len(points) - 3
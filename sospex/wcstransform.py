@@ -0,0 +1,236 @@
+import numpy as np
+import weakref
+
+
+def isLinear(wcs):
+    """Check if the celestial WCS is a TAN projection without distortions."""
+    try:
+        ctype = list(wcs.wcs.ctype)
+        return (ctype[0][-4:] == '-TAN' and ctype[1][-4:] == '-TAN'
+                and not wcs.has_distortion)
+    except BaseException:
+        return False
+
+
+class PixelTransform(object):
+    """
+    Transformation of pixel coordinates from the image with wcs1 to the image with wcs2.
+    Arguments:
+        wcs1, wcs2  celestial WCS of the two images
+        shape       shape (ny, nx) of the first image (domain of the approximation)
+        tolerance   maximum error (in pixels of the second image) of the approximation
+    If both WCS are linear TAN projections with the same tangent point, the transformation
+    is an exact affine one. Otherwise, a polynomial is fitted on a grid over the first
+    image and used if its error, verified on a denser grid, is below the tolerance.
+    Points outside the first image, or transformations which cannot be approximated,
+    are computed with the complete WCS.
+    """
+    def __init__(self, wcs1, wcs2, shape=None, tolerance=0.01):
+        self.wcs1 = wcs1
+        self.wcs2 = wcs2
+        self.tolerance = tolerance
+        self.kind = 'exact'
+        self.error = 0.
+        if self.sameTangentPlane():
+            self.setAffine()
+        elif shape is not None:
+            self.setPolynomial(shape)
+
+    def sameTangentPlane(self):
+        if not (isLinear(self.wcs1) and isLinear(self.wcs2)):
+            return False
+        w1 = self.wcs1.wcs
+        w2 = self.wcs2.wcs
+        return (list(w1.ctype) == list(w2.ctype)
+                and np.allclose(w1.crval, w2.crval, rtol=0, atol=1.e-10)
+                and np.allclose([w1.lonpole, w1.latpole], [w2.lonpole, w2.latpole],
+                                equal_nan=True))
+
+    def setAffine(self):
+        """Exact affine transformation between linear projections on the same plane."""
+        cd1 = self.wcs1.pixel_scale_matrix
+        cd2 = self.wcs2.pixel_scale_matrix
+        self.matrix = np.linalg.solve(cd2, cd1)
+        # 0-based pixel coordinates
+        crpix1 = self.wcs1.wcs.crpix - 1
+        crpix2 = self.wcs2.wcs.crpix - 1
+        self.offset = crpix2 - self.matrix @ crpix1
+        self.kind = 'affine'
+
+    def monomials(self, x, y):
+        u = (x - self.center[0]) / self.scale[0]
+        v = (y - self.center[1]) / self.scale[1]
+        return np.stack([u**i * v**(n - i) for n in range(self.degree + 1)
+                         for i in range(n + 1)], axis=-1)
+
+    def setPolynomial(self, shape, degrees=(3, 5)):
+        """Fit a polynomial on the image domain and verify its error."""
+        ny, nx = shape[-2:]
+        self.domain = (-0.5, nx - 0.5, -0.5, ny - 0.5)
+        self.center = ((nx - 1) * 0.5, (ny - 1) * 0.5)
+        self.scale = (max(nx, 2) * 0.5, max(ny, 2) * 0.5)
+        xg, yg = np.meshgrid(np.linspace(-0.5, nx - 0.5, 16), np.linspace(-0.5, ny - 0.5, 16))
+        xv, yv = np.meshgrid(np.linspace(-0.5, nx - 0.5, 31), np.linspace(-0.5, ny - 0.5, 31))
+        xg, yg, xv, yv = xg.ravel(), yg.ravel(), xv.ravel(), yv.ravel()
+        try:
+            xg2, yg2 = self.exact(xg, yg)
+            xv2, yv2 = self.exact(xv, yv)
+        except BaseException:
+            return
+        if not (np.all(np.isfinite(xg2 + yg2)) and np.all(np.isfinite(xv2 + yv2))):
+            return
+        for degree in degrees:
+            self.degree = degree
+            a = self.monomials(xg, yg)
+            self.coeffs, res, rank, sv = np.linalg.lstsq(a, np.c_[xg2, yg2], rcond=None)
+            p = self.monomials(xv, yv) @ self.coeffs
+            error = np.max(np.hypot(p[:, 0] - xv2, p[:, 1] - yv2))
+            if error <= self.tolerance:
+                self.kind = 'polynomial'
+                self.error = error
+                return
+
+    def exact(self, x, y):
+        ra, dec = self.wcs1.all_pix2world(x, y, 0)
+        return self.wcs2.all_world2pix(ra, dec, 0)
+
+    def __call__(self, x, y):
+        """Transform pixel coordinates (scalars or arrays)."""
+        scalar = np.isscalar(x) and np.isscalar(y)
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if self.kind == 'affine':
+            x2 = self.matrix[0, 0] * x + self.matrix[0, 1] * y + self.offset[0]
+            y2 = self.matrix[1, 0] * x + self.matrix[1, 1] * y + self.offset[1]
+        elif self.kind == 'polynomial':
+            x0, x1, y0, y1 = self.domain
+            inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+            p = self.monomials(x, y) @ self.coeffs
+            x2 = p[..., 0]
+            y2 = p[..., 1]
+            if not np.all(inside):
+                xe, ye = self.exact(x[~inside], y[~inside])
+                x2[~inside] = xe
+                y2[~inside] = ye
+        else:
+            x2, y2 = self.exact(x, y)
+        if scalar:
+            return float(x2), float(y2)
+        return x2, y2
+
+
+_transforms = {}
+
+def pixelTransform(wcs1, wcs2, shape=None):
+    """Return the cached transformation of pixels from wcs1 to wcs2."""
+    key = (id(wcs1), id(wcs2))
+    entry = _transforms.get(key)
+    if entry is not None and entry[0]() is wcs1 and entry[1]() is wcs2:
+        return entry[2]
+    if shape is None:
+        shape = wcs1.array_shape
+    transform = PixelTransform(wcs1, wcs2, shape)
+    try:
+        ref1 = weakref.ref(wcs1, lambda r, key=key: _transforms.pop(key, None))
+        ref2 = weakref.ref(wcs2, lambda r, key=key: _transforms.pop(key, None))
+    except TypeError:
+        return transform
+    _transforms[key] = (ref1, ref2, transform)
+    return transform
+
+def pix2pix(wcs1, wcs2, x, y, shape=None):
+    """Convert pixel coordinates of the image with wcs1 into those of the image with wcs2."""
+    if wcs1 is wcs2:
+        return x, y
+    return pixelTransform(wcs1, wcs2, shape)(x, y)
+
+
+def sexagesimal(value, precision=1):
+    """Format a value (degrees or hours) as d:mm:ss.s without astropy objects."""
+    sign = '-' if value < 0 else ''
+    scale = 10 ** precision
+    total = int(round(abs(value) * 3600 * scale))
+    seconds, fraction = divmod(total, scale)
+    minutes, seconds = divmod(seconds, 60)
+    degrees, minutes = divmod(minutes, 60)
+    if precision > 0:
+        return '{:s}{:d}:{:02d}:{:02d}.{:0{:d}d}'.format(sign, degrees, minutes, seconds,
+                                                       fraction, precision)
+    return '{:s}{:d}:{:02d}:{:02d}'.format(sign, degrees, minutes, seconds)
+
+
+class SkyReadout(object):
+    """
+    Fast conversion of pixel coordinates into sky coordinates for the cursor readout.
+    The world coordinates are computed on a grid of nodes over the image and
+    bilinearly interpolated. The grid is refined until the interpolation error,
+    verified at the centers of the cells, is below the tolerance (in arcsec).
+    Outside the image, or if the tolerance cannot be reached, the complete WCS is used.
+    """
+    def __init__(self, wcs, shape=None, tolerance=1.e-3):
+        self.wcs = wcs
+        self.grid = None
+        if shape is None:
+            shape = wcs.array_shape
+        if shape is None:
+            return
+        ny, nx = shape[-2:]
+        tolerance /= 3600.
+        for nodes in (33, 65, 129, 257):
+            if self.setGrid(nx, ny, min(nodes, nx + 1), min(nodes, ny + 1), tolerance):
+                break
+        else:
+            self.grid = None
+
+    def setGrid(self, nx, ny, mx, my, tolerance):
+        xg = np.linspace(-0.5, nx - 0.5, mx)
+        yg = np.linspace(-0.5, ny - 0.5, my)
+        try:
+            xx, yy = np.meshgrid(xg, yg)
+            ra, dec = self.wcs.all_pix2world(xx, yy, 0)
+            # Verify at the center of the cells
+            xc, yc = np.meshgrid(0.5 * (xg[1:] + xg[:-1]), 0.5 * (yg[1:] + yg[:-1]))
+            rac, decc = self.wcs.all_pix2world(xc, yc, 0)
+        except BaseException:
+            return False
+        if not (np.all(np.isfinite(ra + dec)) and np.all(np.isfinite(rac + decc))):
+            return False
+        # Avoid the discontinuity at RA = 0
+        ra0 = ra[my // 2, mx // 2]
+        ra = (ra - ra0 + 180.) % 360. - 180. + ra0
+        self.x0, self.dx = xg[0], xg[1] - xg[0]
+        self.y0, self.dy = yg[0], yg[1] - yg[0]
+        self.nx, self.ny = mx - 1, my - 1
+        # Nested lists are faster than arrays for scalar access
+        self.grid = (ra.tolist(), dec.tolist())
+        rai = 0.25 * (ra[1:, 1:] + ra[1:, :-1] + ra[:-1, 1:] + ra[:-1, :-1])
+        deci = 0.25 * (dec[1:, 1:] + dec[1:, :-1] + dec[:-1, 1:] + dec[:-1, :-1])
+        dra = ((rai - rac + 180.) % 360. - 180.) * np.cos(np.radians(decc))
+        self.error = np.max(np.hypot(dra, deci - decc)) * 3600.
+        return self.error <= tolerance * 3600.
+
+    def __call__(self, x, y):
+        """Sky coordinates (degrees) of a pixel."""
+        if self.grid is not None:
+            u = (x - self.x0) / self.dx
+            v = (y - self.y0) / self.dy
+            if 0 <= u <= self.nx and 0 <= v <= self.ny:
+                i = min(int(u), self.nx - 1)
+                j = min(int(v), self.ny - 1)
+                u -= i
+                v -= j
+                ra, dec = self.grid
+                w00 = (1 - u) * (1 - v); w10 = u * (1 - v); w01 = (1 - u) * v; w11 = u * v
+                r = (w00 * ra[j][i] + w10 * ra[j][i + 1] + w01 * ra[j + 1][i]
+                     + w11 * ra[j + 1][i + 1])
+                d = (w00 * dec[j][i] + w10 * dec[j][i + 1] + w01 * dec[j + 1][i]
+                     + w11 * dec[j + 1][i + 1])
+                return r % 360., d
+        world = self.wcs.all_pix2world(np.array([[x, y]], dtype=float), 0)
+        return float(world[0][0]) % 360., float(world[0][1])
+
+    def format(self, x, y):
+        """String with sexagesimal coordinates and pixel, as shown by the toolbar."""
+        ra, dec = self(x, y)
+        return '{:s} {:s} ({:4.0f},{:4.0f})'.format(sexagesimal(ra / 15., 2),
+                                                    sexagesimal(dec, 1), x, y)